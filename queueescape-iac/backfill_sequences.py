@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+One-off backfill for QueueEntries tickets created before per-queue sequence
+numbers. Those tickets have no `sequence` or `statusOrder`, so they are not
+on QueueStatusIndex (staff_next never calls them) or in the rank tree.
+
+Per queue, in joinTime order:
+  WAITING        takes the next sequence number and joins the index and the
+                 rank tree in one transaction, behind anyone already ranked
+  BEING_SERVED   takes a sequence number and joins the index; it has
+                 already left the line, so it also counts as a departure
+  COMPLETED      is archived (see queue_common.lifecycle)
+
+Run once right after deploying, with the same table environment variables as
+the Lambdas (QUEUE_ENTRIES_TABLE, QUEUE_STATS_TABLE, ...):
+
+    python backfill_sequences.py
+
+Safe to rerun: tickets that already have a sequence are skipped.
+"""
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lambda_src', 'common', 'python'))
+
+import boto3
+from boto3.dynamodb.conditions import Attr
+from queue_common import lifecycle, progress, ranks
+from queue_common.entries import status_order
+from queue_common.pagination import iter_items
+
+def _tables():
+    dynamodb = boto3.resource('dynamodb')
+    return (
+        dynamodb,
+        dynamodb.Table(os.environ['QUEUE_ENTRIES_TABLE']),
+        dynamodb.Table(os.environ['QUEUE_STATS_TABLE'])
+    )
+
+def _next_sequence(stats_table, queue_id):
+    response = stats_table.update_item(
+        Key={'queueId': queue_id},
+        UpdateExpression="ADD nextSequence :one",
+        ExpressionAttributeValues={':one': 1},
+        ReturnValues='UPDATED_NEW'
+    )
+    return int(response['Attributes']['nextSequence'])
+
+def _sequence_update(entries_table, ticket, status, sequence):
+    return {
+        'TableName': entries_table.name,
+        'Key': {'queueId': ticket['queueId'], 'ticketNumber': ticket['ticketNumber']},
+        'UpdateExpression': "SET #seq = :seq, statusOrder = :order",
+        'ConditionExpression': "attribute_not_exists(#seq) AND #s = :status",
+        'ExpressionAttributeNames': {'#seq': 'sequence', '#s': 'status'},
+        'ExpressionAttributeValues': {
+            ':seq': sequence,
+            ':order': status_order(status, sequence),
+            ':status': status
+        }
+    }
+
+def backfill_ticket(ticket):
+    """
+    Bring one legacy ticket onto the index. Returns True if it was changed.
+    """
+    dynamodb, entries_table, stats_table = _tables()
+    status = ticket['status']
+    if status == 'COMPLETED':
+        lifecycle.archive_ticket(ticket)
+        return True
+    if status not in ('WAITING', 'BEING_SERVED'):
+        print(f"Skipping {ticket['ticketNumber']} with unknown status {status}")
+        return False
+
+    queue_id = ticket['queueId']
+    sequence = _next_sequence(stats_table, queue_id)
+    update = _sequence_update(entries_table, ticket, status, sequence)
+    if status == 'WAITING':
+        if ranks.write_with_rank({'Update': update}, queue_id, sequence, 1):
+            return True
+    else:
+        try:
+            update.pop('TableName')
+            entries_table.update_item(**update)
+            progress.record_departure(queue_id)
+            return True
+        except dynamodb.meta.client.exceptions.ConditionalCheckFailedException:
+            pass
+    # Changed meanwhile (completed, or backfilled by a parallel run): the
+    # sequence number is spent, so count it as a departure to keep
+    # nextSequence - departures equal to the tickets waiting
+    progress.record_departure(queue_id)
+    return False
+
+def backfill():
+    """
+    Backfill every legacy ticket. Returns the number changed.
+    """
+    _, entries_table, _ = _tables()
+    legacy = list(iter_items(
+        entries_table.scan,
+        FilterExpression=Attr('sequence').not_exists()
+    ))
+    legacy.sort(key=lambda ticket: (ticket['queueId'], int(ticket.get('joinTime', 0))))
+    changed = sum(1 for ticket in legacy if backfill_ticket(ticket))
+    print(f"Backfilled {changed} of {len(legacy)} legacy tickets")
+    return changed
+
+if __name__ == '__main__':
+    backfill()
@@ -1,8 +1,10 @@
-# EventBridge rule to trigger notification lambda every 2 minutes
+# EventBridge rule to trigger notification lambda every 10 minutes.
+# Notifications are normally sent by QueueEventsLambda from the QueueEntries
+# stream; this sweep only catches anything the stream consumer missed.
 resource "aws_cloudwatch_event_rule" "notification_scheduler" {
   name                = "queueescape-notification-scheduler"
-  description         = "Trigger notification check every 2 minutes"
-  schedule_expression = "rate(2 minutes)"
+  description         = "Backstop notification check every 10 minutes"
+  schedule_expression = "rate(10 minutes)"
 
   tags = {
     Name = "queueescape-notification-scheduler"
@@ -19,6 +21,31 @@ resource "aws_lambda_permission" "allow_eventbridge" {
   statement_id  = "AllowExecutionFromEventBridge"
   action        = "lambda:InvokeFunction"
   function_name = aws_lambda_function.send_notifications.function_name
-    principal     = "events.amazonaws.com"
-    source_arn    = aws_cloudwatch_event_rule.notification_scheduler.arn
-}
\ No newline at end of file
+  principal     = "events.amazonaws.com"
+  source_arn    = aws_cloudwatch_event_rule.notification_scheduler.arn
+}
+
+# Copy email subscription confirmations into UserNotifications
+resource "aws_cloudwatch_event_rule" "subscription_sync" {
+  name                = "queueescape-subscription-sync"
+  description         = "Sync SNS subscription confirmations every 2 minutes"
+  schedule_expression = "rate(2 minutes)"
+
+  tags = {
+    Name = "queueescape-subscription-sync"
+  }
+}
+
+resource "aws_cloudwatch_event_target" "subscription_sync_lambda" {
+  rule      = aws_cloudwatch_event_rule.subscription_sync.name
+  target_id = "SyncSubscriptionsLambda"
+  arn       = aws_lambda_function.sync_subscriptions.arn
+}
+
+resource "aws_lambda_permission" "allow_eventbridge_subscription_sync" {
+  statement_id  = "AllowExecutionFromEventBridge"
+  action        = "lambda:InvokeFunction"
+  function_name = aws_lambda_function.sync_subscriptions.function_name
+  principal     = "events.amazonaws.com"
+  source_arn    = aws_cloudwatch_event_rule.subscription_sync.arn
+}
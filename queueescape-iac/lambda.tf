@@ -1,3 +1,30 @@
+# Third-party packages for the layer (tzdata: the Lambda runtime has no
+# zoneinfo database), installed next to queue_common before it is zipped
+resource "terraform_data" "queue_common_dependencies" {
+  triggers_replace = filesha1("${path.module}/lambda_src/common/requirements.txt")
+
+  provisioner "local-exec" {
+    command = "pip install --upgrade --target ${path.module}/lambda_src/common/python -r ${path.module}/lambda_src/common/requirements.txt"
+  }
+}
+
+# Shared helpers (queue_common package) published as a Lambda layer
+data "archive_file" "queue_common" {
+  type        = "zip"
+  source_dir  = "${path.module}/lambda_src/common"
+  output_path = "${path.module}/lambda_src/common.zip"
+  excludes    = ["requirements.txt"]
+
+  depends_on = [terraform_data.queue_common_dependencies]
+}
+
+resource "aws_lambda_layer_version" "queue_common" {
+  layer_name          = "queueescape-common"
+  filename            = data.archive_file.queue_common.output_path
+  source_code_hash    = data.archive_file.queue_common.output_base64sha256
+  compatible_runtimes = ["python3.12"]
+}
+
 data "archive_file" "join_queue" {
   type        = "zip"
   source_dir  = "${path.module}/lambda_src/join_queue"
@@ -40,13 +67,57 @@ data "archive_file" "send_notifications" {
   output_path = "${path.module}/lambda_src/send_notifications.zip"
 }
 
+data "archive_file" "notification_worker" {
+  type        = "zip"
+  source_dir  = "${path.module}/lambda_src/notification_worker"
+  output_path = "${path.module}/lambda_src/notification_worker.zip"
+}
+
+data "archive_file" "sync_subscriptions" {
+  type        = "zip"
+  source_dir  = "${path.module}/lambda_src/sync_subscriptions"
+  output_path = "${path.module}/lambda_src/sync_subscriptions.zip"
+}
+
+data "archive_file" "queue_events" {
+  type        = "zip"
+  source_dir  = "${path.module}/lambda_src/queue_events"
+  output_path = "${path.module}/lambda_src/queue_events.zip"
+}
+
+data "archive_file" "drain_outbox" {
+  type        = "zip"
+  source_dir  = "${path.module}/lambda_src/drain_outbox"
+  output_path = "${path.module}/lambda_src/drain_outbox.zip"
+}
+
 locals {
   lambda_env = {
-    QUEUE_ENTRIES_TABLE      = "QueueEntries"
-    QUEUE_STATS_TABLE        = "QueueStats"
-    USER_NOTIFICATIONS_TABLE = "UserNotifications"
-    ALERTS_TOPIC_ARN         = aws_sns_topic.alerts.arn
-    NOTIFICATION_THRESHOLDS  = "50,40,30,20,10,5,3,1"  # Configurable milestones
+    QUEUE_ENTRIES_TABLE               = "QueueEntries"
+    QUEUE_ARCHIVE_TABLE               = "QueueEntriesArchive"
+    ARCHIVE_RETENTION_DAYS            = "90"
+    QUEUE_STATS_TABLE                 = "QueueStats"
+    QUEUE_AGGREGATES_TABLE            = "QueueAggregates"
+    USER_NOTIFICATIONS_TABLE          = "UserNotifications"
+    NOTIFICATIONS_UNCONFIRMED_INDEX   = "UnconfirmedIndex"
+    EMAIL_SUBSCRIPTIONS_TABLE         = "EmailSubscriptions"
+    NOTIFICATION_OUTBOX_TABLE         = "NotificationOutbox"
+    OUTBOX_PENDING_INDEX              = "PendingIndex"
+    QUEUE_STATUS_INDEX                = "QueueStatusIndex"
+    ALERTS_TOPIC_ARN                  = aws_sns_topic.alerts.arn
+    USER_NOTIFICATIONS_TOPIC_ARN      = aws_sns_topic.user_notifications.arn
+    NOTIFICATION_THRESHOLDS           = "50,40,30,20,10,5,3,1"  # Configurable milestones
+    MIN_NOTIFICATION_INTERVAL_SECONDS = "60"
+    CONFIG_CACHE_TTL_SECONDS          = "30"
+    SERVICE_EWMA_ALPHA                = "0.2"
+    SKETCH_DECAY_SAMPLES              = "200"
+    DEFAULT_TIMEZONE                  = "America/New_York"
+    ETA_POSITIONS                     = "200"
+    ETA_MAX_AGE_SECONDS               = "900"
+    COUNTER_HEARTBEAT_SECONDS         = "1800"
+    PUBLISH_CONCURRENCY               = "8"
+    NOTIFICATION_WORK_QUEUE_URL       = aws_sqs_queue.notification_work.url
+    SCHEDULER_TIME_MARGIN_MS          = "10000"
   }
 }
 
@@ -55,6 +126,7 @@ resource "aws_lambda_function" "join_queue" {
   role          = var.lambda_execution_role_arn
   runtime       = "python3.12"
   handler       = "lambda_function.lambda_handler"
+  layers        = [aws_lambda_layer_version.queue_common.arn]
 
   filename         = data.archive_file.join_queue.output_path
   source_code_hash = data.archive_file.join_queue.output_base64sha256
@@ -83,6 +155,7 @@ resource "aws_lambda_function" "get_status" {
   role          = var.lambda_execution_role_arn
   runtime       = "python3.12"
   handler       = "lambda_function.lambda_handler"
+  layers        = [aws_lambda_layer_version.queue_common.arn]
 
   filename         = data.archive_file.get_status.output_path
   source_code_hash = data.archive_file.get_status.output_base64sha256
@@ -111,6 +184,7 @@ resource "aws_lambda_function" "get_summary" {
   role          = var.lambda_execution_role_arn
   runtime       = "python3.12"
   handler       = "lambda_function.lambda_handler"
+  layers        = [aws_lambda_layer_version.queue_common.arn]
 
   filename         = data.archive_file.get_summary.output_path
   source_code_hash = data.archive_file.get_summary.output_base64sha256
@@ -139,6 +213,7 @@ resource "aws_lambda_function" "staff_next" {
   role          = var.lambda_execution_role_arn
   runtime       = "python3.12"
   handler       = "lambda_function.lambda_handler"
+  layers        = [aws_lambda_layer_version.queue_common.arn]
 
   filename         = data.archive_file.staff_next.output_path
   source_code_hash = data.archive_file.staff_next.output_base64sha256
@@ -167,6 +242,7 @@ resource "aws_lambda_function" "staff_complete" {
   role          = var.lambda_execution_role_arn
   runtime       = "python3.12"
   handler       = "lambda_function.lambda_handler"
+  layers        = [aws_lambda_layer_version.queue_common.arn]
 
   filename         = data.archive_file.staff_complete.output_path
   source_code_hash = data.archive_file.staff_complete.output_base64sha256
@@ -195,6 +271,7 @@ resource "aws_lambda_function" "set_settings" {
   role          = var.lambda_execution_role_arn
   runtime       = "python3.12"
   handler       = "lambda_function.lambda_handler"
+  layers        = [aws_lambda_layer_version.queue_common.arn]
   filename      = data.archive_file.set_settings.output_path
   source_code_hash = data.archive_file.set_settings.output_base64sha256
 
@@ -218,12 +295,145 @@ resource "aws_lambda_function" "set_settings" {
 }
 
 resource "aws_lambda_function" "send_notifications" {
-  function_name = "SendNotificationsLambda"
+  function_name    = "SendNotificationsLambda"
+  role             = var.lambda_execution_role_arn
+  runtime          = "python3.12"
+  handler          = "lambda_function.lambda_handler"
+  layers           = [aws_lambda_layer_version.queue_common.arn]
+  filename         = data.archive_file.send_notifications.output_path
+  source_code_hash = data.archive_file.send_notifications.output_base64sha256
+
+  timeout     = 60
+  memory_size = 512
+
+  environment {
+    variables = merge(
+      local.lambda_env,
+      { LOG_LEVEL = "DEBUG" }
+    )
+  }
+
+  vpc_config {
+    subnet_ids = [
+      aws_subnet.private_a.id,
+      aws_subnet.private_b.id
+    ]
+    security_group_ids = [aws_security_group.lambda_sg.id]
+  }
+}
+
+resource "aws_lambda_function" "notification_worker" {
+  function_name = "NotificationWorkerLambda"
   role          = var.lambda_execution_role_arn
   runtime       = "python3.12"
   handler       = "lambda_function.lambda_handler"
-  filename      = data.archive_file.send_notifications.output_path
-  source_code_hash = data.archive_file.send_notifications.output_base64sha256
+  layers        = [aws_lambda_layer_version.queue_common.arn]
+  filename      = data.archive_file.notification_worker.output_path
+  source_code_hash = data.archive_file.notification_worker.output_base64sha256
+
+  timeout = 60
+  memory_size = 512
+
+  environment {
+    variables = merge(
+      local.lambda_env,
+      { LOG_LEVEL = "DEBUG" }
+    )
+  }
+
+  vpc_config {
+    subnet_ids = [
+      aws_subnet.private_a.id,
+      aws_subnet.private_b.id
+    ]
+    security_group_ids = [aws_security_group.lambda_sg.id]
+  }
+}
+
+# One queue per invocation, so every queue gets its own worker
+resource "aws_lambda_event_source_mapping" "notification_work_queue" {
+  event_source_arn = aws_sqs_queue.notification_work.arn
+  function_name    = aws_lambda_function.notification_worker.arn
+  batch_size       = 1
+}
+
+resource "aws_lambda_function" "sync_subscriptions" {
+  function_name = "SyncSubscriptionsLambda"
+  role          = var.lambda_execution_role_arn
+  runtime       = "python3.12"
+  handler       = "lambda_function.lambda_handler"
+  layers        = [aws_lambda_layer_version.queue_common.arn]
+  filename      = data.archive_file.sync_subscriptions.output_path
+  source_code_hash = data.archive_file.sync_subscriptions.output_base64sha256
+
+  timeout = 60
+  memory_size = 512
+
+  environment {
+    variables = merge(
+      local.lambda_env,
+      { LOG_LEVEL = "DEBUG" }
+    )
+  }
+
+  vpc_config {
+    subnet_ids = [
+      aws_subnet.private_a.id,
+      aws_subnet.private_b.id
+    ]
+    security_group_ids = [aws_security_group.lambda_sg.id]
+  }
+}
+
+resource "aws_lambda_function" "queue_events" {
+  function_name = "QueueEventsLambda"
+  role          = var.lambda_execution_role_arn
+  runtime       = "python3.12"
+  handler       = "lambda_function.lambda_handler"
+  layers        = [aws_lambda_layer_version.queue_common.arn]
+  filename      = data.archive_file.queue_events.output_path
+  source_code_hash = data.archive_file.queue_events.output_base64sha256
+
+  timeout = 60
+  memory_size = 512
+
+  environment {
+    variables = merge(
+      local.lambda_env,
+      { LOG_LEVEL = "DEBUG" }
+    )
+  }
+
+  vpc_config {
+    subnet_ids = [
+      aws_subnet.private_a.id,
+      aws_subnet.private_b.id
+    ]
+    security_group_ids = [aws_security_group.lambda_sg.id]
+  }
+}
+
+# Re-evaluate notifications within seconds of a queue changing
+resource "aws_lambda_event_source_mapping" "queue_entries_stream" {
+  event_source_arn                   = aws_dynamodb_table.queue_entries.stream_arn
+  function_name                      = aws_lambda_function.queue_events.arn
+  starting_position                  = "LATEST"
+  batch_size                         = 100
+  maximum_batching_window_in_seconds = 1
+  maximum_retry_attempts             = 3
+
+  # Only records whose subscription update failed are retried
+  function_response_types = ["ReportBatchItemFailures"]
+}
+
+resource "aws_lambda_function" "drain_outbox" {
+  function_name = "DrainOutboxLambda"
+  role          = var.lambda_execution_role_arn
+  runtime       = "python3.12"
+  handler       = "lambda_function.lambda_handler"
+  layers        = [aws_lambda_layer_version.queue_common.arn]
+  filename      = data.archive_file.drain_outbox.output_path
+  source_code_hash = data.archive_file.drain_outbox.output_base64sha256
 
   timeout = 60
   memory_size = 512
@@ -242,4 +452,20 @@ resource "aws_lambda_function" "send_notifications" {
     ]
     security_group_ids = [aws_security_group.lambda_sg.id]
   }
-}
\ No newline at end of file
+}
+
+# Deliver new outbox rows as soon as they are written
+resource "aws_lambda_event_source_mapping" "notification_outbox_stream" {
+  event_source_arn                   = aws_dynamodb_table.notification_outbox.stream_arn
+  function_name                      = aws_lambda_function.drain_outbox.arn
+  starting_position                  = "LATEST"
+  batch_size                         = 100
+  maximum_batching_window_in_seconds = 1
+  maximum_retry_attempts             = 3
+
+  filter_criteria {
+    filter {
+      pattern = jsonencode({ eventName = ["INSERT"] })
+    }
+  }
+}
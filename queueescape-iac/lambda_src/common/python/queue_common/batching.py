@@ -0,0 +1,42 @@
+"""
+BatchGetItem helper: fetches many items in chunks of 100 keys
+(the DynamoDB limit) and retries UnprocessedKeys with backoff.
+"""
+import boto3
+import time
+
+BATCH_GET_LIMIT = 100
+MAX_ATTEMPTS = 5
+
+dynamodb = boto3.resource('dynamodb')
+
+def _chunks(keys, size):
+    for i in range(0, len(keys), size):
+        yield keys[i:i + size]
+
+def batch_get(table, keys, projection=None):
+    """
+    Fetch the items for keys from table. Missing items are simply absent
+    from the result; order is not preserved.
+    projection: optional list of attribute names to return.
+    """
+    request = {}
+    if projection:
+        names = {f"#p{i}": attribute for i, attribute in enumerate(projection)}
+        request['ProjectionExpression'] = ", ".join(names)
+        request['ExpressionAttributeNames'] = names
+
+    items = []
+    for chunk in _chunks(list(keys), BATCH_GET_LIMIT):
+        request_items = {table.name: dict(request, Keys=chunk)}
+        for attempt in range(MAX_ATTEMPTS):
+            response = dynamodb.batch_get_item(RequestItems=request_items)
+            items.extend(response['Responses'].get(table.name, []))
+            request_items = response.get('UnprocessedKeys')
+            if not request_items:
+                break
+            time.sleep(0.05 * (2 ** attempt))
+        else:
+            unprocessed = len(request_items[table.name]['Keys'])
+            print(f"Gave up on {unprocessed} unprocessed keys from {table.name}")
+    return items
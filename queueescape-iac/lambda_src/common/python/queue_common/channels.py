@@ -0,0 +1,120 @@
+"""
+Notification channel: every customer is subscribed to one shared SNS topic
+with a filter policy on their ticketNumbers, and each publish carries a
+ticketNumber message attribute, so only that customer receives it.
+No per-ticket topics are created. SNS allows one subscription per email
+address on the topic; subscriptions.py keeps its filter in step with the
+address's live tickets.
+
+Bulk sends go out as PublishBatch calls (up to 10 messages each) on a
+bounded thread pool that shares one pooled, thread-safe SNS client.
+"""
+import boto3
+import json
+import os
+from botocore.config import Config
+from concurrent.futures import ThreadPoolExecutor
+
+TOPIC_ARN = os.environ.get('USER_NOTIFICATIONS_TOPIC_ARN')
+PUBLISH_BATCH_SIZE = 10  # SNS PublishBatch limit
+PUBLISH_CONCURRENCY = int(os.environ.get('PUBLISH_CONCURRENCY', '8'))
+
+# How SNS lists a subscription whose email link has not been clicked yet
+PENDING_CONFIRMATION = 'PendingConfirmation'
+
+sns = boto3.client('sns', config=Config(max_pool_connections=PUBLISH_CONCURRENCY))
+
+def _ticket_attribute(ticket_number):
+    return {'ticketNumber': {'DataType': 'String', 'StringValue': ticket_number}}
+
+def _filter_policy(ticket_numbers):
+    return json.dumps({'ticketNumber': sorted(ticket_numbers)})
+
+def subscribe(email, ticket_numbers):
+    """
+    Subscribe an email address to these tickets' messages. SNS sends the
+    confirmation email. If the address is already subscribed its existing
+    subscription is reused and its filter replaced. Returns the
+    subscription ARN.
+    """
+    try:
+        response = sns.subscribe(
+            TopicArn=TOPIC_ARN,
+            Protocol='email',
+            Endpoint=email,
+            Attributes={'FilterPolicy': _filter_policy(ticket_numbers)},
+            ReturnSubscriptionArn=True
+        )
+        return response['SubscriptionArn']
+    except sns.exceptions.InvalidParameterException:
+        # "Subscription already exists with different attributes"
+        response = sns.subscribe(TopicArn=TOPIC_ARN, Protocol='email', Endpoint=email, ReturnSubscriptionArn=True)
+        set_ticket_filter(response['SubscriptionArn'], ticket_numbers)
+        return response['SubscriptionArn']
+
+def set_ticket_filter(subscription_arn, ticket_numbers):
+    """
+    Deliver only these tickets' messages to the subscription.
+    """
+    sns.set_subscription_attributes(
+        SubscriptionArn=subscription_arn,
+        AttributeName='FilterPolicy',
+        AttributeValue=_filter_policy(ticket_numbers)
+    )
+
+def unsubscribe(subscription_arn):
+    try:
+        sns.unsubscribe(SubscriptionArn=subscription_arn)
+    except Exception as e:
+        # Still pending confirmation, or already removed by the user
+        print(f"Could not unsubscribe {subscription_arn}: {e}")
+
+def confirmed_subscription_arns():
+    """
+    ARNs of every confirmed subscription on the shared topic, read page by page.
+    """
+    confirmed = set()
+    for page in sns.get_paginator('list_subscriptions_by_topic').paginate(TopicArn=TOPIC_ARN):
+        for subscription in page['Subscriptions']:
+            if subscription['SubscriptionArn'] != PENDING_CONFIRMATION:
+                confirmed.add(subscription['SubscriptionArn'])
+    return confirmed
+
+def _publish_batch(batch):
+    entries = [
+        {
+            'Id': message_id,
+            'Subject': subject,
+            'Message': message,
+            'MessageAttributes': _ticket_attribute(ticket_number)
+        }
+        for message_id, ticket_number, subject, message in batch
+    ]
+    try:
+        response = sns.publish_batch(TopicArn=TOPIC_ARN, PublishBatchRequestEntries=entries)
+    except Exception as e:
+        print(f"Error publishing batch of {len(entries)}: {e}")
+        return set()
+    
+    for failure in response.get('Failed', []):
+        print(f"Error sending notification for {failure['Id']}: {failure.get('Message', failure['Code'])}")
+    return {entry['Id'] for entry in response.get('Successful', [])}
+
+def publish_many(notifications):
+    """
+    Send (message_id, ticket_number, subject, message) notifications.
+    message_id must be unique within the call (letters, digits, - and _).
+    Returns the set of message ids that were delivered.
+    """
+    batches = [
+        notifications[i:i + PUBLISH_BATCH_SIZE]
+        for i in range(0, len(notifications), PUBLISH_BATCH_SIZE)
+    ]
+    if not batches:
+        return set()
+    
+    delivered = set()
+    with ThreadPoolExecutor(max_workers=min(PUBLISH_CONCURRENCY, len(batches))) as pool:
+        for sent in pool.map(_publish_batch, batches):
+            delivered.update(sent)
+    return delivered
@@ -0,0 +1,89 @@
+"""
+Cache of QueueStats items (staff settings) per queue.
+Lives at module level, so it is shared by every call within an invocation
+and survives across warm invocations of the same container for
+CONFIG_CACHE_TTL_SECONDS. The cache is TTL-bounded only: a settings change
+made by another Lambda (set_settings) is seen once the cached item expires,
+up to CONFIG_CACHE_TTL_SECONDS later. Handlers that already get a fresh
+QueueStats item back from a write pass it to observe(), which refreshes
+their own container straight away; configVersion (bumped by set_settings)
+keeps an item from an earlier write from replacing a later one.
+
+Only use the settings (config_*, notification_thresholds, ...) from these
+items: counters such as nextSequence are stale by design.
+
+The queue's precomputed ETA vectors (eta.py) live on their own
+QueueAggregates item, "{queueId}#eta", and are cached the same way by
+get_queue_eta(); etaRefreshedAt orders the items observed.
+"""
+import boto3
+import os
+import time
+
+CONFIG_TTL_SECONDS = int(os.environ.get('CONFIG_CACHE_TTL_SECONDS', '30'))
+
+dynamodb = boto3.resource('dynamodb')
+stats_table = dynamodb.Table(os.environ['QUEUE_STATS_TABLE'])
+aggregates_table = dynamodb.Table(os.environ['QUEUE_AGGREGATES_TABLE'])
+
+_cache = {}  # queueId -> (fetched_at, item)
+_eta_cache = {}  # queueId -> (fetched_at, item)
+
+def _version(item):
+    return int(item.get('configVersion', 0))
+
+def _eta_version(item):
+    return int(item.get('etaRefreshedAt', 0))
+
+def eta_key(queue_id):
+    return f"{queue_id}#eta"
+
+def get_queue_config(queue_id):
+    """
+    The QueueStats item for this queue ({} if none), read at most once per TTL.
+    """
+    now = time.monotonic()
+    entry = _cache.get(queue_id)
+    if entry and now - entry[0] < CONFIG_TTL_SECONDS:
+        return entry[1]
+
+    item = stats_table.get_item(Key={'queueId': queue_id}).get('Item', {})
+    _cache[queue_id] = (now, item)
+    return item
+
+def observe(queue_id, item):
+    """
+    Offer a QueueStats item just returned by a write (ReturnValues='ALL_NEW').
+    Kept if it is at least as new as the cached one.
+    """
+    entry = _cache.get(queue_id)
+    if entry and _version(entry[1]) > _version(item):
+        return
+    _cache[queue_id] = (time.monotonic(), item)
+
+def get_queue_eta(queue_id):
+    """
+    The queue's ETA item ({} if never refreshed), read at most once per TTL.
+    """
+    now = time.monotonic()
+    entry = _eta_cache.get(queue_id)
+    if entry and now - entry[0] < CONFIG_TTL_SECONDS:
+        return entry[1]
+
+    item = aggregates_table.get_item(Key={'aggregateId': eta_key(queue_id)}).get('Item', {})
+    _eta_cache[queue_id] = (now, item)
+    return item
+
+def observe_eta(queue_id, item):
+    """
+    Offer an ETA item just written by eta.refresh(). Kept if it is at least
+    as new as the cached one.
+    """
+    entry = _eta_cache.get(queue_id)
+    if entry and _eta_version(entry[1]) > _eta_version(item):
+        return
+    _eta_cache[queue_id] = (time.monotonic(), item)
+
+def clear():
+    _cache.clear()
+    _eta_cache.clear()
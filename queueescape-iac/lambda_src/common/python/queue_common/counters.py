@@ -0,0 +1,75 @@
+"""
+Active service counters per queue. Each staff_next call heartbeats the
+calling counter on the queue's "{queueId}#counters" QueueAggregates item: one
+attribute per counter, "counter_{counterId}", holding the time its heartbeat
+expires. A counter that has not called anyone for COUNTER_HEARTBEAT_SECONDS
+no longer counts, and the next heartbeat removes its attribute, so the item
+only holds recently active counters.
+"""
+import boto3
+import os
+import re
+import time
+
+COUNTER_HEARTBEAT_SECONDS = int(os.environ.get('COUNTER_HEARTBEAT_SECONDS', '1800'))
+DEFAULT_COUNTER_ID = 'default'
+COUNTER_ID_PATTERN = re.compile(r'[A-Za-z0-9_-]{1,64}')
+ATTRIBUTE_PREFIX = 'counter_'
+
+dynamodb = boto3.resource('dynamodb')
+aggregates_table = dynamodb.Table(os.environ['QUEUE_AGGREGATES_TABLE'])
+
+def _counters_key(queue_id):
+    return f"{queue_id}#counters"
+
+def is_valid(counter_id):
+    return isinstance(counter_id, str) and COUNTER_ID_PATTERN.fullmatch(counter_id) is not None
+
+def _expired(item, now):
+    return [
+        name for name, expires in item.items()
+        if name.startswith(ATTRIBUTE_PREFIX) and expires <= now
+    ]
+
+def heartbeat(queue_id, counter_id):
+    """
+    Mark a counter (see is_valid) as serving this queue for the next
+    COUNTER_HEARTBEAT_SECONDS, and drop counters whose heartbeat expired.
+    """
+    now = int(time.time())
+    item = aggregates_table.update_item(
+        Key={'aggregateId': _counters_key(queue_id)},
+        UpdateExpression="SET #c = :expires",
+        ExpressionAttributeNames={'#c': ATTRIBUTE_PREFIX + counter_id},
+        ExpressionAttributeValues={':expires': now + COUNTER_HEARTBEAT_SECONDS},
+        ReturnValues='ALL_NEW'
+    )['Attributes']
+
+    expired = _expired(item, now)
+    if not expired:
+        return
+    names = {f"#e{i}": name for i, name in enumerate(expired)}
+    try:
+        aggregates_table.update_item(
+            Key={'aggregateId': _counters_key(queue_id)},
+            UpdateExpression="REMOVE " + ", ".join(names),
+            # Unless one of them heartbeated meanwhile
+            ConditionExpression=" AND ".join(f"{alias} <= :now" for alias in names),
+            ExpressionAttributeNames=names,
+            ExpressionAttributeValues={':now': now}
+        )
+    except dynamodb.meta.client.exceptions.ConditionalCheckFailedException:
+        pass
+
+def active_count(queue_id):
+    """
+    Number of counters with a live heartbeat; at least 1, so a queue nobody
+    has served yet is estimated as a single counter.
+    """
+    item = aggregates_table.get_item(Key={'aggregateId': _counters_key(queue_id)}).get('Item', {})
+    now = time.time()
+    active = [
+        name for name, expires in item.items()
+        if name.startswith(ATTRIBUTE_PREFIX) and expires > now
+    ]
+    return max(1, len(active))
@@ -0,0 +1,14 @@
+"""
+Helpers for reading and writing QueueEntries items.
+Shipped to every Lambda through the queueescape-common layer.
+"""
+import os
+
+STATUS_INDEX = os.environ.get('QUEUE_STATUS_INDEX', 'QueueStatusIndex')
+
+def status_order(status, sequence):
+    """
+    Sort key for QueueStatusIndex: the status, then the ticket's per-queue
+    sequence number zero-padded so that string order matches join order.
+    """
+    return f"{status}#{int(sequence):020d}"
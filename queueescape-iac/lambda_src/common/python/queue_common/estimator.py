@@ -0,0 +1,100 @@
+"""
+Measured service time per queue. When staff complete a ticket that was
+being served, its service duration (servedAt -> completedAt) is folded into
+an exponentially weighted moving average for the local hour of day (in
+the queue's timezone, see timezones.py) it was served in, kept on the
+queue's QueueStats item as serviceMinutesH00..H23.
+Readers take the bucket for the current hour from the (cached) QueueStats
+item: one number, no extra reads. The same durations also feed the
+per-hour quantile sketch (sketch.py) behind the p50/p90 ETAs.
+
+Until an hour bucket has data, the staff peak-window setting is used as the
+prior (PEAK_MINUTES inside the window, DEFAULT_MINUTES outside).
+"""
+import boto3
+import os
+from decimal import Decimal
+from queue_common import config_cache, sketch
+from queue_common.timezones import local_hour
+
+EWMA_ALPHA = float(os.environ.get('SERVICE_EWMA_ALPHA', '0.2'))
+DEFAULT_MINUTES = 5
+PEAK_MINUTES = 15
+# Longer than this is a ticket staff forgot to complete, not a service time
+MAX_SERVICE_MINUTES = 240
+MAX_UPDATE_ATTEMPTS = 3
+
+dynamodb = boto3.resource('dynamodb')
+stats_table = dynamodb.Table(os.environ['QUEUE_STATS_TABLE'])
+
+def _attribute(hour):
+    return f"serviceMinutesH{hour:02d}"
+
+def default_minutes(config, hour):
+    """
+    Prior from the staff settings: slower inside the peak window.
+    """
+    start_hour = int(config.get('config_start_hour', 17))
+    end_hour = int(config.get('config_end_hour', 22))
+    if config and start_hour <= hour < end_hour:
+        return PEAK_MINUTES
+    return DEFAULT_MINUTES
+
+def minutes_per_person(config, hour=None):
+    """
+    Expected service minutes per person for the queue's QueueStats item,
+    for the given local hour (default: now).
+    Returns (minutes, measured).
+    """
+    if hour is None:
+        hour = local_hour(config)
+    measured = config.get(_attribute(hour))
+    if measured is not None:
+        return float(measured), True
+    return default_minutes(config, hour), False
+
+def record_service(queue_id, served_at, completed_at):
+    """
+    Fold one service duration into the queue's EWMA and quantile sketch for
+    the hour it was served in. The EWMA uses an optimistic conditional write
+    so concurrent completions do not overwrite each other.
+    """
+    minutes = (int(completed_at) - int(served_at)) / 60
+    if minutes < 0 or minutes > MAX_SERVICE_MINUTES:
+        return
+    hour = local_hour(config_cache.get_queue_config(queue_id), int(served_at))
+    sketch.add(queue_id, hour, minutes)
+    attribute = _attribute(hour)
+
+    for _ in range(MAX_UPDATE_ATTEMPTS):
+        current = stats_table.get_item(
+            Key={'queueId': queue_id},
+            ProjectionExpression='#a',
+            ExpressionAttributeNames={'#a': attribute},
+            ConsistentRead=True
+        ).get('Item', {}).get(attribute)
+
+        if current is None:
+            updated = minutes
+            condition = "attribute_not_exists(#a)"
+            values = {}
+        else:
+            updated = EWMA_ALPHA * minutes + (1 - EWMA_ALPHA) * float(current)
+            condition = "#a = :old"
+            values = {':old': current}
+
+        values[':new'] = Decimal(str(round(updated, 3)))
+        try:
+            stats_table.update_item(
+                Key={'queueId': queue_id},
+                UpdateExpression="SET #a = :new",
+                ConditionExpression=condition,
+                ExpressionAttributeNames={'#a': attribute},
+                ExpressionAttributeValues=values
+            )
+            return
+        except dynamodb.meta.client.exceptions.ConditionalCheckFailedException:
+            # Another completion updated the bucket first; re-read and retry
+            continue
+
+    print(f"Gave up updating {attribute} for {queue_id}")
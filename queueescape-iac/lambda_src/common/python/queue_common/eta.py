@@ -0,0 +1,155 @@
+"""
+Precomputed ETAs per queue. refresh() runs off the request path (the
+QueueEntries stream consumer and the notification worker) and writes the
+queue's ETA vectors to their own QueueAggregates item, "{queueId}#eta":
+
+    etaMinutes      expected wait in minutes for positions 0..ETA_POSITIONS-1
+    etaP50Minutes   median wait per position
+    etaP90Minutes   90th percentile wait per position
+    etaStep         minutes added per position past the end of the vectors
+    etaServiceMinutes, etaMeasured
+                    minutes per person, and whether that was measured
+    etaServers      active counters the estimate assumes
+    etaRefreshedAt  when it was computed (also copied to QueueStats for
+                    the scheduler's staleness check)
+
+The vectors are a few KB, so they are kept off the QueueStats item that
+every join, next and complete writes to: DynamoDB bills a write for the
+size of the whole item.
+
+With c counters busy, the line moves one place each time any of them
+finishes, so (M/M/c style) each position ahead costs service time / c.
+
+Readers get the ETA item through config_cache (TTL-bounded, like the
+settings), so a lookup is a list index: the estimator's work is paid once
+per refresh, not once per poll.
+"""
+import boto3
+import math
+import os
+import time
+from decimal import Decimal
+from queue_common import config_cache, counters, estimator, sketch
+
+ETA_POSITIONS = int(os.environ.get('ETA_POSITIONS', '200'))
+# Refresh an idle queue's vector at least this often (hour-of-day buckets)
+ETA_MAX_AGE_SECONDS = int(os.environ.get('ETA_MAX_AGE_SECONDS', '900'))
+# Standard normal quantile for each percentile vector
+NORMAL_QUANTILES = {0.5: 0.0, 0.9: 1.2816}
+
+dynamodb = boto3.resource('dynamodb')
+stats_table = dynamodb.Table(os.environ['QUEUE_STATS_TABLE'])
+aggregates_table = dynamodb.Table(os.environ['QUEUE_AGGREGATES_TABLE'])
+
+def _decimal(value):
+    return Decimal(str(round(value, 2)))
+
+def percentile_vector(counts, q, mean, servers=1):
+    """
+    Wait per position at quantile q. The sketch gives the shape of one
+    service time, rescaled to the same minutes per person as etaMinutes.
+    The wait for position p is the sum of p service times: mean p * mean,
+    spread sigma * sqrt(p), plus the skew of one service time, which does
+    not grow with p (Cornish-Fisher). That skew is measured directly as the
+    sketch quantile's distance from its normal approximation, so position 1
+    gets the sketch quantile itself and far positions tend to the normal.
+    None if the sketch has too few samples.
+    """
+    if sum(counts) < sketch.MIN_SAMPLES:
+        return None
+    scale = mean / sketch.mean(counts)
+    sigma = math.sqrt(sketch.variance(counts)) * scale
+    z = NORMAL_QUANTILES[q]
+    skew = sketch.quantile(counts, q) * scale - mean - z * sigma
+    vector = [0]
+    for position in range(1, ETA_POSITIONS):
+        wait = position * mean + z * sigma * math.sqrt(position) + skew
+        vector.append(max(0, round(wait / servers)))
+    return vector
+
+def compute(queue_id, config):
+    """
+    The eta* attributes (see above) for a queue, from its QueueStats item.
+    """
+    hour = estimator.local_hour(config)
+    minutes_per_person, measured = estimator.minutes_per_person(config, hour)
+    servers = counters.active_count(queue_id)
+    step = minutes_per_person / servers
+    expected = [round(position * step) for position in range(ETA_POSITIONS)]
+
+    # Without enough measurements the spread is unknown: use the expectation
+    counts = sketch.load(queue_id, hour)
+    return {
+        'etaMinutes': expected,
+        'etaP50Minutes': percentile_vector(counts, 0.5, minutes_per_person, servers) or expected,
+        'etaP90Minutes': percentile_vector(counts, 0.9, minutes_per_person, servers) or expected,
+        'etaStep': _decimal(step),
+        'etaServiceMinutes': _decimal(minutes_per_person),
+        'etaMeasured': measured,
+        'etaServers': servers
+    }
+
+def refresh(queue_id):
+    """
+    Recompute and store the queue's ETA vectors.
+    """
+    config = stats_table.get_item(Key={'queueId': queue_id}, ConsistentRead=True).get('Item', {})
+    item = compute(queue_id, config)
+    item['aggregateId'] = config_cache.eta_key(queue_id)
+    item['etaRefreshedAt'] = int(time.time())
+    aggregates_table.put_item(Item=item)
+    config_cache.observe_eta(queue_id, item)
+    stats_table.update_item(
+        Key={'queueId': queue_id},
+        UpdateExpression="SET etaRefreshedAt = :now",
+        ExpressionAttributeValues={':now': item['etaRefreshedAt']}
+    )
+
+def is_stale(progress, now=None):
+    """
+    True if the queue's vector (etaRefreshedAt from progress.list_queue_progress)
+    is missing or older than ETA_MAX_AGE_SECONDS.
+    """
+    refreshed_at = progress.get('etaRefreshedAt')
+    return refreshed_at is None or (now or time.time()) - refreshed_at >= ETA_MAX_AGE_SECONDS
+
+def minutes_per_person(queue_id):
+    """
+    (minutes, measured) behind the queue's current ETAs.
+    """
+    vectors = config_cache.get_queue_eta(queue_id)
+    if 'etaServiceMinutes' in vectors:
+        return float(vectors['etaServiceMinutes']), bool(vectors.get('etaMeasured'))
+    return estimator.minutes_per_person(config_cache.get_queue_config(queue_id))
+
+def servers(queue_id):
+    """
+    Active counters behind the queue's current ETAs.
+    """
+    return int(config_cache.get_queue_eta(queue_id).get('etaServers', 1))
+
+def _at(vectors, name, position):
+    vector = vectors[name]
+    if position < len(vector):
+        return int(vector[position])
+    return round(int(vector[-1]) + (position - len(vector) + 1) * float(vectors['etaStep']))
+
+def lookup(queue_id, position):
+    """
+    Expected wait in minutes for a position, from the queue's cached ETA item.
+    Queues that have never been refreshed are estimated on the spot.
+    """
+    vectors = config_cache.get_queue_eta(queue_id)
+    if not vectors.get('etaMinutes'):
+        return round(position * minutes_per_person(queue_id)[0])
+    return _at(vectors, 'etaMinutes', position)
+
+def lookup_percentiles(queue_id, position):
+    """
+    (p50, p90) wait in minutes for a position.
+    """
+    vectors = config_cache.get_queue_eta(queue_id)
+    if not vectors.get('etaP90Minutes'):
+        expected = lookup(queue_id, position)
+        return expected, expected
+    return _at(vectors, 'etaP50Minutes', position), _at(vectors, 'etaP90Minutes', position)
@@ -0,0 +1,54 @@
+"""
+Ticket lifecycle: moves COMPLETED tickets out of the hot QueueEntries table.
+The archived row keeps only the attributes needed for history and expires
+after ARCHIVE_RETENTION_DAYS. The ticket's UserNotifications row is removed
+at the same time and the ticket is taken off its email's subscription.
+"""
+import boto3
+import os
+import time
+from queue_common import subscriptions
+
+ARCHIVE_RETENTION_DAYS = int(os.environ.get('ARCHIVE_RETENTION_DAYS', '90'))
+ARCHIVED_ATTRIBUTES = ('queueId', 'ticketNumber', 'sequence', 'joinTime', 'servedAt', 'completedAt')
+
+dynamodb = boto3.resource('dynamodb')
+entries_table = dynamodb.Table(os.environ['QUEUE_ENTRIES_TABLE'])
+archive_table = dynamodb.Table(os.environ['QUEUE_ARCHIVE_TABLE'])
+notifications_table = dynamodb.Table(os.environ['USER_NOTIFICATIONS_TABLE'])
+
+def release_notifications(ticket):
+    """
+    Take a QueueEntries ticket off its email's subscription (the last
+    ticket of an address unsubscribes it) and delete its notification
+    record. Safe to repeat.
+    """
+    if ticket.get('email'):
+        subscriptions.detach(ticket['email'], ticket['ticketNumber'])
+    notifications_table.delete_item(Key={'ticketNumber': ticket['ticketNumber']})
+
+def archive_ticket(ticket):
+    """
+    Copy a completed ticket to the archive table in compacted form, release
+    its notifications, then delete it from QueueEntries. Every step can be
+    repeated, and the entry goes last: if this fails half way the ticket is
+    still in QueueEntries, so staff_complete's retry finds it and finishes.
+    """
+    now = int(time.time())
+    record = {name: ticket[name] for name in ARCHIVED_ATTRIBUTES if name in ticket}
+    record['status'] = 'COMPLETED'
+    record.setdefault('completedAt', now)
+    record['expiresAt'] = now + ARCHIVE_RETENTION_DAYS * 86400
+    archive_table.put_item(Item=record)
+    release_notifications(ticket)
+
+    entries_table.delete_item(
+        Key={'queueId': ticket['queueId'], 'ticketNumber': ticket['ticketNumber']}
+    )
+
+def get_archived_ticket(queue_id, ticket_number):
+    """
+    Look up a ticket that has already been archived, or None.
+    """
+    response = archive_table.get_item(Key={'queueId': queue_id, 'ticketNumber': ticket_number})
+    return response.get('Item')
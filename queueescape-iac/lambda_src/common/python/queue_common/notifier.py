@@ -0,0 +1,349 @@
+"""
+Position notifications: evaluates the front of a queue and emails every
+ticket that has crossed one of the queue's milestones.
+Used by the periodic scheduler (send_notifications) and by the
+QueueEntries change-event consumer (queue_events).
+"""
+import boto3
+import os
+import time
+import zlib
+from boto3.dynamodb.conditions import Key
+from queue_common import channels, config_cache, eta, outbox, progress, subscriptions, templates
+from queue_common.batching import batch_get
+from queue_common.entries import STATUS_INDEX
+from queue_common.pagination import iter_items
+
+dynamodb = boto3.resource('dynamodb')
+entries_table = dynamodb.Table(os.environ['QUEUE_ENTRIES_TABLE'])
+notifications_table = dynamodb.Table(os.environ['USER_NOTIFICATIONS_TABLE'])
+stats_table = dynamodb.Table(os.environ['QUEUE_STATS_TABLE'])
+
+# Sparse index over the records still waiting for their email confirmation:
+# awaitingConfirmation ("<shard>") is removed once the subscription is confirmed
+UNCONFIRMED_INDEX = os.environ.get('NOTIFICATIONS_UNCONFIRMED_INDEX', 'UnconfirmedIndex')
+CONFIRMATION_SHARDS = 4
+# SNS confirmation links expire after three days; older records are not checked
+CONFIRMATION_WINDOW_SECONDS = 3 * 24 * 3600
+
+# Get notification thresholds from environment
+THRESHOLDS = [int(x) for x in os.environ.get('NOTIFICATION_THRESHOLDS', '50,40,30,20,10,5,3,1').split(',')]
+
+# A ticket gets at most one position notification per interval; milestones
+# crossed in the meantime are folded into the next one
+MIN_NOTIFICATION_INTERVAL_SECONDS = int(os.environ.get('MIN_NOTIFICATION_INTERVAL_SECONDS', '60'))
+
+# Only what the scheduler needs from each UserNotifications record
+NOTIFICATION_RECORD_ATTRIBUTES = [
+    'ticketNumber', 'subscriptionArn', 'subscriptionConfirmed',
+    'lastNotifiedPosition', 'lastNotifiedAt', 'notificationsSent'
+]
+
+def register_recipient(ticket_number, email, queue_id):
+    """
+    Add a new ticket to its email's subscription and create its
+    UserNotifications record. Runs from the change-event consumer, not on
+    the join request path. Safe to repeat: the ticket is only added to the
+    subscription once and the record is only written once.
+    """
+    subscription_arn = subscriptions.attach(email, ticket_number)
+    try:
+        notifications_table.put_item(
+            Item={
+                'ticketNumber': ticket_number,
+                'queueId': queue_id,
+                'email': email,
+                'subscriptionArn': subscription_arn,
+                'subscriptionConfirmed': False,
+                'awaitingConfirmation': str(zlib.crc32(ticket_number.encode()) % CONFIRMATION_SHARDS),
+                'registeredAt': int(time.time()),
+                'notificationsSent': [],  # Track which milestones were sent
+                'lastNotifiedPosition': 999999  # Start high
+            },
+            ConditionExpression="attribute_not_exists(ticketNumber)"
+        )
+    except dynamodb.meta.client.exceptions.ConditionalCheckFailedException:
+        pass
+
+def get_notification_settings(queue_id):
+    """
+    Fetch custom notification thresholds from QueueStats if configured by staff.
+    Falls back to environment variable defaults.
+    """
+    try:
+        config = config_cache.get_queue_config(queue_id)
+        if 'notification_thresholds' in config:
+            custom = config['notification_thresholds']
+            return [int(x) for x in custom.split(',')]
+    except Exception as e:
+        print(f"Error fetching custom thresholds: {e}")
+    
+    return THRESHOLDS
+
+def _unconfirmed_records(since):
+    for shard in range(CONFIRMATION_SHARDS):
+        yield from iter_items(
+            notifications_table.query,
+            IndexName=UNCONFIRMED_INDEX,
+            KeyConditionExpression=Key('awaitingConfirmation').eq(str(shard)) & Key('registeredAt').gte(since)
+        )
+
+def sync_confirmations():
+    """
+    Copy SNS confirmation state onto the UserNotifications records that are
+    still unconfirmed, from one paged listing of the topic. Only records in
+    the sparse UnconfirmedIndex registered within CONFIRMATION_WINDOW_SECONDS
+    are read. Queues with a newly confirmed recipient lose their progress
+    watermark, so their next scheduled evaluation covers the whole window.
+    Returns the number of records confirmed.
+    """
+    unconfirmed = list(_unconfirmed_records(int(time.time()) - CONFIRMATION_WINDOW_SECONDS))
+    if not unconfirmed:
+        return 0
+    
+    confirmed_arns = channels.confirmed_subscription_arns()
+    confirmed_count = 0
+    queues = set()
+    for record in unconfirmed:
+        if record.get('subscriptionArn') not in confirmed_arns:
+            continue
+        try:
+            notifications_table.update_item(
+                Key={'ticketNumber': record['ticketNumber']},
+                UpdateExpression="SET subscriptionConfirmed = :confirmed REMOVE awaitingConfirmation",
+                ConditionExpression="attribute_exists(ticketNumber)",
+                ExpressionAttributeValues={':confirmed': True}
+            )
+        except dynamodb.meta.client.exceptions.ConditionalCheckFailedException:
+            # Ticket completed and released meanwhile
+            continue
+        confirmed_count += 1
+        if record.get('queueId'):
+            queues.add(record['queueId'])
+    
+    for queue_id in queues:
+        progress.reset(queue_id)
+    return confirmed_count
+
+def load_notification_window(queue_id, window_size):
+    """
+    The first window_size WAITING tickets of a queue, in join order.
+    Tickets further back cannot have crossed any threshold, so they are never read.
+    """
+    return list(iter_items(
+        entries_table.query,
+        projection=['queueId', 'ticketNumber', 'sequence'],
+        limit=window_size,
+        page_size=window_size,
+        IndexName=STATUS_INDEX,
+        KeyConditionExpression=Key('queueId').eq(queue_id) & Key('statusOrder').begins_with('WAITING#')
+    ))
+
+def should_notify(current_position, last_notified_position, notifications_sent, thresholds):
+    """
+    Determine if we should send a notification based on current position.
+    Every threshold crossed since the last notification is coalesced into
+    one notice for the lowest of them.
+    Returns (should_send, milestone, crossed) tuple.
+    """
+    crossed = [
+        threshold for threshold in thresholds
+        if current_position <= threshold < last_notified_position
+        and threshold not in notifications_sent
+    ]
+    if not crossed:
+        return False, None, []
+    
+    return True, min(crossed), crossed
+
+def build_position_notification(queue_id, ticket_number, position, estimated_wait):
+    """
+    Subject and message for a queue position notification.
+    """
+    return templates.render(
+        queue_id, templates.band_for_position(position), ticket_number,
+        position=position, estimated_wait=estimated_wait
+    )
+
+def load_notification_records(tickets):
+    """
+    UserNotifications records for these tickets, keyed by ticketNumber,
+    fetched with BatchGetItem instead of one GetItem per ticket.
+    """
+    records = batch_get(
+        notifications_table,
+        [{'ticketNumber': ticket['ticketNumber']} for ticket in tickets],
+        projection=NOTIFICATION_RECORD_ATTRIBUTES
+    )
+    return {record['ticketNumber']: record for record in records}
+
+def plan_notification(ticket, notif_record, current_position, thresholds, now):
+    """
+    Decide whether one waiting ticket has crossed a milestone.
+    Returns the notification to send, or None.
+    """
+    ticket_number = ticket['ticketNumber']
+    if not notif_record:
+        print(f"No notification record for {ticket_number}")
+        return None
+    
+    # Publishing to an unconfirmed subscription reaches nobody; the
+    # milestones stay unsent until sync_confirmations sees the confirmation
+    if not notif_record.get('subscriptionArn') or not notif_record.get('subscriptionConfirmed'):
+        return None
+    
+    last_notified = notif_record.get('lastNotifiedPosition', 999999)
+    sent_milestones = notif_record.get('notificationsSent', [])
+    
+    # Check if we should notify
+    should_send, milestone, crossed = should_notify(
+        current_position, 
+        last_notified, 
+        sent_milestones,
+        thresholds
+    )
+    
+    if not should_send:
+        return None
+    
+    # Estimated wait from the queue's precomputed ETAs
+    estimated_wait = eta.lookup(ticket['queueId'], current_position)
+    subject, message = build_position_notification(ticket['queueId'], ticket_number, current_position, estimated_wait)
+    return {
+        'ticketNumber': ticket_number,
+        'sequence': int(ticket['sequence']),
+        'subject': subject,
+        'message': message,
+        'position': current_position,
+        'milestone': milestone,
+        'notifiedAt': now,
+        'notificationsSent': sent_milestones + crossed
+    }
+
+def recently_notified(notif_record, now):
+    last_notified_at = notif_record.get('lastNotifiedAt')
+    return bool(last_notified_at) and now - int(last_notified_at) < MIN_NOTIFICATION_INTERVAL_SECONDS
+
+def could_have_crossed(position, departures, thresholds):
+    """
+    A ticket now at this position was at position + departures before, so
+    it can only have crossed a threshold in [position, position + departures).
+    """
+    return any(position <= threshold < position + departures for threshold in thresholds)
+
+def _record_operation(planned):
+    """
+    Save the milestones of a queued notification on its UserNotifications
+    record: every milestone it covers is marked sent in one update. Applies
+    only while the milestone is not marked sent yet, so a rerun or parallel
+    worker that already recorded it does not record it again.
+    """
+    return {
+        'Update': {
+            'TableName': notifications_table.name,
+            'Key': {'ticketNumber': planned['ticketNumber']},
+            'UpdateExpression': "SET lastNotifiedPosition = :pos, lastNotifiedAt = :at, notificationsSent = :sent",
+            'ConditionExpression': "attribute_exists(ticketNumber) AND NOT contains(notificationsSent, :milestone)",
+            'ExpressionAttributeValues': {
+                ':pos': planned['position'],
+                ':at': planned['notifiedAt'],
+                ':sent': planned['notificationsSent'],
+                ':milestone': planned['milestone']
+            }
+        }
+    }
+
+def queue_notification(planned):
+    """
+    Append a planned notification to the outbox and record it on the
+    UserNotifications record in one transaction, so neither write can land
+    without the other. Returns True if it was queued, False if an earlier
+    run already queued or recorded this milestone.
+    """
+    client = dynamodb.meta.client
+    enqueue = outbox.enqueue_operation(planned['ticketNumber'], planned['milestone'],
+                                       planned['subject'], planned['message'])
+    record = _record_operation(planned)
+    try:
+        client.transact_write_items(TransactItems=[enqueue, record])
+        return True
+    except client.exceptions.TransactionCanceledException as e:
+        codes = [reason.get('Code') for reason in e.response.get('CancellationReasons', [])]
+        if len(codes) < 2 or 'ConditionalCheckFailed' not in codes:
+            raise
+        if codes[1] == 'ConditionalCheckFailed':
+            # Already recorded
+            return False
+    # Queued by an earlier run that did not record it (before the two
+    # writes were made atomic): only record it
+    record = record['Update']
+    record.pop('TableName')
+    try:
+        notifications_table.update_item(**record)
+    except client.exceptions.ConditionalCheckFailedException:
+        pass
+    return False
+
+def evaluate_queue(queue_id, resume_after_sequence=0, out_of_time=None, queue_progress=None):
+    """
+    Check the notification window at the front of one queue.
+    Tickets up to resume_after_sequence were handled by an earlier run and are
+    skipped. out_of_time, if given, is checked before each notification; when
+    it returns True the run stops early.
+    With queue_progress (from progress.list_queue_progress) only tickets that
+    joined or could have crossed a threshold since the last evaluated
+    watermark are checked, and the new watermark is recorded once the queue
+    is fully handled.
+    Returns (tickets_processed, notifications_queued, stopped_after) where
+    stopped_after is the sequence to resume after, or None if finished.
+    """
+    # Settings are read once per queue, not once per ticket
+    thresholds = get_notification_settings(queue_id)
+    tickets = load_notification_window(queue_id, max(thresholds) + 1)
+    
+    candidates = []
+    for current_position, ticket in enumerate(tickets):
+        # Positions still count the skipped tickets ahead
+        if int(ticket['sequence']) <= resume_after_sequence:
+            continue
+        if queue_progress and 'evaluatedNextSequence' in queue_progress:
+            departures = queue_progress.get('departures', 0) - queue_progress.get('evaluatedDepartures', 0)
+            joined = int(ticket['sequence']) > queue_progress['evaluatedNextSequence']
+            if not joined and not could_have_crossed(current_position, departures, thresholds):
+                continue
+        candidates.append((current_position, ticket))
+    
+    planned = []
+    complete = True
+    if candidates:
+        notif_records = load_notification_records([ticket for _, ticket in candidates])
+        now = int(time.time())
+        for current_position, ticket in candidates:
+            notif_record = notif_records.get(ticket['ticketNumber'])
+            notification = plan_notification(ticket, notif_record, current_position, thresholds, now)
+            if not notification:
+                continue
+            if recently_notified(notif_record, now):
+                # Notified too recently: wait, later milestones are coalesced.
+                # The watermark stays put so the next run looks again.
+                complete = False
+                continue
+            planned.append(notification)
+    
+    # Queue in the outbox; the drain worker publishes. A milestone that is
+    # already queued or recorded (rerun, parallel worker) is skipped.
+    notifications_queued_count = 0
+    for notification in planned:
+        if out_of_time and out_of_time():
+            # Everything ahead of this ticket is done
+            return len(candidates), notifications_queued_count, notification['sequence'] - 1
+        try:
+            if queue_notification(notification):
+                notifications_queued_count += 1
+        except Exception as e:
+            print(f"Error processing ticket {notification['ticketNumber']}: {str(e)}")
+            complete = False
+    
+    if queue_progress and complete:
+        progress.record_evaluated(queue_progress)
+    return len(candidates), notifications_queued_count, None
@@ -0,0 +1,179 @@
+"""
+Transactional outbox for customer notifications.
+
+Producers (the notifier, staff_next) never publish directly: they append the
+intended message to NotificationOutbox with a conditional write keyed on
+(ticketNumber, milestone), so reruns and parallel workers cannot queue the
+same milestone twice. The drain worker (drain_outbox) claims PENDING entries
+with a conditional update, publishes them, and retries failures with
+exponential backoff. Entries that still fail stay pending in the sparse
+PendingIndex for the next drain, until MAX_DELIVERY_ATTEMPTS claims have
+failed: then they are dead-lettered as FAILED.
+
+Pending entries are spread over PENDING_SHARDS index partitions
+("PENDING#<n>", by ticket) so a large backlog has no single hot key.
+"""
+import boto3
+import os
+import time
+import zlib
+from boto3.dynamodb.conditions import Key
+from queue_common import channels
+from queue_common.pagination import iter_items
+
+PENDING_INDEX = os.environ.get('OUTBOX_PENDING_INDEX', 'PendingIndex')
+OUTBOX_TTL_DAYS = 7
+CLAIM_SECONDS = 60
+MAX_ATTEMPTS = 4
+BACKOFF_BASE_SECONDS = 0.2
+# Drains (claims) an entry may fail before it is dead-lettered
+MAX_DELIVERY_ATTEMPTS = 5
+# Only ever raise this: entries in shards above a lowered count are not drained
+PENDING_SHARDS = 8
+FAILED = 'FAILED'
+
+# Milestone used for the "your turn" message sent by staff_next; below any
+# position threshold, so it never collides with a staff milestone of 0
+YOUR_TURN_MILESTONE = -1
+
+dynamodb = boto3.resource('dynamodb')
+outbox_table = dynamodb.Table(os.environ['NOTIFICATION_OUTBOX_TABLE'])
+
+def _message_id(entry):
+    return f"{entry['ticketNumber']}-{int(entry['milestone'])}"
+
+def _key(entry):
+    return {'ticketNumber': entry['ticketNumber'], 'milestone': entry['milestone']}
+
+def pending_status(ticket_number):
+    return f"PENDING#{zlib.crc32(ticket_number.encode()) % PENDING_SHARDS}"
+
+def pending_statuses():
+    """
+    Every PendingIndex partition key that holds undelivered entries.
+    """
+    return [f"PENDING#{shard}" for shard in range(PENDING_SHARDS)]
+
+def enqueue_operation(ticket_number, milestone, subject, message):
+    """
+    The outbox append as a TransactWriteItems Put, for producers that record
+    the notification in the same transaction. Its condition fails if this
+    (ticket, milestone) was already queued.
+    """
+    now = int(time.time())
+    return {
+        'Put': {
+            'TableName': outbox_table.name,
+            'Item': {
+                'ticketNumber': ticket_number,
+                'milestone': milestone,
+                'subject': subject,
+                'message': message,
+                'outboxStatus': pending_status(ticket_number),
+                'attempts': 0,
+                'createdAt': now,
+                'expiresAt': now + OUTBOX_TTL_DAYS * 86400
+            },
+            'ConditionExpression': "attribute_not_exists(ticketNumber)"
+        }
+    }
+
+def enqueue(ticket_number, milestone, subject, message):
+    """
+    Append a notification to the outbox. Returns False if this
+    (ticket, milestone) was already queued.
+    """
+    put = enqueue_operation(ticket_number, milestone, subject, message)['Put']
+    try:
+        outbox_table.put_item(Item=put['Item'], ConditionExpression=put['ConditionExpression'])
+        return True
+    except dynamodb.meta.client.exceptions.ConditionalCheckFailedException:
+        return False
+
+def _claim(entry, now):
+    """
+    Take a pending entry for this worker for CLAIM_SECONDS, counting the
+    attempt. Returns the claimed entry, or None.
+    """
+    try:
+        response = outbox_table.update_item(
+            Key=_key(entry),
+            UpdateExpression="SET claimedUntil = :until ADD attempts :one",
+            ConditionExpression="begins_with(outboxStatus, :pending) AND (attribute_not_exists(claimedUntil) OR claimedUntil < :now)",
+            ExpressionAttributeValues={
+                ':until': now + CLAIM_SECONDS,
+                ':now': now,
+                ':pending': 'PENDING',
+                ':one': 1
+            },
+            ReturnValues='ALL_NEW'
+        )
+        return response['Attributes']
+    except dynamodb.meta.client.exceptions.ConditionalCheckFailedException:
+        return None
+
+def _mark_sent(entry):
+    # Removing outboxStatus takes the entry out of PendingIndex
+    outbox_table.update_item(
+        Key=_key(entry),
+        UpdateExpression="SET deliveredAt = :now REMOVE outboxStatus, claimedUntil",
+        ExpressionAttributeValues={':now': int(time.time())}
+    )
+
+def _release(entry):
+    if int(entry.get('attempts', 0)) < MAX_DELIVERY_ATTEMPTS:
+        outbox_table.update_item(Key=_key(entry), UpdateExpression="REMOVE claimedUntil")
+        return
+    # Dead-lettered: out of the pending partitions, kept until the TTL
+    print(f"Giving up on notification {_message_id(entry)} after {entry['attempts']} attempts")
+    outbox_table.update_item(
+        Key=_key(entry),
+        UpdateExpression="SET outboxStatus = :failed REMOVE claimedUntil",
+        ExpressionAttributeValues={':failed': FAILED}
+    )
+
+def deliver(entries):
+    """
+    Claim and publish outbox entries, retrying failures with exponential
+    backoff. Returns the number delivered.
+    """
+    now = int(time.time())
+    pending = [claimed for claimed in (_claim(entry, now) for entry in entries) if claimed]
+    delivered_count = 0
+
+    for attempt in range(MAX_ATTEMPTS):
+        delivered = channels.publish_many([
+            (_message_id(entry), entry['ticketNumber'], entry['subject'], entry['message'])
+            for entry in pending
+        ])
+        for entry in pending:
+            if _message_id(entry) in delivered:
+                _mark_sent(entry)
+                delivered_count += 1
+        pending = [entry for entry in pending if _message_id(entry) not in delivered]
+        if not pending:
+            break
+        if attempt < MAX_ATTEMPTS - 1:
+            time.sleep(BACKOFF_BASE_SECONDS * (2 ** attempt))
+
+    # Leave the rest for the next drain, or dead-letter them
+    for entry in pending:
+        _release(entry)
+    return delivered_count
+
+def drain_pending(older_than_seconds=0):
+    """
+    Deliver everything still pending that was queued at least
+    older_than_seconds ago, one index partition at a time.
+    Returns the number delivered.
+    """
+    cutoff = int(time.time()) - older_than_seconds
+    delivered_count = 0
+    for status in pending_statuses():
+        entries = iter_items(
+            outbox_table.query,
+            IndexName=PENDING_INDEX,
+            KeyConditionExpression=Key('outboxStatus').eq(status) & Key('createdAt').lte(cutoff)
+        )
+        delivered_count += deliver(list(entries))
+    return delivered_count
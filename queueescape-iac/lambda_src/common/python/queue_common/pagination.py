@@ -0,0 +1,52 @@
+"""
+Streaming pagination for DynamoDB scan/query calls.
+DynamoDB returns at most 1 MB per call; these helpers follow
+LastEvaluatedKey so callers always see the whole result set.
+"""
+
+def _with_projection(kwargs, projection):
+    if not projection:
+        return kwargs
+    names = dict(kwargs.get('ExpressionAttributeNames', {}))
+    placeholders = []
+    for i, attribute in enumerate(projection):
+        placeholder = f"#p{i}"
+        names[placeholder] = attribute
+        placeholders.append(placeholder)
+    kwargs['ExpressionAttributeNames'] = names
+    kwargs['ProjectionExpression'] = ", ".join(placeholders)
+    return kwargs
+
+def iter_pages(operation, **kwargs):
+    """
+    Yield each raw response page of a Table.scan or Table.query call.
+    """
+    while True:
+        response = operation(**kwargs)
+        yield response
+        last_key = response.get('LastEvaluatedKey')
+        if not last_key:
+            return
+        kwargs['ExclusiveStartKey'] = last_key
+
+def iter_items(operation, projection=None, limit=None, page_size=None, **kwargs):
+    """
+    Yield items one at a time from a Table.scan or Table.query call.
+
+    projection: optional list of attribute names to return.
+    limit: stop after this many items (no further pages are read).
+    page_size: DynamoDB Limit for each underlying request.
+    Only one page is held in memory at a time.
+    """
+    kwargs = _with_projection(dict(kwargs), projection)
+    if page_size:
+        kwargs['Limit'] = page_size
+    if limit is not None and limit <= 0:
+        return
+    yielded = 0
+    for page in iter_pages(operation, **kwargs):
+        for item in page.get('Items', []):
+            yield item
+            yielded += 1
+            if limit is not None and yielded >= limit:
+                return
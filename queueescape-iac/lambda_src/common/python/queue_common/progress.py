@@ -0,0 +1,97 @@
+"""
+Per-queue progress watermark, kept on the queue's QueueStats item.
+Positions only change when a ticket joins (nextSequence moves) or a WAITING
+ticket leaves the line (departures moves, bumped by staff_next and
+staff_complete). The scheduler records the watermark it last evaluated in
+evaluatedNextSequence / evaluatedDepartures and skips queues that have not
+moved since.
+"""
+import boto3
+import os
+from boto3.dynamodb.conditions import Attr
+from queue_common.pagination import iter_items
+
+PROGRESS_ATTRIBUTES = [
+    'queueId', 'nextSequence', 'departures', 'evaluatedNextSequence', 'evaluatedDepartures', 'etaRefreshedAt'
+]
+
+dynamodb = boto3.resource('dynamodb')
+stats_table = dynamodb.Table(os.environ['QUEUE_STATS_TABLE'])
+
+def record_departure(queue_id):
+    """
+    Count a WAITING ticket leaving the line.
+    """
+    stats_table.update_item(
+        Key={'queueId': queue_id},
+        UpdateExpression="ADD departures :one",
+        ExpressionAttributeValues={':one': 1}
+    )
+
+def departure_operation(queue_id):
+    """
+    record_departure as a TransactWriteItems operation, to commit with the
+    QueueEntries write that takes the ticket out of WAITING.
+    """
+    return {
+        'Update': {
+            'TableName': stats_table.name,
+            'Key': {'queueId': queue_id},
+            'UpdateExpression': "ADD departures :one",
+            'ExpressionAttributeValues': {':one': 1}
+        }
+    }
+
+def list_queue_progress():
+    """
+    Progress of every queue that has ever had a ticket, as plain ints.
+    """
+    queues = iter_items(
+        stats_table.scan,
+        projection=PROGRESS_ATTRIBUTES,
+        FilterExpression=Attr('nextSequence').exists()
+    )
+    return [
+        {name: (item[name] if name == 'queueId' else int(item[name]))
+         for name in PROGRESS_ATTRIBUTES if name in item}
+        for item in queues
+    ]
+
+def has_progressed(progress):
+    """
+    True if the queue has changed since its watermark was last evaluated.
+    """
+    if 'evaluatedNextSequence' not in progress:
+        return True
+    return (progress.get('nextSequence', 0) != progress['evaluatedNextSequence']
+            or progress.get('departures', 0) != progress.get('evaluatedDepartures', 0))
+
+def has_waiting(progress):
+    """
+    True if the queue still has WAITING tickets: every join bumps
+    nextSequence and every WAITING ticket that leaves bumps departures.
+    """
+    return progress.get('nextSequence', 0) > progress.get('departures', 0)
+
+def reset(queue_id):
+    """
+    Forget the evaluated watermark so the next scheduler run evaluates the
+    whole queue.
+    """
+    stats_table.update_item(
+        Key={'queueId': queue_id},
+        UpdateExpression="REMOVE evaluatedNextSequence, evaluatedDepartures"
+    )
+
+def record_evaluated(progress):
+    """
+    Remember that the queue was fully evaluated up to this watermark.
+    """
+    stats_table.update_item(
+        Key={'queueId': progress['queueId']},
+        UpdateExpression="SET evaluatedNextSequence = :seq, evaluatedDepartures = :departures",
+        ExpressionAttributeValues={
+            ':seq': progress.get('nextSequence', 0),
+            ':departures': progress.get('departures', 0)
+        }
+    )
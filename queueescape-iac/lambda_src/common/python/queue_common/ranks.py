@@ -0,0 +1,106 @@
+"""
+Per-queue rank structure: how many WAITING tickets are ahead of sequence N.
+
+A two-level Fenwick tree stored as items in the QueueAggregates table:
+  "<queueId>#ranks#<block>"  one item per block of BLOCK_SIZE sequence numbers,
+                             a Fenwick tree over the offsets inside the block
+  "<queueId>#ranks"          a Fenwick tree over the block totals
+Each tree node is a top-level numeric attribute "f<index>", so an update is
+one ADD per node on the path of each item, and a lookup is a single GetItem
+per item projecting only the nodes it needs. Both are O(log n).
+
+The tree is only ever changed in the same transaction as the QueueEntries
+write that moves a ticket into or out of WAITING (write_with_rank), so a
+crash between the two cannot leave it out of step with the entries.
+"""
+import boto3
+import os
+import random
+import time
+
+BLOCK_SIZE = 512
+MAX_BLOCKS = 2 ** 20  # room for ~536M tickets per queue
+# Concurrent transactions on the same rank items are cancelled with a
+# TransactionConflict; retry those a few times
+MAX_TRANSACT_ATTEMPTS = 5
+
+dynamodb = boto3.resource('dynamodb')
+aggregates_table = dynamodb.Table(os.environ['QUEUE_AGGREGATES_TABLE'])
+
+def _update_path(index, size):
+    while index <= size:
+        yield index
+        index += index & -index
+
+def _prefix_path(index):
+    while index > 0:
+        yield index
+        index -= index & -index
+
+def _block_key(queue_id, block):
+    return f"{queue_id}#ranks#{block}"
+
+def _directory_key(queue_id):
+    return f"{queue_id}#ranks"
+
+def _add_operation(key, nodes, delta):
+    return {
+        'Update': {
+            'TableName': aggregates_table.name,
+            'Key': {'aggregateId': key},
+            'UpdateExpression': "ADD " + ", ".join(f"f{node} :d" for node in nodes),
+            'ExpressionAttributeValues': {':d': delta}
+        }
+    }
+
+def _sum_nodes(key, nodes):
+    names = [f"f{node}" for node in nodes]
+    if not names:
+        return 0
+    response = aggregates_table.get_item(
+        Key={'aggregateId': key},
+        ProjectionExpression=", ".join(names)
+    )
+    item = response.get('Item', {})
+    return sum(int(item.get(name, 0)) for name in names)
+
+def add_operations(queue_id, sequence, delta):
+    """
+    TransactWriteItems operations that add delta (+1 on join, -1 when a
+    WAITING ticket leaves) at this sequence.
+    """
+    block, offset = divmod(int(sequence) - 1, BLOCK_SIZE)
+    return [
+        _add_operation(_block_key(queue_id, block), _update_path(offset + 1, BLOCK_SIZE), delta),
+        _add_operation(_directory_key(queue_id), _update_path(block + 1, MAX_BLOCKS), delta)
+    ]
+
+def write_with_rank(operation, queue_id, sequence, delta, also=()):
+    """
+    Apply one QueueEntries write (a TransactWriteItems operation: Put or
+    Update) together with the rank change it implies, and any further
+    operations in `also` (e.g. progress.departure_operation), atomically.
+    Returns False if the write's own ConditionExpression failed.
+    """
+    client = dynamodb.meta.client
+    items = [operation] + add_operations(queue_id, sequence, delta) + list(also)
+    for attempt in range(MAX_TRANSACT_ATTEMPTS):
+        try:
+            client.transact_write_items(TransactItems=items)
+            return True
+        except client.exceptions.TransactionCanceledException as e:
+            codes = [reason.get('Code') for reason in e.response.get('CancellationReasons', [])]
+            if codes and codes[0] == 'ConditionalCheckFailed':
+                return False
+            if 'TransactionConflict' not in codes or attempt == MAX_TRANSACT_ATTEMPTS - 1:
+                raise
+            time.sleep(random.uniform(0, 0.02 * (2 ** attempt)))
+
+def count_before(queue_id, sequence):
+    """
+    Number of WAITING tickets in the queue with a sequence lower than this one.
+    """
+    block, offset = divmod(int(sequence) - 1, BLOCK_SIZE)
+    in_block = _sum_nodes(_block_key(queue_id, block), _prefix_path(offset))
+    earlier_blocks = _sum_nodes(_directory_key(queue_id), _prefix_path(block))
+    return in_block + earlier_blocks
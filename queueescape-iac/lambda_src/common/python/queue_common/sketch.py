@@ -0,0 +1,103 @@
+"""
+Fixed-size quantile sketch of service times, one per queue and local hour
+of day. Service minutes are counted in BINS log-spaced bins (each bin is
+GAMMA times wider than the one before, so quantiles are accurate to about
+(GAMMA - 1) / 2 relative error). Each sketch is a QueueAggregates item keyed
+"{queueId}#sketch#{hour}" with one counter attribute per bin, b0..b{BINS-1},
+and the total in `samples`: adding a sample is a single ADD, and the item
+never grows with history.
+
+Old samples decay: once a sketch holds DECAY_SAMPLES, every bin is halved,
+so it reflects roughly the last DECAY_SAMPLES..2*DECAY_SAMPLES services
+and follows changes in how long service takes.
+"""
+import boto3
+import math
+import os
+
+MIN_MINUTES = 0.25
+GAMMA = 1.25
+BINS = 32  # the last bin starts at ~252 minutes and holds everything longer
+# Fewer samples than this and the sketch is not trusted for percentiles
+MIN_SAMPLES = 5
+DECAY_SAMPLES = int(os.environ.get('SKETCH_DECAY_SAMPLES', '200'))
+
+dynamodb = boto3.resource('dynamodb')
+aggregates_table = dynamodb.Table(os.environ['QUEUE_AGGREGATES_TABLE'])
+
+def _sketch_key(queue_id, hour):
+    return f"{queue_id}#sketch#{hour:02d}"
+
+def bin_index(minutes):
+    if minutes <= MIN_MINUTES:
+        return 0
+    return min(BINS - 1, math.ceil(math.log(minutes / MIN_MINUTES, GAMMA)))
+
+def bin_value(index):
+    """
+    Representative service time of a bin: the point with equal relative
+    error to both of its edges.
+    """
+    if index == 0:
+        return MIN_MINUTES
+    return MIN_MINUTES * GAMMA ** index * 2 / (1 + GAMMA)
+
+def add(queue_id, hour, minutes):
+    """
+    Count one service time in the queue's sketch for this hour, halving the
+    sketch when it reaches DECAY_SAMPLES.
+    """
+    item = aggregates_table.update_item(
+        Key={'aggregateId': _sketch_key(queue_id, hour)},
+        UpdateExpression=f"ADD b{bin_index(minutes)} :one, samples :one",
+        ExpressionAttributeValues={':one': 1},
+        ReturnValues='ALL_NEW'
+    )['Attributes']
+    if int(item['samples']) >= DECAY_SAMPLES:
+        _decay(item)
+
+def _decay(item):
+    halved = [int(item.get(f"b{i}", 0)) // 2 for i in range(BINS)]
+    values = {f":b{i}": count for i, count in enumerate(halved)}
+    values.update({':samples': sum(halved), ':seen': item['samples']})
+    try:
+        aggregates_table.update_item(
+            Key={'aggregateId': item['aggregateId']},
+            UpdateExpression="SET samples = :samples, " + ", ".join(f"b{i} = :b{i}" for i in range(BINS)),
+            ConditionExpression="samples = :seen",
+            ExpressionAttributeValues=values
+        )
+    except dynamodb.meta.client.exceptions.ConditionalCheckFailedException:
+        # Another sample landed first; whoever added it halves instead
+        pass
+
+def load(queue_id, hour):
+    """
+    Bin counts of the queue's sketch for this hour (all zero if none).
+    """
+    item = aggregates_table.get_item(Key={'aggregateId': _sketch_key(queue_id, hour)}).get('Item', {})
+    return [int(item.get(f"b{i}", 0)) for i in range(BINS)]
+
+def quantile(counts, q):
+    total = sum(counts)
+    if not total:
+        return None
+    rank = q * (total - 1)
+    seen = 0
+    for index, count in enumerate(counts):
+        seen += count
+        if seen > rank:
+            return bin_value(index)
+    return bin_value(BINS - 1)
+
+def mean(counts):
+    total = sum(counts)
+    if not total:
+        return None
+    return sum(count * bin_value(index) for index, count in enumerate(counts)) / total
+
+def variance(counts):
+    centre = mean(counts)
+    if centre is None:
+        return None
+    return sum(count * (bin_value(index) - centre) ** 2 for index, count in enumerate(counts)) / sum(counts)
@@ -0,0 +1,140 @@
+"""
+Email subscriptions on the shared notification topic. SNS keeps a single
+subscription per (topic, protocol, endpoint), so every ticket of one email
+address shares it and its filter policy lists the address's live tickets.
+
+Each address has an EmailSubscriptions item holding the subscription ARN
+and the set of live tickets. Tickets are added and removed with atomic
+ADD/DELETE updates, and the filter policy is rewritten from the result.
+When the last ticket is released the subscription is removed: the item is
+marked retiringAt first, and new tickets for the address wait until it is
+gone, so a new ticket never attaches to a subscription being removed.
+"""
+import boto3
+import os
+import time
+from queue_common import channels
+
+# A retirement older than this died half way and is taken over
+RETIRE_TIMEOUT_SECONDS = 60
+MAX_ATTEMPTS = 5
+
+dynamodb = boto3.resource('dynamodb')
+subscriptions_table = dynamodb.Table(os.environ['EMAIL_SUBSCRIPTIONS_TABLE'])
+
+def _add_ticket(email, ticket_number):
+    for attempt in range(MAX_ATTEMPTS):
+        try:
+            return subscriptions_table.update_item(
+                Key={'email': email},
+                UpdateExpression="ADD tickets :ticket",
+                ConditionExpression="attribute_not_exists(retiringAt) OR retiringAt < :stale",
+                ExpressionAttributeValues={
+                    ':ticket': {ticket_number},
+                    ':stale': int(time.time()) - RETIRE_TIMEOUT_SECONDS
+                },
+                ReturnValues='ALL_NEW'
+            )['Attributes']
+        except dynamodb.meta.client.exceptions.ConditionalCheckFailedException:
+            # The address's previous subscription is being removed
+            time.sleep(0.1 * (2 ** attempt))
+    raise RuntimeError(f"Subscription for {email} is still being removed")
+
+def _sync_filter(email, subscription_arn, tickets):
+    """
+    Point the subscription's filter at the address's live tickets. Re-read
+    after each write, so concurrent changes converge: whoever writes the
+    filter last also checks last.
+    """
+    for _ in range(MAX_ATTEMPTS):
+        channels.set_ticket_filter(subscription_arn, tickets)
+        item = subscriptions_table.get_item(Key={'email': email}, ConsistentRead=True).get('Item', {})
+        latest = item.get('tickets', set())
+        if not latest or latest == set(tickets) or item.get('subscriptionArn') != subscription_arn:
+            return
+        tickets = latest
+    print(f"Filter for {email} still changing after {MAX_ATTEMPTS} writes")
+
+def _forget(email, subscription_arn):
+    """
+    Clear a stored subscription ARN that SNS no longer knows, unless it was
+    replaced meanwhile.
+    """
+    try:
+        subscriptions_table.update_item(
+            Key={'email': email},
+            UpdateExpression="REMOVE subscriptionArn",
+            ConditionExpression="subscriptionArn = :arn",
+            ExpressionAttributeValues={':arn': subscription_arn}
+        )
+    except dynamodb.meta.client.exceptions.ConditionalCheckFailedException:
+        pass
+
+def attach(email, ticket_number):
+    """
+    Add a ticket to its email address's subscription, subscribing the
+    address if it has none. Safe to repeat. Returns the subscription ARN.
+    """
+    item = _add_ticket(email, ticket_number)
+    subscription_arn = item.get('subscriptionArn')
+    if subscription_arn and 'retiringAt' not in item:
+        try:
+            _sync_filter(email, subscription_arn, item['tickets'])
+            return subscription_arn
+        except channels.sns.exceptions.NotFoundException:
+            # Unsubscribed by the user, or never confirmed and expired
+            print(f"Subscription {subscription_arn} for {email} is gone, subscribing again")
+            _forget(email, subscription_arn)
+
+    subscription_arn = channels.subscribe(email, item['tickets'])
+    subscriptions_table.update_item(
+        Key={'email': email},
+        UpdateExpression="SET subscriptionArn = :arn REMOVE retiringAt",
+        ExpressionAttributeValues={':arn': subscription_arn}
+    )
+    # Tickets added while subscribing
+    _sync_filter(email, subscription_arn, item['tickets'])
+    return subscription_arn
+
+def detach(email, ticket_number):
+    """
+    Remove a released ticket from its email address's subscription. The
+    address's last ticket removes the subscription. Safe to repeat.
+    """
+    try:
+        item = subscriptions_table.update_item(
+            Key={'email': email},
+            UpdateExpression="DELETE tickets :ticket",
+            ConditionExpression="attribute_exists(email)",
+            ExpressionAttributeValues={':ticket': {ticket_number}},
+            ReturnValues='ALL_OLD'
+        )['Attributes']
+    except dynamodb.meta.client.exceptions.ConditionalCheckFailedException:
+        return
+
+    subscription_arn = item.get('subscriptionArn')
+    tickets = item.get('tickets', set())
+    remaining = tickets - {ticket_number}
+    if remaining:
+        # Already detached (a repeat) leaves the filter as it is
+        if ticket_number in tickets and subscription_arn:
+            try:
+                _sync_filter(email, subscription_arn, remaining)
+            except channels.sns.exceptions.NotFoundException:
+                # Nothing left to filter; the next attach subscribes again
+                _forget(email, subscription_arn)
+        return
+
+    try:
+        subscriptions_table.update_item(
+            Key={'email': email},
+            UpdateExpression="SET retiringAt = :now",
+            ConditionExpression="attribute_not_exists(tickets) AND attribute_not_exists(retiringAt)",
+            ExpressionAttributeValues={':now': int(time.time())}
+        )
+    except dynamodb.meta.client.exceptions.ConditionalCheckFailedException:
+        # A new ticket arrived, or another release is already removing it
+        return
+    if subscription_arn:
+        channels.unsubscribe(subscription_arn)
+    subscriptions_table.delete_item(Key={'email': email})
@@ -0,0 +1,176 @@
+"""
+Notification templates, keyed by milestone band and locale.
+The built-in templates are compiled once per container at import. A queue
+can pick a locale (notification_locale) and override any band with its own
+subject/message (notification_templates: {band: {subject, message}}) on its
+QueueStats item; overrides are compiled the first time they are seen.
+
+Templates use str.format fields: {ticket_number}, {position},
+{estimated_wait}. Every channel renders from here, so a new channel only
+needs to decide how to deliver (subject, message).
+"""
+import textwrap
+from queue_common import config_cache
+
+DEFAULT_LOCALE = 'en'
+
+# Milestone bands
+YOUR_TURN = 'your_turn'          # staff called the ticket (staff_next)
+FRONT_OF_LINE = 'front_of_line'  # position 0
+ALMOST = 'almost'                # positions 1-3
+UPDATE = 'update'                # further back
+
+_SAMPLE_FIELDS = {'ticket_number': 'A1B2C3D4', 'position': 1, 'estimated_wait': 5}
+
+_BUILT_IN = {
+    'en': {
+        YOUR_TURN: ("🔔 YOUR TURN - Please Proceed Now!", """
+            🎉 YOUR TURN HAS ARRIVED!
+
+            Ticket Number: {ticket_number}
+
+            Please proceed to the service counter IMMEDIATELY.
+
+            Thank you for your patience!
+            - QueueEscape Team
+            """),
+        FRONT_OF_LINE: ("🔔 Your Turn - Please Proceed!", """
+            🎉 Your Turn!
+
+            Ticket Number: {ticket_number}
+
+            Please proceed to the service counter immediately. Your turn has arrived!
+
+            Thank you for using QueueEscape.
+            """),
+        ALMOST: ("⚠️ Position Update - You're #{position}!", """
+            ⚠️ Almost Your Turn!
+
+            Ticket Number: {ticket_number}
+            Current Position: {position}
+            Estimated Wait: {estimated_wait} minutes
+
+            You're next in line! Please be ready to proceed to the counter.
+
+            Thank you for using QueueEscape.
+            """),
+        UPDATE: ("📍 Position Update - You're #{position}", """
+            📍 Queue Position Update
+
+            Ticket Number: {ticket_number}
+            Current Position: {position}
+            Estimated Wait: {estimated_wait} minutes
+
+            You're getting closer! We'll notify you again as you move up in the queue.
+
+            Thank you for using QueueEscape.
+            """),
+    },
+    'es': {
+        YOUR_TURN: ("🔔 ES SU TURNO - ¡Pase ahora!", """
+            🎉 ¡HA LLEGADO SU TURNO!
+
+            Número de turno: {ticket_number}
+
+            Por favor, pase al mostrador de atención de INMEDIATO.
+
+            ¡Gracias por su paciencia!
+            - Equipo de QueueEscape
+            """),
+        FRONT_OF_LINE: ("🔔 Es su turno - ¡Pase por favor!", """
+            🎉 ¡Es su turno!
+
+            Número de turno: {ticket_number}
+
+            Por favor, pase al mostrador de atención. ¡Ha llegado su turno!
+
+            Gracias por usar QueueEscape.
+            """),
+        ALMOST: ("⚠️ Actualización - ¡Es el #{position}!", """
+            ⚠️ ¡Casi es su turno!
+
+            Número de turno: {ticket_number}
+            Posición actual: {position}
+            Espera estimada: {estimated_wait} minutos
+
+            ¡Es de los siguientes! Esté listo para pasar al mostrador.
+
+            Gracias por usar QueueEscape.
+            """),
+        UPDATE: ("📍 Actualización - Es el #{position}", """
+            📍 Actualización de su posición
+
+            Número de turno: {ticket_number}
+            Posición actual: {position}
+            Espera estimada: {estimated_wait} minutos
+
+            ¡Ya falta menos! Le avisaremos de nuevo a medida que avance en la fila.
+
+            Gracias por usar QueueEscape.
+            """),
+    },
+}
+
+def _compile(subject, message):
+    """
+    Normalise a template once so rendering is a single format() per part.
+    Raises if it does not format with the sample fields (unknown or
+    positional fields, bad format specs, ...).
+    """
+    template = (subject.strip(), textwrap.dedent(message).strip() + "\n")
+    for part in template:
+        part.format(**_SAMPLE_FIELDS)
+    return template
+
+_REGISTRY = {
+    locale: {band: _compile(subject, message) for band, (subject, message) in bands.items()}
+    for locale, bands in _BUILT_IN.items()
+}
+
+_overrides = {}  # queueId -> (raw notification_templates, compiled)
+
+def _queue_overrides(queue_id, raw):
+    cached = _overrides.get(queue_id)
+    if cached and cached[0] == raw:
+        return cached[1]
+
+    compiled = {}
+    for band, template in raw.items():
+        try:
+            compiled[band] = _compile(template['subject'], template['message'])
+        except Exception as e:
+            # Staff input: anything format() can raise (IndexError for {0},
+            # AttributeError for {position.x}, ...) disables the override
+            print(f"Ignoring invalid {band} template for {queue_id}: {e!r}")
+    _overrides[queue_id] = (raw, compiled)
+    return compiled
+
+def band_for_position(position):
+    if position == 0:
+        return FRONT_OF_LINE
+    if position <= 3:
+        return ALMOST
+    return UPDATE
+
+def render(queue_id, band, ticket_number, position=0, estimated_wait=0):
+    """
+    (subject, message) for this queue's locale, using its override for the
+    band if it has one. An override that fails to format these values
+    (e.g. {estimated_wait:d} with a fractional wait) falls back to the
+    built-in template.
+    """
+    config = config_cache.get_queue_config(queue_id)
+    locale = config.get('notification_locale', DEFAULT_LOCALE)
+    built_in = _REGISTRY.get(locale, _REGISTRY[DEFAULT_LOCALE])[band]
+    template = _queue_overrides(queue_id, config.get('notification_templates') or {}).get(band)
+
+    fields = {'ticket_number': ticket_number, 'position': position, 'estimated_wait': estimated_wait}
+    if template:
+        try:
+            return template[0].format(**fields), template[1].format(**fields)
+        except Exception as e:
+            print(f"Override {band} template for {queue_id} failed to render: {e!r}")
+    return built_in[0].format(**fields), built_in[1].format(**fields)
+
+def clear():
+    _overrides.clear()
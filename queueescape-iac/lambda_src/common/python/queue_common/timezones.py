@@ -0,0 +1,48 @@
+"""
+Local time at each queue's site. A queue's IANA timezone name is the
+`timezone` attribute on its QueueStats item (set through set_settings);
+queues without one use DEFAULT_TIMEZONE. ZoneInfo objects are resolved once
+per name and the most recently used are kept for the life of the container.
+
+Lambda's Python runtime has no system zoneinfo database: the layer bundles
+the tzdata package (lambda_src/common/requirements.txt), which zoneinfo
+falls back to.
+"""
+import os
+from datetime import datetime, timezone
+from functools import lru_cache
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+DEFAULT_TIMEZONE = os.environ.get('DEFAULT_TIMEZONE', 'America/New_York')
+
+@lru_cache(maxsize=128)
+def _zone(name):
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        return None
+
+def is_valid(name):
+    return isinstance(name, str) and _zone(name) is not None
+
+def resolve(name):
+    """
+    ZoneInfo for a timezone name, or the default zone if it is missing or unknown.
+    Raises ZoneInfoNotFoundError if the default zone itself cannot be loaded
+    (no tzdata), rather than letting callers silently fall back to UTC.
+    """
+    if name and is_valid(name):
+        return _zone(name)
+    if name:
+        print(f"Unknown timezone {name}, using {DEFAULT_TIMEZONE}")
+    zone = _zone(DEFAULT_TIMEZONE)
+    if zone is None:
+        raise ZoneInfoNotFoundError(f"Default timezone {DEFAULT_TIMEZONE} not found; is tzdata in the layer?")
+    return zone
+
+def local_hour(config, timestamp=None):
+    """
+    Hour of day at the queue's site for a Unix timestamp (default: now).
+    """
+    moment = datetime.fromtimestamp(timestamp, timezone.utc) if timestamp else datetime.now(timezone.utc)
+    return moment.astimezone(resolve(config.get('timezone'))).hour
@@ -0,0 +1,60 @@
+"""
+Per-queue notification work items: {'queueId': ..., 'resumeAfterSequence': ...,
+'progress': ...} where progress is the queue's watermark (see progress.py).
+The scheduler sends one item per active queue and the notification worker
+(NotificationWorkerLambda, fed by SQS) evaluates each queue on its own, so
+queues are handled in parallel across Lambda concurrency.
+
+Without NOTIFICATION_WORK_QUEUE_URL (local runs, tests) items are kept in an
+in-process list instead; take_local() hands them to a worker.
+"""
+import boto3
+import json
+import os
+
+WORK_QUEUE_URL = os.environ.get('NOTIFICATION_WORK_QUEUE_URL')
+SEND_BATCH_SIZE = 10  # SQS SendMessageBatch limit
+
+sqs = boto3.client('sqs')
+
+_local_items = []
+
+def work_item(queue_id, resume_after_sequence=0, progress=None):
+    item = {'queueId': queue_id, 'resumeAfterSequence': int(resume_after_sequence)}
+    if progress:
+        item['progress'] = progress
+    return item
+
+def send(items):
+    """
+    Queue work items for the workers. Returns the number accepted.
+    """
+    if not WORK_QUEUE_URL:
+        _local_items.extend(items)
+        return len(items)
+
+    sent_count = 0
+    for i in range(0, len(items), SEND_BATCH_SIZE):
+        batch = items[i:i + SEND_BATCH_SIZE]
+        response = sqs.send_message_batch(
+            QueueUrl=WORK_QUEUE_URL,
+            Entries=[{'Id': str(n), 'MessageBody': json.dumps(item)} for n, item in enumerate(batch)]
+        )
+        for failure in response.get('Failed', []):
+            print(f"Error queueing {batch[int(failure['Id'])]['queueId']}: {failure.get('Message', failure['Code'])}")
+        sent_count += len(response.get('Successful', []))
+    return sent_count
+
+def items_from_event(event):
+    """
+    Work items carried by an SQS event.
+    """
+    return [json.loads(record['body']) for record in event.get('Records', [])]
+
+def take_local():
+    """
+    Remove and return the items queued in-process.
+    """
+    items = list(_local_items)
+    _local_items.clear()
+    return items
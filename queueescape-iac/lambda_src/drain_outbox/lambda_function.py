@@ -0,0 +1,35 @@
+import json
+from boto3.dynamodb.types import TypeDeserializer
+from queue_common import outbox
+
+deserializer = TypeDeserializer()
+
+def new_entries(records):
+    """
+    Outbox entries inserted in this batch of NotificationOutbox stream records.
+    """
+    entries = []
+    for record in records:
+        if record.get('eventName') != 'INSERT':
+            continue
+        image = record['dynamodb']['NewImage']
+        entries.append({k: deserializer.deserialize(v) for k, v in image.items()})
+    return entries
+
+def lambda_handler(event, context):
+    """
+    Drain worker for the notification outbox. Triggered by the
+    NotificationOutbox stream for new entries; when invoked without stream
+    records (e.g. by the scheduler) it drains everything still pending.
+    """
+    records = event.get('Records')
+    if records:
+        delivered = outbox.deliver(new_entries(records))
+    else:
+        delivered = outbox.drain_pending()
+
+    print(f"Delivered {delivered} notifications")
+    return {
+        'statusCode': 200,
+        'body': json.dumps({'notificationsDelivered': delivered})
+    }
@@ -1,13 +1,13 @@
 import json
 import boto3
 import os
-from boto3.dynamodb.conditions import Key
+from boto3.dynamodb.conditions import Attr, Key
 from decimal import Decimal
-from datetime import datetime, timezone, timedelta
+from queue_common import eta, lifecycle, ranks
+from queue_common.pagination import iter_items
 
 dynamodb = boto3.resource('dynamodb')
 entries_table = dynamodb.Table(os.environ['QUEUE_ENTRIES_TABLE'])
-stats_table = dynamodb.Table(os.environ['QUEUE_STATS_TABLE'])
 
 class DecimalEncoder(json.JSONEncoder):
     def default(self, obj):
@@ -15,37 +15,19 @@ class DecimalEncoder(json.JSONEncoder):
             return float(obj)
         return super(DecimalEncoder, self).default(obj)
 
-def get_wait_time_per_person(queue_id):
+def legacy_position(queue_id, ticket):
     """
-    Fetches staff settings from DB and compares with current time.
+    Position of a ticket from before sequence numbers (not yet backfilled,
+    see backfill_sequences.py): WAITING tickets of the queue that joined
+    earlier. Reads the queue's partition, so it only serves the changeover.
     """
-    # 1. Default values (if staff never set anything)
-    current_wait_per_person = 5 # Standard
-    
-    try:
-        # 2. Fetch Settings
-        response = stats_table.get_item(Key={'queueId': queue_id})
-        
-        if 'Item' in response:
-            config = response['Item']
-            start_hour = int(config.get('config_start_hour', 17))
-            end_hour = int(config.get('config_end_hour', 22))
-            
-            # 3. Check Current Time (Adjust -4 for your Timezone)
-            utc_now = datetime.now(timezone.utc)
-            local_time = utc_now + timedelta(hours=-4) 
-            current_hour = local_time.hour
-            
-            # 4. Logic: Are we in the peak window?
-            if start_hour <= current_hour < end_hour:
-                return 15 # Peak Time (Slow)
-            else:
-                return 5  # Off-Peak (Fast)
-                
-    except Exception as e:
-        print(f"Error fetching stats: {e}")
-        
-    return current_wait_per_person
+    ahead = iter_items(
+        entries_table.query,
+        projection=['ticketNumber'],
+        KeyConditionExpression=Key('queueId').eq(queue_id),
+        FilterExpression=Attr('status').eq('WAITING') & Attr('joinTime').lt(ticket['joinTime'])
+    )
+    return sum(1 for _ in ahead)
 
 def lambda_handler(event, context):
     try:
@@ -53,27 +35,28 @@ def lambda_handler(event, context):
         queue_id = event['pathParameters'].get('queueId', 'main_queue')
         # 1. Get Ticket
         response = entries_table.get_item(Key={'queueId': queue_id, 'ticketNumber': ticket_number})
-        if 'Item' not in response:
+        my_ticket = response.get('Item')
+        if not my_ticket:
+            # Completed tickets live in the archive table
+            my_ticket = lifecycle.get_archived_ticket(queue_id, ticket_number)
+        if not my_ticket:
             return {'statusCode': 404, 'headers': {'Access-Control-Allow-Origin': '*'}, 'body': json.dumps({'error': 'Not found'})}
-            
-        my_ticket = response['Item']
-        
-        # 2. Calculate Position
-        scan_resp = entries_table.scan(
-            FilterExpression=Key('status').eq('WAITING') & Key('queueId').eq(queue_id)
-        )
         
+        # 2. Calculate Position: WAITING tickets ahead of our sequence
         position = 0
-        for item in scan_resp['Items']:
-            if item['joinTime'] < my_ticket['joinTime']:
-                position += 1
-        
-        if my_ticket['status'] == 'BEING_SERVED':
-            position = 0
+        if my_ticket['status'] == 'WAITING' and 'sequence' in my_ticket:
+            position = ranks.count_before(queue_id, my_ticket['sequence'])
+        elif my_ticket['status'] == 'WAITING':
+            position = legacy_position(queue_id, my_ticket)
 
-        # 3. Dynamic Calculation
-        minutes_per_person = get_wait_time_per_person(queue_id)
-        total_wait = position * minutes_per_person
+        # 3. Precomputed ETA for this position (cached ETA item)
+        total_wait = eta.lookup(queue_id, position)
+        wait_p50, wait_p90 = eta.lookup_percentiles(queue_id, position)
+        minutes_per_person, measured = eta.minutes_per_person(queue_id)
+        calculation_mode = f"{'measured' if measured else 'default'} {minutes_per_person:g} mins/person"
+        servers = eta.servers(queue_id)
+        if servers > 1:
+            calculation_mode += f" across {servers} counters"
 
         return {
             'statusCode': 200,
@@ -89,7 +72,9 @@ def lambda_handler(event, context):
                 'status': my_ticket['status'],
                 'position': position,
                 'estimatedWaitMinutes': total_wait,
-                'calculationMode': f"{minutes_per_person} mins/person"
+                'waitP50Minutes': wait_p50,
+                'waitP90Minutes': wait_p90,
+                'calculationMode': calculation_mode
             }, cls=DecimalEncoder)
         }
     except Exception as e:
@@ -1,8 +1,10 @@
 import json
 import boto3
 import os
-from boto3.dynamodb.conditions import Key, Attr
+from boto3.dynamodb.conditions import Key
 from decimal import Decimal
+from queue_common.entries import STATUS_INDEX
+from queue_common.pagination import iter_items
 
 dynamodb = boto3.resource('dynamodb')
 table = dynamodb.Table(os.environ['QUEUE_ENTRIES_TABLE'])
@@ -17,16 +19,16 @@ def lambda_handler(event, context):
     try:
         params = event.get('queryStringParameters') or {}
         queue_id = params.get('queueId', 'main_queue')        
-        # Scan for everyone not completed
+        # Query everyone not completed (COMPLETED tickets are not in the index)
         # valid statuses: WAITING, BEING_SERVED
-        response = table.scan(
-            FilterExpression=Key('queueId').eq(queue_id) & Attr('status').ne('COMPLETED')
-        )
+        items = list(iter_items(
+            table.query,
+            IndexName=STATUS_INDEX,
+            KeyConditionExpression=Key('queueId').eq(queue_id)
+        ))
         
-        items = response.get('Items', [])
-        
-        # Sort by join time
-        items.sort(key=lambda x: x['joinTime'])
+        # Sort by join order
+        items.sort(key=lambda x: x['sequence'])
 
         return {
             'statusCode': 200,
@@ -3,36 +3,27 @@ import boto3
 import os
 import time
 import uuid
+from queue_common import config_cache, progress, ranks
+from queue_common.entries import status_order
 
 dynamodb = boto3.resource('dynamodb')
 entries_table = dynamodb.Table(os.environ['QUEUE_ENTRIES_TABLE'])
-notifications_table = dynamodb.Table(os.environ['USER_NOTIFICATIONS_TABLE'])
-sns = boto3.client('sns')
+stats_table = dynamodb.Table(os.environ['QUEUE_STATS_TABLE'])
 
-def create_user_topic(ticket_number, email):
+def next_sequence(queue_id):
     """
-    Create a unique SNS topic for this user and subscribe their email.
-    Returns the topic ARN.
+    Atomically take the next ticket sequence number for this queue.
+    Sequences start at 1 and never repeat, even for joins in the same microsecond.
     """
-    try:
-        # Create topic with unique name
-        topic_name = f"QueueUser-{ticket_number}"
-        response = sns.create_topic(Name=topic_name)
-        topic_arn = response['TopicArn']
-        
-        # Subscribe the email
-        sns.subscribe(
-            TopicArn=topic_arn,
-            Protocol='email',
-            Endpoint=email
-        )
-        
-        print(f"Created topic {topic_arn} and subscribed {email}")
-        return topic_arn
-        
-    except Exception as e:
-        print(f"Error creating topic: {str(e)}")
-        return None
+    response = stats_table.update_item(
+        Key={'queueId': queue_id},
+        UpdateExpression="ADD nextSequence :one",
+        ExpressionAttributeValues={':one': 1},
+        ReturnValues='ALL_NEW'
+    )
+    # The whole QueueStats item comes back for free; refresh the settings cache
+    config_cache.observe(queue_id, response['Attributes'])
+    return int(response['Attributes']['nextSequence'])
 
 def lambda_handler(event, context):
     try:
@@ -56,9 +47,7 @@ def lambda_handler(event, context):
         queue_id = body.get('queueId', 'main_queue')
         ticket_number = str(uuid.uuid4())[:8]
         timestamp = int(time.time() * 1000000)
-        
-        # Create SNS topic for this user
-        topic_arn = create_user_topic(ticket_number, email)
+        sequence = next_sequence(queue_id)
         
         # Save to QueueEntries
         item = {
@@ -66,20 +55,21 @@ def lambda_handler(event, context):
             'ticketNumber': ticket_number,
             'status': 'WAITING',
             'joinTime': timestamp,
+            'sequence': sequence,
+            'statusOrder': status_order('WAITING', sequence),
             'email': email
         }
-        entries_table.put_item(Item=item)
+        # The ticket and its rank are written in one transaction
+        try:
+            ranks.write_with_rank({'Put': {'TableName': entries_table.name, 'Item': item}}, queue_id, sequence, 1)
+        except Exception:
+            # The sequence number is spent without a ticket: count it as a
+            # departure so nextSequence - departures still equals the line
+            progress.record_departure(queue_id)
+            raise
         
-        # Save to UserNotifications with notification tracking
-        notification_item = {
-            'ticketNumber': ticket_number,
-            'email': email,
-            'topicArn': topic_arn if topic_arn else 'NONE',
-            'subscriptionConfirmed': False,
-            'notificationsSent': [],  # Track which milestones were sent
-            'lastNotifiedPosition': 999999  # Start high
-        }
-        notifications_table.put_item(Item=notification_item)
+        # The email subscription and UserNotifications record are set up by
+        # QueueEventsLambda from this insert, off the request path
         
         return {
             'statusCode': 200,
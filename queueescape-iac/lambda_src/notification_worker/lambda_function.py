@@ -0,0 +1,55 @@
+import json
+import os
+from queue_common import eta, notifier, work_queue
+
+# Stop and hand the rest back to the work queue when less than this much
+# time is left in the invocation
+TIME_BUDGET_MARGIN_MS = int(os.environ.get('SCHEDULER_TIME_MARGIN_MS', '10000'))
+
+def out_of_time(context):
+    # No context when run locally: no time limit
+    if context is None:
+        return False
+    return context.get_remaining_time_in_millis() < TIME_BUDGET_MARGIN_MS
+
+def lambda_handler(event, context):
+    """
+    Refreshes the ETAs and evaluates the notification window of each queue
+    named in a batch of work items sent by the scheduler. A queue that cannot be finished in
+    this invocation is sent back as a new work item that resumes after the
+    last ticket handled.
+    """
+    tickets_processed = 0
+    notifications_queued_count = 0
+    unfinished = []
+
+    for item in work_queue.items_from_event(event):
+        queue_id = item['queueId']
+        resume_after = int(item.get('resumeAfterSequence', 0))
+        queue_progress = item.get('progress')
+        if unfinished or out_of_time(context):
+            unfinished.append(work_queue.work_item(queue_id, resume_after, queue_progress))
+            continue
+        if not resume_after:
+            eta.refresh(queue_id)
+        processed, queued, stopped_after = notifier.evaluate_queue(
+            queue_id, resume_after, lambda: out_of_time(context), queue_progress
+        )
+        tickets_processed += processed
+        notifications_queued_count += queued
+        if stopped_after is not None:
+            unfinished.append(work_queue.work_item(queue_id, stopped_after, queue_progress))
+
+    if unfinished:
+        print(f"Out of time, handing back {len(unfinished)} queues")
+        work_queue.send(unfinished)
+
+    print(f"Evaluated {tickets_processed} tickets, queued {notifications_queued_count} notifications")
+    return {
+        'statusCode': 200,
+        'body': json.dumps({
+            'ticketsProcessed': tickets_processed,
+            'notificationsQueued': notifications_queued_count,
+            'queuesHandedBack': len(unfinished)
+        })
+    }
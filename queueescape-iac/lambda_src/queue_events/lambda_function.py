@@ -0,0 +1,96 @@
+import json
+from boto3.dynamodb.types import TypeDeserializer
+from queue_common import eta, lifecycle, notifier
+
+deserializer = TypeDeserializer()
+
+def _status(image):
+    if 'status' not in image:
+        return None
+    return deserializer.deserialize(image['status'])
+
+def affected_queues(records):
+    """
+    Queues whose front-of-line positions may have changed in this batch of
+    QueueEntries stream records: a ticket joined (it may already be inside
+    the notification window) or a WAITING ticket left the line (served,
+    removed by staff, or cancelled).
+    """
+    queues = set()
+    for record in records:
+        change = record.get('dynamodb', {})
+        old_status = _status(change.get('OldImage', {}))
+        new_status = _status(change.get('NewImage', {}))
+
+        joined = record.get('eventName') == 'INSERT' and new_status == 'WAITING'
+        left_line = old_status == 'WAITING' and new_status != 'WAITING'
+        if joined or left_line:
+            queues.add(deserializer.deserialize(change['Keys']['queueId']))
+    return queues
+
+def update_recipients(records):
+    """
+    Set up email notifications for every ticket inserted in this batch, and
+    release them for every ticket deleted from QueueEntries. The release
+    also catches a ticket completed before its registration was processed.
+    Deferred here so that joining the queue makes no SNS calls.
+    A failing record is logged and skipped, so it cannot hold up the rest
+    of the batch. Returns the records that failed.
+    """
+    failed = []
+    for record in records:
+        try:
+            change = record['dynamodb']
+            if record.get('eventName') == 'INSERT':
+                image = change.get('NewImage', {})
+                if 'email' not in image:
+                    continue
+                notifier.register_recipient(
+                    deserializer.deserialize(image['ticketNumber']),
+                    deserializer.deserialize(image['email']),
+                    deserializer.deserialize(change['Keys']['queueId'])
+                )
+            elif record.get('eventName') == 'REMOVE' and 'OldImage' in change:
+                ticket = {k: deserializer.deserialize(v) for k, v in change['OldImage'].items()}
+                lifecycle.release_notifications(ticket)
+        except Exception as e:
+            print(f"Error updating recipient for record {record.get('dynamodb', {}).get('SequenceNumber')}: {str(e)}")
+            failed.append(record)
+    return failed
+
+def lambda_handler(event, context):
+    """
+    Consumes the QueueEntries DynamoDB stream. New tickets get their email
+    subscription, then each affected queue's ETAs are refreshed and its
+    notification window is evaluated once per batch; idle queues cost nothing.
+    Records whose subscription could not be updated are reported back
+    (ReportBatchItemFailures) so only they are retried; a queue that fails
+    to evaluate is left to the scheduler's backstop run.
+    """
+    records = event.get('Records', [])
+    failed = update_recipients(records)
+    
+    tickets_processed = 0
+    notifications_queued_count = 0
+
+    for queue_id in affected_queues(records):
+        try:
+            eta.refresh(queue_id)
+            processed, queued, _ = notifier.evaluate_queue(queue_id)
+        except Exception as e:
+            print(f"Error evaluating {queue_id}: {str(e)}")
+            continue
+        tickets_processed += processed
+        notifications_queued_count += queued
+
+    print(f"Evaluated {tickets_processed} tickets, queued {notifications_queued_count} notifications")
+    return {
+        'statusCode': 200,
+        'body': json.dumps({
+            'ticketsProcessed': tickets_processed,
+            'notificationsQueued': notifications_queued_count
+        }),
+        'batchItemFailures': [
+            {'itemIdentifier': record['dynamodb'].get('SequenceNumber')} for record in failed
+        ]
+    }
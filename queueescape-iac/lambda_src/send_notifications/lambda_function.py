@@ -1,220 +1,123 @@
-import json
 import boto3
+import json
 import os
-from boto3.dynamodb.conditions import Key
-from decimal import Decimal
+import time
+from queue_common import eta, outbox, progress, work_queue
+
+# Outbox entries still PENDING after this long are retried by the scheduler
+STUCK_OUTBOX_SECONDS = 120
+
+# Stop and checkpoint when less than this much time is left in the invocation
+TIME_BUDGET_MARGIN_MS = int(os.environ.get('SCHEDULER_TIME_MARGIN_MS', '10000'))
+
+# QueueStats item holding where an unfinished run stopped. It has no
+# nextSequence, so list_queue_progress() never mistakes it for a queue.
+CHECKPOINT_KEY = '__scheduler_checkpoint__'
 
 dynamodb = boto3.resource('dynamodb')
-entries_table = dynamodb.Table(os.environ['QUEUE_ENTRIES_TABLE'])
-notifications_table = dynamodb.Table(os.environ['USER_NOTIFICATIONS_TABLE'])
 stats_table = dynamodb.Table(os.environ['QUEUE_STATS_TABLE'])
-sns = boto3.client('sns')
-
-# Get notification thresholds from environment
-THRESHOLDS = [int(x) for x in os.environ.get('NOTIFICATION_THRESHOLDS', '50,40,30,20,10,5,3,1').split(',')]
+lambda_client = boto3.client('lambda')
 
-def get_notification_settings(queue_id):
-    """
-    Fetch custom notification thresholds from QueueStats if configured by staff.
-    Falls back to environment variable defaults.
-    """
-    try:
-        response = stats_table.get_item(Key={'queueId': queue_id})
-        if 'Item' in response and 'notification_thresholds' in response['Item']:
-            custom = response['Item']['notification_thresholds']
-            return [int(x) for x in custom.split(',')]
-    except Exception as e:
-        print(f"Error fetching custom thresholds: {e}")
-    
-    return THRESHOLDS
+def out_of_time(context):
+    # No context when run locally: no time limit
+    if context is None:
+        return False
+    return context.get_remaining_time_in_millis() < TIME_BUDGET_MARGIN_MS
 
-def calculate_position(ticket, queue_id):
+def load_checkpoint():
     """
-    Calculate current position in queue for a given ticket.
+    The first queue not yet dispatched by the previous run, or None if it
+    finished.
     """
-    scan_resp = entries_table.scan(
-        FilterExpression=Key('status').eq('WAITING') & Key('queueId').eq(queue_id)
+    item = stats_table.get_item(Key={'queueId': CHECKPOINT_KEY}).get('Item')
+    if not item:
+        return None
+    return item['resumeQueueId']
+
+def save_checkpoint(queue_id):
+    stats_table.put_item(
+        Item={
+            'queueId': CHECKPOINT_KEY,
+            'resumeQueueId': queue_id,
+            'savedAt': int(time.time())
+        }
     )
-    
-    position = 0
-    for item in scan_resp['Items']:
-        if item['joinTime'] < ticket['joinTime']:
-            position += 1
-    
-    return position
 
-def should_notify(current_position, last_notified_position, notifications_sent, thresholds):
-    """
-    Determine if we should send a notification based on current position.
-    Returns (should_send, milestone) tuple.
-    """
-    # Check if we've crossed a threshold
-    for threshold in thresholds:
-        if current_position <= threshold and last_notified_position > threshold:
-            # We've crossed this threshold
-            if threshold not in notifications_sent:
-                return True, threshold
-    
-    return False, None
+def clear_checkpoint():
+    stats_table.delete_item(Key={'queueId': CHECKPOINT_KEY})
 
-def send_position_notification(topic_arn, ticket_number, position, estimated_wait):
+def continue_later(context, queue_id):
     """
-    Send notification about queue position.
+    Save the checkpoint and start a new invocation to carry on from it.
+    If the re-invocation fails the next scheduled run resumes instead.
     """
+    save_checkpoint(queue_id)
+    print(f"Out of time, stopping at {queue_id}")
     try:
-        if position == 0:
-            message = f"""
-🎉 Your Turn!
-
-Ticket Number: {ticket_number}
-
-Please proceed to the service counter immediately. Your turn has arrived!
-
-Thank you for using QueueEscape.
-            """
-            subject = "🔔 Your Turn - Please Proceed!"
-        elif position <= 3:
-            message = f"""
-⚠️ Almost Your Turn!
-
-Ticket Number: {ticket_number}
-Current Position: {position}
-Estimated Wait: {estimated_wait} minutes
-
-You're next in line! Please be ready to proceed to the counter.
-
-Thank you for using QueueEscape.
-            """
-            subject = f"⚠️ Position Update - You're #{position}!"
-        else:
-            message = f"""
-📍 Queue Position Update
-
-Ticket Number: {ticket_number}
-Current Position: {position}
-Estimated Wait: {estimated_wait} minutes
-
-You're getting closer! We'll notify you again as you move up in the queue.
-
-Thank you for using QueueEscape.
-            """
-            subject = f"📍 Position Update - You're #{position}"
-        
-        sns.publish(
-            TopicArn=topic_arn,
-            Message=message,
-            Subject=subject
+        lambda_client.invoke(
+            FunctionName=context.function_name,
+            InvocationType='Event',
+            Payload=json.dumps({'resume': True})
         )
-        
-        print(f"Sent notification for ticket {ticket_number} at position {position}")
-        return True
-        
     except Exception as e:
-        print(f"Error sending notification: {str(e)}")
-        return False
+        print(f"Could not re-invoke scheduler: {str(e)}")
 
 def lambda_handler(event, context):
     """
-    This function should be triggered periodically (e.g., every 1-2 minutes via EventBridge)
-    to check all waiting tickets and send notifications as needed.
+    Triggered periodically by EventBridge as a backstop for the queue_events
+    consumer. Dispatches one work item per queue that has moved since its
+    last evaluation, or whose ETAs are getting old while it still has
+    someone waiting, to the notification worker, which handles the queues in parallel; idle queues cost nothing
+    beyond the scan. Queues are dispatched in
+    a fixed order; when the invocation runs low on time it checkpoints and
+    the next invocation resumes where it stopped.
     """
     try:
-        # Get all waiting tickets
-        scan_resp = entries_table.scan(
-            FilterExpression=Key('status').eq('WAITING')
-        )
-        
-        waiting_tickets = scan_resp.get('Items', [])
-        notifications_sent_count = 0
-        
-        for ticket in waiting_tickets:
-            ticket_number = ticket['ticketNumber']
-            queue_id = ticket['queueId']
-            
-            # Get notification settings for this ticket
-            try:
-                notif_resp = notifications_table.get_item(Key={'ticketNumber': ticket_number})
-                
-                if 'Item' not in notif_resp:
-                    print(f"No notification record for {ticket_number}")
-                    continue
-                
-                notif_record = notif_resp['Item']
-                topic_arn = notif_record.get('topicArn')
-                
-                if not topic_arn or topic_arn == 'NONE':
-                    continue
-                
-                # Get current position
-                current_position = calculate_position(ticket, queue_id)
-                last_notified = notif_record.get('lastNotifiedPosition', 999999)
-                sent_milestones = notif_record.get('notificationsSent', [])
-                
-                # Get thresholds for this queue
-                thresholds = get_notification_settings(queue_id)
-                
-                # Check if we should notify
-                should_send, milestone = should_notify(
-                    current_position, 
-                    last_notified, 
-                    sent_milestones,
-                    thresholds
-                )
-                
-                if should_send:
-                    # Calculate estimated wait time
-                    from datetime import datetime, timezone, timedelta
-                    
-                    # Get wait time per person (reuse logic from get_status)
-                    wait_per_person = 5  # Default
-                    try:
-                        stats_resp = stats_table.get_item(Key={'queueId': queue_id})
-                        if 'Item' in stats_resp:
-                            config = stats_resp['Item']
-                            start_hour = int(config.get('config_start_hour', 17))
-                            end_hour = int(config.get('config_end_hour', 22))
-                            
-                            utc_now = datetime.now(timezone.utc)
-                            local_time = utc_now + timedelta(hours=-4)
-                            current_hour = local_time.hour
-                            
-                            if start_hour <= current_hour < end_hour:
-                                wait_per_person = 15
-                    except Exception:
-                        pass
-                    
-                    estimated_wait = current_position * wait_per_person
-                    
-                    # Send notification
-                    if send_position_notification(topic_arn, ticket_number, current_position, estimated_wait):
-                        # Update notification record
-                        sent_milestones.append(milestone)
-                        notifications_table.update_item(
-                            Key={'ticketNumber': ticket_number},
-                            UpdateExpression="SET lastNotifiedPosition = :pos, notificationsSent = :sent",
-                            ExpressionAttributeValues={
-                                ':pos': current_position,
-                                ':sent': sent_milestones
-                            }
-                        )
-                        notifications_sent_count += 1
-                        
-            except Exception as e:
-                print(f"Error processing ticket {ticket_number}: {str(e)}")
-                continue
-        
+        queues_dispatched = 0
+        complete = True
+
+        resume_queue_id = load_checkpoint()
+        queues = sorted(progress.list_queue_progress(), key=lambda q: q['queueId'])
+        if resume_queue_id:
+            queues = [q for q in queues if q['queueId'] >= resume_queue_id]
+        now = time.time()
+        moved = [
+            q for q in queues
+            if progress.has_progressed(q) or (progress.has_waiting(q) and eta.is_stale(q, now))
+        ]
+
+        for i in range(0, len(moved), work_queue.SEND_BATCH_SIZE):
+            if out_of_time(context):
+                continue_later(context, moved[i]['queueId'])
+                complete = False
+                break
+            batch = moved[i:i + work_queue.SEND_BATCH_SIZE]
+            queues_dispatched += work_queue.send([
+                work_queue.work_item(q['queueId'], progress=q) for q in batch
+            ])
+
+        redelivered = 0
+        if complete:
+            if resume_queue_id:
+                clear_checkpoint()
+            # Retry anything the outbox drain worker could not deliver. Fresh
+            # entries are left to the worker, which is still handling them.
+            redelivered = outbox.drain_pending(older_than_seconds=STUCK_OUTBOX_SECONDS)
+
         return {
             'statusCode': 200,
             'body': json.dumps({
-                'message': 'Notification check complete',
-                'ticketsProcessed': len(waiting_tickets),
-                'notificationsSent': notifications_sent_count
+                'message': 'Notification check dispatched' if complete else 'Notification check checkpointed',
+                'complete': complete,
+                'queuesDispatched': queues_dispatched,
+                'queuesSkipped': len(queues) - len(moved),
+                'outboxDelivered': redelivered
             })
         }
-        
+
     except Exception as e:
         print(f"Error in notification lambda: {str(e)}")
         return {
             'statusCode': 500,
             'body': json.dumps({'error': str(e)})
-        }
\ No newline at end of file
+        }
@@ -1,6 +1,7 @@
 import json
 import boto3
 import os
+from queue_common import timezones
 
 dynamodb = boto3.resource('dynamodb')
 stats_table = dynamodb.Table(os.environ['QUEUE_STATS_TABLE'])
@@ -8,7 +9,18 @@ stats_table = dynamodb.Table(os.environ['QUEUE_STATS_TABLE'])
 def lambda_handler(event, context):
     try:
         body = json.loads(event.get('body', '{}'))
-        queue_id = "main_queue"
+        queue_id = body.get('queueId', 'main_queue')
+
+        # Optional IANA timezone name ("America/Chicago") for the queue's site
+        tz_name = body.get('timezone')
+        if tz_name is not None and not timezones.is_valid(tz_name):
+            return {'statusCode': 400,
+                    "headers": {
+                        "Access-Control-Allow-Origin": "*",  # or "http://localhost:3000"
+                        "Access-Control-Allow-Headers": "Content-Type",
+                        "Access-Control-Allow-Methods": "OPTIONS,GET,POST",
+                        "Content-Type": "application/json"},
+                    'body': json.dumps({'error': f"Unknown timezone: {tz_name}"})}
         
         # Staff sends "peak_period": "MORNING", "AFTERNOON", or "EVENING"
         peak_period = body.get('peak_period', 'EVENING').upper()
@@ -23,14 +35,33 @@ def lambda_handler(event, context):
         
         selected_hours = hours_map.get(peak_period, hours_map["EVENING"])
         
-        stats_table.put_item(
-            Item={
-                'queueId': queue_id,
-                'config_peak_period': peak_period,
-                'config_start_hour': selected_hours['start'],
-                'config_end_hour': selected_hours['end']
-            }
-        )
+        # A timezone-only update leaves the peak window as it was
+        updates = []
+        values = {':one': 1}
+        names = {}
+        if 'peak_period' in body or tz_name is None:
+            updates.append("config_peak_period = :period, config_start_hour = :start, config_end_hour = :end")
+            values.update({
+                ':period': peak_period,
+                ':start': selected_hours['start'],
+                ':end': selected_hours['end']
+            })
+        if tz_name is not None:
+            updates.append("#tz = :tz")  # TIMEZONE is a DynamoDB reserved word
+            names['#tz'] = 'timezone'
+            values[':tz'] = tz_name
+
+        # update_item (not put_item) so the queue's sequence counters survive.
+        # Cached readers in other Lambdas see the change within their cache TTL
+        # (config_cache); configVersion orders the items they observe.
+        kwargs = {'ExpressionAttributeNames': names} if names else {}
+        stored = stats_table.update_item(
+            Key={'queueId': queue_id},
+            UpdateExpression="SET " + ", ".join(updates) + " ADD configVersion :one",
+            ExpressionAttributeValues=values,
+            ReturnValues='ALL_NEW',
+            **kwargs
+        )['Attributes']
         
         return {
             'statusCode': 200,
@@ -39,9 +70,14 @@ def lambda_handler(event, context):
                     "Access-Control-Allow-Headers": "Content-Type",
                     "Access-Control-Allow-Methods": "OPTIONS,GET,POST",
                     "Content-Type": "application/json"},
+            # Report what is stored: either part may have been left as it was
             'body': json.dumps({
-                'message': f"Queue settings updated. Peak time set to {peak_period}",
-                'details': selected_hours
+                'message': f"Queue settings updated. Peak time set to {stored.get('config_peak_period', peak_period)}",
+                'details': {
+                    'start': int(stored.get('config_start_hour', selected_hours['start'])),
+                    'end': int(stored.get('config_end_hour', selected_hours['end']))
+                },
+                'timezone': stored.get('timezone', timezones.DEFAULT_TIMEZONE)
             })
         }
     except Exception as e:
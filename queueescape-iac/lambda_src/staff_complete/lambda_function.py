@@ -1,10 +1,54 @@
 import json
 import boto3
 import os
+import time
+from queue_common import estimator, lifecycle, progress, ranks
+
+# Attempts when the ticket changes status between the read and the update
+MAX_COMPLETE_ATTEMPTS = 3
 
 dynamodb = boto3.resource('dynamodb')
 table = dynamodb.Table(os.environ['QUEUE_ENTRIES_TABLE'])
 
+def complete_ticket(queue_id, ticket_number, completed_at):
+    """
+    Mark the ticket COMPLETED (removing statusOrder drops it from
+    QueueStatusIndex). A WAITING ticket leaves the rank tree and counts as a
+    departure in the same transaction. The update only applies while the
+    ticket still has the status just read, so a concurrent claim by
+    staff_next is re-read, not miscounted. Returns the ticket as it was, or None if it does not exist.
+    """
+    for _ in range(MAX_COMPLETE_ATTEMPTS):
+        ticket = table.get_item(
+            Key={'queueId': queue_id, 'ticketNumber': ticket_number},
+            ConsistentRead=True
+        ).get('Item')
+        if not ticket:
+            return None
+        
+        update = {
+            'Key': {'queueId': queue_id, 'ticketNumber': ticket_number},
+            'UpdateExpression': "set #s = :val, completedAt = :now remove statusOrder",
+            'ConditionExpression': "#s = :old",
+            'ExpressionAttributeNames': {'#s': 'status'},
+            'ExpressionAttributeValues': {':val': 'COMPLETED', ':now': completed_at, ':old': ticket['status']}
+        }
+        # Tickets from before sequence numbers (see backfill_sequences.py) are not ranked
+        if ticket['status'] == 'WAITING' and 'sequence' in ticket:
+            update['TableName'] = table.name
+            # It leaves mid-queue (no-show, left the line): counted as a departure
+            if ranks.write_with_rank({'Update': update}, queue_id, ticket['sequence'], -1,
+                                     also=[progress.departure_operation(queue_id)]):
+                return ticket
+            continue
+        try:
+            table.update_item(**update)
+            return ticket
+        except dynamodb.meta.client.exceptions.ConditionalCheckFailedException:
+            continue
+    
+    raise RuntimeError(f"Ticket {ticket_number} changed while completing it, try again")
+
 def lambda_handler(event, context):
     try:
         body = json.loads(event.get('body', '{}'))
@@ -23,12 +67,31 @@ def lambda_handler(event, context):
                 'body': json.dumps({'error': 'ticketNumber required'})
             }
         # Update Status to COMPLETED
-        table.update_item(
-            Key={'queueId': queue_id, 'ticketNumber': ticket_number},
-            UpdateExpression="set #s = :val",
-            ExpressionAttributeNames={'#s': 'status'},
-            ExpressionAttributeValues={':val': 'COMPLETED'}
-        )
+        completed_at = int(time.time())
+        old_ticket = complete_ticket(queue_id, ticket_number, completed_at)
+        if not old_ticket:
+            return {
+                'statusCode': 404,
+                'headers': {
+                    'Access-Control-Allow-Origin': '*',
+                    'Access-Control-Allow-Headers': 'Content-Type',
+                    'Access-Control-Allow-Methods': 'OPTIONS,GET,POST',
+                    'Content-Type': 'application/json'
+                },
+                'body': json.dumps({'error': 'Ticket not found'})
+            }
+        
+        # Measured service time feeds the queue's wait estimate. The ticket is
+        # already completed, so a failure here only costs one sample.
+        if old_ticket.get('status') == 'BEING_SERVED' and 'servedAt' in old_ticket:
+            try:
+                estimator.record_service(queue_id, old_ticket['servedAt'], completed_at)
+            except Exception as e:
+                print(f"Error recording service time for {ticket_number}: {str(e)}")
+        
+        # Move it out of the hot table. If this fails the ticket stays
+        # COMPLETED in QueueEntries and completing it again archives it.
+        lifecycle.archive_ticket(old_ticket)
         
         return {
             'statusCode': 200,
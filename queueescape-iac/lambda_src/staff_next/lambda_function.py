@@ -1,13 +1,19 @@
 import json
 import boto3
 import os
+import time
 from boto3.dynamodb.conditions import Key
 from decimal import Decimal
+from queue_common import counters, outbox, progress, ranks, templates
+from queue_common.entries import STATUS_INDEX, status_order
+from queue_common.pagination import iter_items
 
 dynamodb = boto3.resource('dynamodb')
 entries_table = dynamodb.Table(os.environ['QUEUE_ENTRIES_TABLE'])
 notifications_table = dynamodb.Table(os.environ['USER_NOTIFICATIONS_TABLE'])
-sns = boto3.client('sns')
+
+# Candidates read per index page while looking for a ticket to claim
+CLAIM_PAGE_SIZE = 10
 
 class DecimalEncoder(json.JSONEncoder):
     def default(self, obj):
@@ -15,34 +21,19 @@ class DecimalEncoder(json.JSONEncoder):
             return int(obj)
         return super(DecimalEncoder, self).default(obj)
 
-def send_your_turn_notification(ticket_number):
+def send_your_turn_notification(queue_id, ticket_number):
     """
-    Send immediate notification that it's the user's turn.
+    Queue the notification that it's the user's turn; the outbox drain
+    worker delivers it within seconds.
     """
     try:
         notif_resp = notifications_table.get_item(Key={'ticketNumber': ticket_number})
         
         if 'Item' in notif_resp:
             notif_record = notif_resp['Item']
-            topic_arn = notif_record.get('topicArn')
-            
-            if topic_arn and topic_arn != 'NONE':
-                message = f"""
-🎉 YOUR TURN HAS ARRIVED!
-
-Ticket Number: {ticket_number}
-
-Please proceed to the service counter IMMEDIATELY.
-
-Thank you for your patience!
-- QueueEscape Team
-                """
-                
-                sns.publish(
-                    TopicArn=topic_arn,
-                    Message=message,
-                    Subject="🔔 YOUR TURN - Please Proceed Now!"
-                )
+            if notif_record.get('subscriptionArn') and notif_record.get('subscriptionConfirmed'):
+                subject, message = templates.render(queue_id, templates.YOUR_TURN, ticket_number)
+                outbox.enqueue(ticket_number, outbox.YOUR_TURN_MILESTONE, subject, message)
                 
                 # Update notification record
                 notifications_table.update_item(
@@ -51,43 +42,103 @@ Thank you for your patience!
                     ExpressionAttributeValues={':pos': 0}
                 )
                 
-                print(f"Sent 'your turn' notification for {ticket_number}")
+                print(f"Queued 'your turn' notification for {ticket_number}")
                 
     except Exception as e:
         print(f"Error sending your-turn notification: {str(e)}")
 
+def claim_next_ticket(queue_id):
+    """
+    Claim the oldest WAITING ticket in the queue for this staff member.
+    The update only succeeds while the ticket is still WAITING, so two staff
+    calling "next" together never get the same ticket: the loser moves on to
+    the next candidate. Returns the claimed ticket, or None if the line is empty.
+    """
+    candidates = iter_items(
+        entries_table.query,
+        page_size=CLAIM_PAGE_SIZE,
+        IndexName=STATUS_INDEX,
+        KeyConditionExpression=Key('queueId').eq(queue_id) & Key('statusOrder').begins_with('WAITING#')
+    )
+    for candidate in candidates:
+        claimed = {
+            'status': 'BEING_SERVED',
+            'statusOrder': status_order('BEING_SERVED', candidate['sequence']),
+            'servedAt': int(time.time())
+        }
+        # The claim, the rank change and the departure commit together
+        claim = {
+            'Update': {
+                'TableName': entries_table.name,
+                'Key': {'queueId': queue_id, 'ticketNumber': candidate['ticketNumber']},
+                'UpdateExpression': "set #s = :val, statusOrder = :order, servedAt = :now",
+                'ConditionExpression': "#s = :waiting",
+                'ExpressionAttributeNames': {'#s': 'status'},
+                'ExpressionAttributeValues': {
+                    ':val': claimed['status'],
+                    ':waiting': 'WAITING',
+                    ':order': claimed['statusOrder'],
+                    ':now': claimed['servedAt']
+                }
+            }
+        }
+        if not ranks.write_with_rank(claim, queue_id, candidate['sequence'], -1,
+                                     also=[progress.departure_operation(queue_id)]):
+            # Another counter claimed it first
+            continue
+        
+        next_person = dict(candidate, **claimed)
+        return next_person
+    
+    return None
+
+def requesting_counter(event, body):
+    """
+    The counter calling "next": an explicit counterId, else the signed-in
+    staff member (Cognito sub), so each staff login counts as one counter.
+    """
+    if 'counterId' in body:
+        return body['counterId']
+    claims = ((event.get('requestContext') or {}).get('authorizer') or {}).get('claims') or {}
+    return claims.get('sub', counters.DEFAULT_COUNTER_ID)
+
 def lambda_handler(event, context):
     try:
         body = json.loads(event.get('body', '{}'))
         queue_id = body.get('queueId', 'main_queue')        
+        counter_id = requesting_counter(event, body)
         
-        # Find oldest WAITING ticket
-        scan_resp = entries_table.scan(
-            FilterExpression=Key('status').eq('WAITING') & Key('queueId').eq(queue_id)
-        )
-        items = scan_resp.get('Items', [])
+        if not counters.is_valid(counter_id):
+            return {
+                'statusCode': 400,
+                'headers': {
+                    'Access-Control-Allow-Origin': '*',
+                    'Access-Control-Allow-Headers': 'Content-Type',
+                    'Access-Control-Allow-Methods': 'OPTIONS,GET,POST',
+                    'Content-Type': 'application/json'
+                },
+                'body': json.dumps({'error': 'counterId must be 1-64 letters, digits, - or _'})
+            }
+        
+        # Claim oldest WAITING ticket (index is ordered by sequence)
+        next_person = claim_next_ticket(queue_id)
         
-        if not items:
+        # This counter is staffed; the ETA model divides by active counters.
+        # Only feeds the estimate, so it never fails the call
+        try:
+            counters.heartbeat(queue_id, counter_id)
+        except Exception as e:
+            print(f"Error recording heartbeat for counter {counter_id}: {str(e)}")
+        
+        if not next_person:
             return {
                 'statusCode': 200, 
                 'headers': {'Access-Control-Allow-Origin': '*'},
                 'body': json.dumps({'message': 'No waiting tickets'})
             }
-            
-        # Sort to find the first one
-        items.sort(key=lambda x: x['joinTime'])
-        next_person = items[0]
-        
-        # Update Status to BEING_SERVED
-        entries_table.update_item(
-            Key={'queueId': queue_id, 'ticketNumber': next_person['ticketNumber']},
-            UpdateExpression="set #s = :val",
-            ExpressionAttributeNames={'#s': 'status'},
-            ExpressionAttributeValues={':val': 'BEING_SERVED'}
-        )
         
         # Send immediate notification
-        send_your_turn_notification(next_person['ticketNumber'])
+        send_your_turn_notification(queue_id, next_person['ticketNumber'])
 
         return {
             'statusCode': 200,
@@ -0,0 +1,16 @@
+import json
+from queue_common import notifier
+
+def lambda_handler(event, context):
+    """
+    Triggered periodically by EventBridge. Marks UserNotifications records
+    whose email subscription has been confirmed, so the notification path
+    can skip unconfirmed recipients without asking SNS.
+    """
+    confirmed = notifier.sync_confirmations()
+
+    print(f"Confirmed {confirmed} subscriptions")
+    return {
+        'statusCode': 200,
+        'body': json.dumps({'subscriptionsConfirmed': confirmed})
+    }
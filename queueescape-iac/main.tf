@@ -5,6 +5,10 @@ resource "aws_dynamodb_table" "queue_entries" {
   hash_key  = "queueId"
   range_key = "ticketNumber"
 
+  # Change events drive the queue_events notification consumer
+  stream_enabled   = true
+  stream_view_type = "NEW_AND_OLD_IMAGES"
+
   attribute {
     name = "queueId"
     type = "S"
@@ -15,11 +19,55 @@ resource "aws_dynamodb_table" "queue_entries" {
     type = "S"
   }
 
+  # statusOrder = "<status>#<zero-padded sequence>", so one Query per queue can
+  # count or page through the WAITING line in join order. COMPLETED tickets
+  # drop the attribute and fall out of the index.
+  attribute {
+    name = "statusOrder"
+    type = "S"
+  }
+
+  global_secondary_index {
+    name            = "QueueStatusIndex"
+    hash_key        = "queueId"
+    range_key       = "statusOrder"
+    projection_type = "ALL"
+  }
+
   tags = {
     Name = "QueueEntries"
   }
 }
 
+# Completed tickets are moved here by staff_complete so QueueEntries only
+# holds live tickets. Rows expire automatically after the retention window.
+resource "aws_dynamodb_table" "queue_entries_archive" {
+  name         = "QueueEntriesArchive"
+  billing_mode = "PAY_PER_REQUEST"
+
+  hash_key  = "queueId"
+  range_key = "ticketNumber"
+
+  attribute {
+    name = "queueId"
+    type = "S"
+  }
+
+  attribute {
+    name = "ticketNumber"
+    type = "S"
+  }
+
+  ttl {
+    attribute_name = "expiresAt"
+    enabled        = true
+  }
+
+  tags = {
+    Name = "QueueEntriesArchive"
+  }
+}
+
 resource "aws_dynamodb_table" "queue_stats" {
   name         = "QueueStats"
   billing_mode = "PAY_PER_REQUEST"
@@ -36,6 +84,26 @@ resource "aws_dynamodb_table" "queue_stats" {
   }
 }
 
+# Per-queue structures derived from the entries (rank trees, service-time
+# sketches, active counters, ETA vectors), kept apart from QueueStats so
+# that scans of the queues' settings and counters never read them and the
+# writes to QueueStats stay small.
+resource "aws_dynamodb_table" "queue_aggregates" {
+  name         = "QueueAggregates"
+  billing_mode = "PAY_PER_REQUEST"
+
+  hash_key = "aggregateId"
+
+  attribute {
+    name = "aggregateId"
+    type = "S"
+  }
+
+  tags = {
+    Name = "QueueAggregates"
+  }
+}
+
 # NEW: Table to track user notification preferences and SNS topic ARNs
 resource "aws_dynamodb_table" "user_notifications" {
   name         = "UserNotifications"
@@ -53,13 +121,104 @@ resource "aws_dynamodb_table" "user_notifications" {
     type = "S"
   }
 
+  attribute {
+    name = "awaitingConfirmation"
+    type = "S"
+  }
+
+  attribute {
+    name = "registeredAt"
+    type = "N"
+  }
+
   global_secondary_index {
     name            = "EmailIndex"
     hash_key        = "email"
     projection_type = "ALL"
   }
 
+  # Sparse: only records whose email subscription is not yet confirmed
+  # carry awaitingConfirmation, so the confirmation sync never scans
+  global_secondary_index {
+    name               = "UnconfirmedIndex"
+    hash_key           = "awaitingConfirmation"
+    range_key          = "registeredAt"
+    projection_type    = "INCLUDE"
+    non_key_attributes = ["subscriptionArn", "queueId"]
+  }
+
   tags = {
     Name = "UserNotifications"
   }
-}
\ No newline at end of file
+}
+
+# One row per email address subscribed to the shared notification topic:
+# its subscription ARN and the set of its live tickets (see subscriptions.py).
+resource "aws_dynamodb_table" "email_subscriptions" {
+  name         = "EmailSubscriptions"
+  billing_mode = "PAY_PER_REQUEST"
+
+  hash_key = "email"
+
+  attribute {
+    name = "email"
+    type = "S"
+  }
+
+  tags = {
+    Name = "EmailSubscriptions"
+  }
+}
+
+# Notifications waiting to be delivered. Producers write one row per
+# (ticketNumber, milestone) with a conditional put; DrainOutboxLambda reads
+# new rows from the stream and publishes them. outboxStatus is only present
+# while a row is pending ("PENDING#<shard>", spread over several partitions)
+# or dead-lettered ("FAILED"), so PendingIndex holds just the undelivered
+# backlog.
+resource "aws_dynamodb_table" "notification_outbox" {
+  name         = "NotificationOutbox"
+  billing_mode = "PAY_PER_REQUEST"
+
+  hash_key  = "ticketNumber"
+  range_key = "milestone"
+
+  stream_enabled   = true
+  stream_view_type = "NEW_IMAGE"
+
+  attribute {
+    name = "ticketNumber"
+    type = "S"
+  }
+
+  attribute {
+    name = "milestone"
+    type = "N"
+  }
+
+  attribute {
+    name = "outboxStatus"
+    type = "S"
+  }
+
+  attribute {
+    name = "createdAt"
+    type = "N"
+  }
+
+  global_secondary_index {
+    name            = "PendingIndex"
+    hash_key        = "outboxStatus"
+    range_key       = "createdAt"
+    projection_type = "ALL"
+  }
+
+  ttl {
+    attribute_name = "expiresAt"
+    enabled        = true
+  }
+
+  tags = {
+    Name = "NotificationOutbox"
+  }
+}
@@ -42,7 +42,7 @@ echo -e "\n${BLUE}━━━━━━━━━━━━━━━━━━━━
 echo -e "${BOLD}1. Checking DynamoDB Tables${NC}"
 echo -e "${BLUE}━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━${NC}"
 
-TABLES=("QueueEntries" "QueueStats" "UserNotifications")
+TABLES=("QueueEntries" "QueueEntriesArchive" "QueueStats" "UserNotifications" "EmailSubscriptions")
 
 for table in "${TABLES[@]}"; do
     echo -n "   Checking $table... "
@@ -93,12 +93,16 @@ else
     ((CHECKS_FAILED++))
 fi
 
-echo -n "   User-specific topics... "
-USER_TOPIC_COUNT=$(aws sns list-topics --query "Topics[?contains(TopicArn, 'QueueUser-')]" --output json | jq '. | length')
-if [ "$USER_TOPIC_COUNT" -gt 0 ]; then
-    echo -e "${YELLOW}⚠️  $USER_TOPIC_COUNT active${NC}"
+echo -n "   Shared user notifications topic... "
+USER_TOPIC=$(aws sns list-topics --query "Topics[?contains(TopicArn, 'queueescape-user-notifications')].TopicArn" --output text)
+if [ -n "$USER_TOPIC" ]; then
+    echo -e "${GREEN}✅ FOUND${NC}"
+    USER_SUB_COUNT=$(aws sns list-subscriptions-by-topic --topic-arn "$USER_TOPIC" --output json | jq '.Subscriptions | length')
+    echo -e "      ${CYAN}$USER_SUB_COUNT email subscription(s)${NC}"
+    ((CHECKS_PASSED++))
 else
-    echo -e "${CYAN}ℹ️  None (normal if no active users)${NC}"
+    echo -e "${RED}❌ NOT FOUND${NC}"
+    ((CHECKS_FAILED++))
 fi
 
 # ============================================================================
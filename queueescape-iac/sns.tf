@@ -8,7 +8,18 @@ resource "aws_sns_topic" "alerts" {
 }
 
 # This is a general topic for system alerts
-# User-specific topics will be created dynamically by Lambda
+
+# Shared topic for customer notifications. Each email address has one
+# subscription whose filter policy lists its live tickets (ticketNumber
+# message attribute), so one topic serves every ticket.
+resource "aws_sns_topic" "user_notifications" {
+  name         = "queueescape-user-notifications"
+  display_name = "QueueEscape"
+
+  tags = {
+    Name = "queueescape-user-notifications"
+  }
+}
 
 output "alerts_topic_arn" {
   value       = aws_sns_topic.alerts.arn
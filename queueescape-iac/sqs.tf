@@ -0,0 +1,25 @@
+# Per-queue notification work items sent by SendNotificationsLambda and
+# consumed by NotificationWorkerLambda, so queues are evaluated in parallel.
+resource "aws_sqs_queue" "notification_work_dlq" {
+  name                      = "queueescape-notification-work-dlq"
+  message_retention_seconds = 1209600
+
+  tags = {
+    Name = "queueescape-notification-work-dlq"
+  }
+}
+
+resource "aws_sqs_queue" "notification_work" {
+  name                       = "queueescape-notification-work"
+  visibility_timeout_seconds = 360 # 6x the worker timeout
+  message_retention_seconds  = 3600
+
+  redrive_policy = jsonencode({
+    deadLetterTargetArn = aws_sqs_queue.notification_work_dlq.arn
+    maxReceiveCount     = 3
+  })
+
+  tags = {
+    Name = "queueescape-notification-work"
+  }
+}
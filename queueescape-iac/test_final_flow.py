@@ -339,7 +339,7 @@ def test_dynamodb_tables():
     """Verify all required DynamoDB tables exist"""
     print_test("Test 1.4: Checking DynamoDB Tables")
     
-    required_tables = ['QueueEntries', 'QueueStats', 'UserNotifications']
+    required_tables = ['QueueEntries', 'QueueEntriesArchive', 'QueueStats', 'UserNotifications', 'EmailSubscriptions']
     all_exist = True
     
     for table_name in required_tables:
@@ -403,13 +403,19 @@ def test_sns_topic():
         topics = response.get('Topics', [])
         
         alerts_topic = [t for t in topics if 'queueescape-alerts' in t['TopicArn']]
+        # Customers subscribe to one shared topic, filtered by ticket
+        user_topic = [t for t in topics if 'queueescape-user-notifications' in t['TopicArn']]
         
-        if alerts_topic:
+        if alerts_topic and user_topic:
             print_success(f"  ✓ Main alerts topic exists")
+            print_success(f"  ✓ Shared user notifications topic exists")
             test_passed()
             return True
         else:
-            print_error("  ✗ Main alerts topic not found")
+            if not alerts_topic:
+                print_error("  ✗ Main alerts topic not found")
+            if not user_topic:
+                print_error("  ✗ Shared user notifications topic not found")
             test_failed()
             return False
             
@@ -919,7 +925,7 @@ def test_staff_complete(auth, ticket_number):
         if response.status_code == 200:
             print_success("Service completed")
             
-            # Verify status change
+            # Completed tickets move from QueueEntries to the archive
             time.sleep(2)
             
             entries_table = dynamodb.Table('QueueEntries')
@@ -928,13 +934,21 @@ def test_staff_complete(auth, ticket_number):
             )
             
             if 'Item' in entry:
-                status = entry['Item'].get('status')
-                
-                if status == 'COMPLETED':
-                    print_success("  ✓ Status updated to COMPLETED")
-                else:
-                    print_warning(f"  Status is {status}")
-                    test_warning()
+                print_warning(f"  Ticket still in QueueEntries (status {entry['Item'].get('status')})")
+                test_warning()
+            else:
+                print_success("  ✓ Ticket removed from QueueEntries")
+            
+            archive_table = dynamodb.Table('QueueEntriesArchive')
+            archived = archive_table.get_item(
+                Key={'queueId': QUEUE_ID, 'ticketNumber': ticket_number}
+            )
+            
+            if archived.get('Item', {}).get('status') == 'COMPLETED':
+                print_success("  ✓ Ticket archived as COMPLETED")
+            else:
+                print_warning("  Ticket not found in QueueEntriesArchive")
+                test_warning()
             
             test_passed()
             return True
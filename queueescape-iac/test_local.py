@@ -79,7 +79,7 @@ def test_dynamodb_tables():
     """Verify all required DynamoDB tables exist"""
     print_test("Test 1: Checking DynamoDB Tables")
     
-    required_tables = ['QueueEntries', 'QueueStats', 'UserNotifications']
+    required_tables = ['QueueEntries', 'QueueEntriesArchive', 'QueueStats', 'UserNotifications', 'EmailSubscriptions']
     
     for table_name in required_tables:
         try:
@@ -164,10 +164,14 @@ def test_sns_topic():
             test_failed()
             return False
         
-        # Check for any user topics
-        user_topics = [t for t in topics if 'QueueUser-' in t['TopicArn']]
-        if user_topics:
-            print_info(f"Found {len(user_topics)} existing user topics")
+        # Customers subscribe to one shared topic, filtered by ticket
+        user_topic = [t for t in topics if 'queueescape-user-notifications' in t['TopicArn']]
+        if user_topic:
+            print_success(f"Shared user notifications topic exists: {user_topic[0]['TopicArn']}")
+        else:
+            print_error("Shared user notifications topic not found")
+            test_failed()
+            return False
         
         return True
         
@@ -217,8 +221,8 @@ def test_eventbridge_rule():
 # ============================================================================
 
 def test_join_queue():
-    """Test joining the queue and SNS topic creation"""
-    print_test("\nTest 5: Testing Queue Join & SNS Topic Creation")
+    """Test joining the queue and the email subscription"""
+    print_test("\nTest 5: Testing Queue Join & Email Subscription")
     
     try:
         # Invoke JoinQueue Lambda directly
@@ -264,37 +268,39 @@ def test_join_queue():
                 test_failed()
                 return None
             
-            # Check UserNotifications
+            # Check UserNotifications; QueueEventsLambda creates the record
+            # from the QueueEntries stream, a few seconds after the join
             notif_table = dynamodb.Table('UserNotifications')
-            notif = notif_table.get_item(
-                Key={'ticketNumber': ticket_number}
-            )
+            notif = {}
+            for _ in range(10):
+                notif = notif_table.get_item(
+                    Key={'ticketNumber': ticket_number}
+                )
+                if 'Item' in notif:
+                    break
+                time.sleep(2)
             
             if 'Item' in notif:
                 print_success(f"  ✓ Entry found in UserNotifications table")
-                topic_arn = notif['Item'].get('topicArn')
-                print_info(f"    Topic ARN: {topic_arn}")
+                subscription_arn = notif['Item'].get('subscriptionArn')
+                print_info(f"    Subscription ARN: {subscription_arn}")
                 
-                # Verify SNS topic exists
-                if topic_arn and topic_arn != 'NONE':
+                # Verify the email's subscription on the shared topic
+                # delivers this ticket's messages
+                if subscription_arn:
                     try:
-                        attrs = sns.get_topic_attributes(TopicArn=topic_arn)
-                        print_success(f"  ✓ SNS topic verified")
-                        
-                        # Check subscriptions
-                        subs = sns.list_subscriptions_by_topic(TopicArn=topic_arn)
-                        if subs['Subscriptions']:
-                            print_success(f"  ✓ Found {len(subs['Subscriptions'])} subscription(s)")
-                            for sub in subs['Subscriptions']:
-                                print_info(f"    - {sub['Protocol']}: {sub['Endpoint']} ({sub['SubscriptionArn']})")
-                        else:
-                            print_warning(f"  No subscriptions yet")
+                        attrs = sns.get_subscription_attributes(SubscriptionArn=subscription_arn)['Attributes']
+                        print_success(f"  ✓ SNS subscription verified")
+                        print_info(f"    Filter policy: {attrs.get('FilterPolicy')}")
+                        if ticket_number not in attrs.get('FilterPolicy', ''):
+                            print_warning(f"  Filter policy does not include {ticket_number} yet")
+                            test_warning()
                     except ClientError as e:
-                        print_error(f"  ✗ SNS topic not found: {e}")
+                        print_error(f"  ✗ SNS subscription not found: {e}")
                         test_failed()
                         return None
                 else:
-                    print_error(f"  ✗ Invalid topic ARN")
+                    print_error(f"  ✗ No subscription ARN")
                     test_failed()
                     return None
             else:
@@ -444,13 +450,13 @@ def test_staff_complete(ticket_number):
         
         print_info("Completing ticket and cleaning up...")
         
-        # Get topic ARN before deletion
+        # Get the subscription ARN before deletion
         notif_table = dynamodb.Table('UserNotifications')
         notif = notif_table.get_item(Key={'ticketNumber': ticket_number})
-        topic_arn = None
+        subscription_arn = None
         
         if 'Item' in notif:
-            topic_arn = notif['Item'].get('topicArn')
+            subscription_arn = notif['Item'].get('subscriptionArn')
         
         response = lambda_client.invoke(
             FunctionName='StaffCompleteLambda',
@@ -463,7 +469,7 @@ def test_staff_complete(ticket_number):
         if result.get('statusCode') == 200:
             print_success("Staff Complete executed successfully")
             
-            # Verify status changed to COMPLETED
+            # Completed tickets move from QueueEntries to the archive
             time.sleep(2)
             
             entries_table = dynamodb.Table('QueueEntries')
@@ -472,14 +478,21 @@ def test_staff_complete(ticket_number):
             )
             
             if 'Item' in entry:
-                status = entry['Item'].get('status')
-                print_info(f"  Updated Status: {status}")
-                
-                if status == 'COMPLETED':
-                    print_success("  ✓ Status updated to COMPLETED")
-                else:
-                    print_warning(f"  Status is {status}, expected COMPLETED")
-                    test_warning()
+                print_warning(f"  Ticket still in QueueEntries (status {entry['Item'].get('status')})")
+                test_warning()
+            else:
+                print_success("  ✓ Ticket removed from QueueEntries")
+            
+            archive_table = dynamodb.Table('QueueEntriesArchive')
+            archived = archive_table.get_item(
+                Key={'queueId': QUEUE_ID, 'ticketNumber': ticket_number}
+            )
+            
+            if archived.get('Item', {}).get('status') == 'COMPLETED':
+                print_success("  ✓ Ticket archived as COMPLETED")
+            else:
+                print_warning("  Ticket not found in QueueEntriesArchive")
+                test_warning()
             
             # Verify notification record deleted
             notif = notif_table.get_item(Key={'ticketNumber': ticket_number})
@@ -490,17 +503,20 @@ def test_staff_complete(ticket_number):
                 print_warning("  UserNotifications record still exists")
                 test_warning()
             
-            # Verify SNS topic deleted
-            if topic_arn and topic_arn != 'NONE':
+            # The email's subscription goes with its last live ticket
+            subscriptions_table = dynamodb.Table('EmailSubscriptions')
+            if 'Item' in subscriptions_table.get_item(Key={'email': TEST_EMAIL}):
+                print_info("  Email still has live tickets, subscription kept")
+            elif subscription_arn:
                 try:
-                    sns.get_topic_attributes(TopicArn=topic_arn)
-                    print_warning("  SNS topic still exists (may take time to delete)")
+                    sns.get_subscription_attributes(SubscriptionArn=subscription_arn)
+                    print_warning("  SNS subscription still exists (may take time to delete)")
                     test_warning()
                 except ClientError as e:
                     if 'NotFound' in str(e):
-                        print_success("  ✓ SNS topic deleted")
+                        print_success("  ✓ SNS subscription removed")
                     else:
-                        print_error(f"  Error checking topic: {e}")
+                        print_error(f"  Error checking subscription: {e}")
             
             test_passed()
             return True
@@ -5,10 +5,36 @@ import sys
 import unittest
 import time
 from datetime import datetime
+from decimal import Decimal
+from boto3.dynamodb.conditions import Key
+from boto3.dynamodb.types import TypeSerializer
 from moto import mock_aws
 
 # Add lambda_src to path so we can import the functions
 sys.path.append('./lambda_src')
+sys.path.append('./lambda_src/common/python')
+
+def stream_record(event_name, old_image=None, new_image=None, keys=('queueId', 'ticketNumber')):
+    """Local stand-in for a DynamoDB stream record (QueueEntries keys by default)."""
+    serializer = TypeSerializer()
+    image = new_image or old_image
+    change = {'Keys': {k: serializer.serialize(image[k]) for k in keys}}
+    if old_image:
+        change['OldImage'] = {k: serializer.serialize(v) for k, v in old_image.items()}
+    if new_image:
+        change['NewImage'] = {k: serializer.serialize(v) for k, v in new_image.items()}
+    return {'eventName': event_name, 'dynamodb': change}
+
+class FakeContext:
+    """Local stand-in for the Lambda context: plenty of time for `calls` checks, then nearly none."""
+    function_name = 'SendNotificationsLambda'
+
+    def __init__(self, calls):
+        self.calls = calls
+
+    def get_remaining_time_in_millis(self):
+        self.calls -= 1
+        return 60000 if self.calls >= 0 else 1000
 
 @mock_aws
 class TestQueueSystem(unittest.TestCase):
@@ -17,8 +43,15 @@ class TestQueueSystem(unittest.TestCase):
         """Runs before every test. Sets up a fake DynamoDB and SNS."""
         # 1. Setup Environment Variables
         os.environ['QUEUE_ENTRIES_TABLE'] = 'QueueEntries'
+        os.environ['QUEUE_ARCHIVE_TABLE'] = 'QueueEntriesArchive'
         os.environ['QUEUE_STATS_TABLE'] = 'QueueStats'
+        os.environ['QUEUE_AGGREGATES_TABLE'] = 'QueueAggregates'
+        os.environ['USER_NOTIFICATIONS_TABLE'] = 'UserNotifications'
+        os.environ['EMAIL_SUBSCRIPTIONS_TABLE'] = 'EmailSubscriptions'
+        os.environ['NOTIFICATION_OUTBOX_TABLE'] = 'NotificationOutbox'
         os.environ['ALERTS_TOPIC_ARN'] = 'arn:aws:sns:us-east-1:123456789012:queueescape-alerts'
+        os.environ['USER_NOTIFICATIONS_TOPIC_ARN'] = 'arn:aws:sns:us-east-1:123456789012:queueescape-user-notifications'
+        os.environ['MIN_NOTIFICATION_INTERVAL_SECONDS'] = '0'
         os.environ['AWS_DEFAULT_REGION'] = 'us-east-1'
 
         # 2. Create Fake DynamoDB Tables
@@ -26,6 +59,22 @@ class TestQueueSystem(unittest.TestCase):
         self.entries_table = self.dynamodb.create_table(
             TableName='QueueEntries',
             KeySchema=[{'AttributeName': 'queueId', 'KeyType': 'HASH'}, {'AttributeName': 'ticketNumber', 'KeyType': 'RANGE'}],
+            AttributeDefinitions=[
+                {'AttributeName': 'queueId', 'AttributeType': 'S'},
+                {'AttributeName': 'ticketNumber', 'AttributeType': 'S'},
+                {'AttributeName': 'statusOrder', 'AttributeType': 'S'}
+            ],
+            GlobalSecondaryIndexes=[{
+                'IndexName': 'QueueStatusIndex',
+                'KeySchema': [{'AttributeName': 'queueId', 'KeyType': 'HASH'}, {'AttributeName': 'statusOrder', 'KeyType': 'RANGE'}],
+                'Projection': {'ProjectionType': 'ALL'},
+                'ProvisionedThroughput': {'ReadCapacityUnits': 5, 'WriteCapacityUnits': 5}
+            }],
+            ProvisionedThroughput={'ReadCapacityUnits': 5, 'WriteCapacityUnits': 5}
+        )
+        self.archive_table = self.dynamodb.create_table(
+            TableName='QueueEntriesArchive',
+            KeySchema=[{'AttributeName': 'queueId', 'KeyType': 'HASH'}, {'AttributeName': 'ticketNumber', 'KeyType': 'RANGE'}],
             AttributeDefinitions=[{'AttributeName': 'queueId', 'AttributeType': 'S'}, {'AttributeName': 'ticketNumber', 'AttributeType': 'S'}],
             ProvisionedThroughput={'ReadCapacityUnits': 5, 'WriteCapacityUnits': 5}
         )
@@ -35,10 +84,90 @@ class TestQueueSystem(unittest.TestCase):
             AttributeDefinitions=[{'AttributeName': 'queueId', 'AttributeType': 'S'}],
             ProvisionedThroughput={'ReadCapacityUnits': 1, 'WriteCapacityUnits': 1}
         )
+        self.aggregates_table = self.dynamodb.create_table(
+            TableName='QueueAggregates',
+            KeySchema=[{'AttributeName': 'aggregateId', 'KeyType': 'HASH'}],
+            AttributeDefinitions=[{'AttributeName': 'aggregateId', 'AttributeType': 'S'}],
+            ProvisionedThroughput={'ReadCapacityUnits': 5, 'WriteCapacityUnits': 5}
+        )
+        self.notifications_table = self.dynamodb.create_table(
+            TableName='UserNotifications',
+            KeySchema=[{'AttributeName': 'ticketNumber', 'KeyType': 'HASH'}],
+            AttributeDefinitions=[
+                {'AttributeName': 'ticketNumber', 'AttributeType': 'S'},
+                {'AttributeName': 'awaitingConfirmation', 'AttributeType': 'S'},
+                {'AttributeName': 'registeredAt', 'AttributeType': 'N'}
+            ],
+            GlobalSecondaryIndexes=[{
+                'IndexName': 'UnconfirmedIndex',
+                'KeySchema': [{'AttributeName': 'awaitingConfirmation', 'KeyType': 'HASH'}, {'AttributeName': 'registeredAt', 'KeyType': 'RANGE'}],
+                'Projection': {'ProjectionType': 'INCLUDE', 'NonKeyAttributes': ['subscriptionArn', 'queueId']},
+                'ProvisionedThroughput': {'ReadCapacityUnits': 5, 'WriteCapacityUnits': 5}
+            }],
+            ProvisionedThroughput={'ReadCapacityUnits': 5, 'WriteCapacityUnits': 5}
+        )
+        self.subscriptions_table = self.dynamodb.create_table(
+            TableName='EmailSubscriptions',
+            KeySchema=[{'AttributeName': 'email', 'KeyType': 'HASH'}],
+            AttributeDefinitions=[{'AttributeName': 'email', 'AttributeType': 'S'}],
+            ProvisionedThroughput={'ReadCapacityUnits': 5, 'WriteCapacityUnits': 5}
+        )
+        self.outbox_table = self.dynamodb.create_table(
+            TableName='NotificationOutbox',
+            KeySchema=[{'AttributeName': 'ticketNumber', 'KeyType': 'HASH'}, {'AttributeName': 'milestone', 'KeyType': 'RANGE'}],
+            AttributeDefinitions=[
+                {'AttributeName': 'ticketNumber', 'AttributeType': 'S'},
+                {'AttributeName': 'milestone', 'AttributeType': 'N'},
+                {'AttributeName': 'outboxStatus', 'AttributeType': 'S'},
+                {'AttributeName': 'createdAt', 'AttributeType': 'N'}
+            ],
+            GlobalSecondaryIndexes=[{
+                'IndexName': 'PendingIndex',
+                'KeySchema': [{'AttributeName': 'outboxStatus', 'KeyType': 'HASH'}, {'AttributeName': 'createdAt', 'KeyType': 'RANGE'}],
+                'Projection': {'ProjectionType': 'ALL'},
+                'ProvisionedThroughput': {'ReadCapacityUnits': 5, 'WriteCapacityUnits': 5}
+            }],
+            ProvisionedThroughput={'ReadCapacityUnits': 5, 'WriteCapacityUnits': 5}
+        )
+
+        # Warm-container caches must not leak between tests
+        from queue_common import config_cache, templates, work_queue
+        config_cache.clear()
+        templates.clear()
+        work_queue.take_local()
 
         # 3. Create Fake SNS
         self.sns = boto3.client('sns', region_name='us-east-1')
         self.sns.create_topic(Name='queueescape-alerts')
+        self.sns.create_topic(Name='queueescape-user-notifications')
+
+    def register_joined_tickets(self):
+        """Replay the QueueEntries INSERTs that QueueEventsLambda would receive,
+        then sync confirmations (moto confirms every subscription)."""
+        from queue_events import lambda_function as events_lambda
+        from sync_subscriptions import lambda_function as sync_lambda
+        items = self.entries_table.scan()['Items']
+        events_lambda.update_recipients([stream_record('INSERT', new_image=item) for item in items])
+        sync_lambda.lambda_handler({}, None)
+
+    def run_workers(self, context=None):
+        """Feed the in-process work items to NotificationWorkerLambda, as SQS would."""
+        from notification_worker import lambda_function as worker_lambda
+        from queue_common import work_queue
+        totals = {'ticketsProcessed': 0, 'notificationsQueued': 0}
+        items = work_queue.take_local()
+        if items:
+            event = {'Records': [{'body': json.dumps(item)} for item in items]}
+            body = json.loads(worker_lambda.lambda_handler(event, context)['body'])
+            totals = {k: body[k] for k in totals}
+        return totals
+
+    def run_scheduler(self):
+        """Run the dispatcher, then the workers on everything it dispatched."""
+        from send_notifications import lambda_function as notify_lambda
+        body = json.loads(notify_lambda.lambda_handler({}, None)['body'])
+        body.update(self.run_workers())
+        return body
 
     def test_multi_queue_isolation(self):
         print("\n--- TESTING MULTI-QUEUE ISOLATION ---")
@@ -132,5 +261,792 @@ class TestQueueSystem(unittest.TestCase):
         # Even if the math result is 5 (because of local time), getting the key proves logic worked.
         print(f"   Logic Used: {body['calculationMode']}")
         print("   Success: Settings applied and read by status lambda.")
+
+    def test_config_cache_versioning(self):
+        print("\n--- TESTING QUEUE CONFIG CACHE ---")
+
+        from queue_common import config_cache
+        from set_settings import lambda_function as settings_lambda
+
+        # 1. First read hits DynamoDB and is cached
+        settings_lambda.lambda_handler({'body': json.dumps({'peak_period': 'MORNING'})}, None)
+        config = config_cache.get_queue_config('main_queue')
+        self.assertEqual(config['config_peak_period'], 'MORNING')
+        self.assertEqual(config['configVersion'], 1)
+
+        # 2. A change made elsewhere is not seen until the TTL runs out...
+        settings_lambda.lambda_handler({'body': json.dumps({'peak_period': 'EVENING'})}, None)
+        self.assertEqual(config_cache.get_queue_config('main_queue')['config_peak_period'], 'MORNING')
+
+        # 3. ...unless a fresher item is observed
+        fresh = self.stats_table.get_item(Key={'queueId': 'main_queue'})['Item']
+        config_cache.observe('main_queue', fresh)
+        self.assertEqual(config_cache.get_queue_config('main_queue')['config_peak_period'], 'EVENING')
+
+        # 4. An older version never replaces a newer one
+        config_cache.observe('main_queue', config)
+        self.assertEqual(config_cache.get_queue_config('main_queue')['configVersion'], 2)
+
+        # 5. Without observing anything, the change shows once the TTL is up
+        settings_lambda.lambda_handler({'body': json.dumps({'peak_period': 'AFTERNOON'})}, None)
+        self.assertEqual(config_cache.get_queue_config('main_queue')['config_peak_period'], 'EVENING')
+        original_ttl = config_cache.CONFIG_TTL_SECONDS
+        config_cache.CONFIG_TTL_SECONDS = 0
+        self.addCleanup(setattr, config_cache, 'CONFIG_TTL_SECONDS', original_ttl)
+        self.assertEqual(config_cache.get_queue_config('main_queue')['config_peak_period'], 'AFTERNOON')
+        print("   Success: cache is bounded by its TTL and honours configVersion.")
+
+    def test_notification_positions_per_queue(self):
+        print("\n--- TESTING NOTIFICATION SCHEDULER POSITIONS ---")
+
+        from join_queue import lambda_function as join_lambda
+
+        # 1. Three users join "Registrar", two join "Cafeteria"
+        registrar = []
+        for i in range(3):
+            resp = join_lambda.lambda_handler({'body': json.dumps({'email': f"r{i}@test.com", 'queueId': 'Registrar'})}, None)
+            registrar.append(json.loads(resp['body'])['ticketNumber'])
+        for i in range(2):
+            join_lambda.lambda_handler({'body': json.dumps({'email': f"c{i}@test.com", 'queueId': 'Cafeteria'})}, None)
+        self.register_joined_tickets()
+
+        # 2. First run: everyone is inside the top milestone
+        print("1. Running scheduler...")
+        body = self.run_scheduler()
+        print(f"   Processed {body['ticketsProcessed']}, sent {body['notificationsQueued']}")
+        self.assertEqual(body['ticketsProcessed'], 5)
+        self.assertEqual(body['notificationsQueued'], 5)
+
+        # 3. Positions are per queue, in join order
+        record = self.notifications_table.get_item(Key={'ticketNumber': registrar[2]})['Item']
+        self.assertEqual(record['lastNotifiedPosition'], 2)
+
+        # 4. Second run: nothing moved, nothing sent
+        print("2. Running scheduler again...")
+        body = self.run_scheduler()
+        self.assertEqual(body['notificationsQueued'], 0)
+        print("   Success: no duplicate notifications.")
+
+    def test_notification_window_is_bounded_by_thresholds(self):
+        print("\n--- TESTING NOTIFICATION WINDOW ---")
+
+        from join_queue import lambda_function as join_lambda
+
+        # 1. Staff only cares about the top 3, six users are waiting
+        self.stats_table.put_item(Item={'queueId': 'SmallWindow', 'notification_thresholds': '3,1'})
+        for i in range(6):
+            join_lambda.lambda_handler({'body': json.dumps({'email': f"w{i}@test.com", 'queueId': 'SmallWindow'})}, None)
+        self.register_joined_tickets()
+
+        # 2. Only max(threshold) + 1 tickets are evaluated
+        body = self.run_scheduler()
+        print(f"   Processed {body['ticketsProcessed']} of 6 (Expected: 4)")
+        self.assertEqual(body['ticketsProcessed'], 4)
+        self.assertEqual(body['notificationsQueued'], 4)
+
+    def test_queue_events_notify_only_affected_queue(self):
+        print("\n--- TESTING EVENT-DRIVEN NOTIFICATIONS ---")
+
+        from join_queue import lambda_function as join_lambda
+        from staff_next import lambda_function as next_lambda
+        from queue_events import lambda_function as events_lambda
+
+        self.stats_table.put_item(Item={'queueId': 'Registrar', 'notification_thresholds': '2,1'})
+
+        # 1. Four users join; the stream delivers their INSERTs in one batch
+        tickets = []
+        for i in range(4):
+            resp = join_lambda.lambda_handler({'body': json.dumps({'email': f"e{i}@test.com", 'queueId': 'Registrar'})}, None)
+            tickets.append(json.loads(resp['body'])['ticketNumber'])
+        items = [self.entries_table.get_item(Key={'queueId': 'Registrar', 'ticketNumber': t})['Item'] for t in tickets]
+        inserts = {'Records': [stream_record('INSERT', new_image=item) for item in items]}
+
+        # Nobody has confirmed their email yet, so nothing is sent
+        body = json.loads(events_lambda.lambda_handler(inserts, None)['body'])
+        self.assertEqual(body['notificationsQueued'], 0)
+
+        # Once confirmations are synced, a redelivered batch notifies
+        from sync_subscriptions import lambda_function as sync_lambda
+        sync_lambda.lambda_handler({}, None)
+        body = json.loads(events_lambda.lambda_handler(inserts, None)['body'])
+        print(f"   After joins: sent {body['notificationsQueued']} (Expected: 3)")
+        self.assertEqual(body['notificationsQueued'], 3)
+
+        record = self.notifications_table.get_item(Key={'ticketNumber': tickets[0]})['Item']
+        self.assertTrue(record['subscriptionArn'].startswith('arn:aws:sns'))
+
+        # 2. Staff serves the first user; the MODIFY moves everyone up
+        next_lambda.lambda_handler({'body': json.dumps({'queueId': 'Registrar'})}, None)
+        served = self.entries_table.get_item(Key={'queueId': 'Registrar', 'ticketNumber': tickets[0]})['Item']
+        modify = {'Records': [stream_record('MODIFY', old_image=items[0], new_image=served)]}
+
+        body = json.loads(events_lambda.lambda_handler(modify, None)['body'])
+        print(f"   After next: sent {body['notificationsQueued']} (Expected: 2)")
+        self.assertEqual(body['notificationsQueued'], 2)
+
+        # 3. Archiving a COMPLETED ticket elsewhere does not touch any queue
+        completed = dict(items[0], queueId='Cafeteria', status='COMPLETED')
+        body = json.loads(events_lambda.lambda_handler({'Records': [stream_record('REMOVE', old_image=completed)]}, None)['body'])
+        self.assertEqual(body['ticketsProcessed'], 0)
+        print("   Success: only the changed queue was evaluated.")
+
+    def test_tickets_of_one_email_share_a_subscription(self):
+        print("\n--- TESTING ONE SUBSCRIPTION PER EMAIL ---")
+
+        from join_queue import lambda_function as join_lambda
+        from staff_complete import lambda_function as complete_lambda
+        from queue_events import lambda_function as events_lambda
+        from queue_common import channels
+
+        topic_arn = os.environ['USER_NOTIFICATIONS_TOPIC_ARN']
+
+        def filter_tickets():
+            subscriptions = self.sns.list_subscriptions_by_topic(TopicArn=topic_arn)['Subscriptions']
+            self.assertLessEqual(len(subscriptions), 1)
+            if not subscriptions:
+                return None
+            attributes = self.sns.get_subscription_attributes(SubscriptionArn=subscriptions[0]['SubscriptionArn'])['Attributes']
+            return sorted(json.loads(attributes['FilterPolicy'])['ticketNumber'])
+
+        # 1. The same customer takes tickets in two queues
+        tickets = {}
+        for queue_id in ('Pharmacy', 'Lab'):
+            resp = join_lambda.lambda_handler({'body': json.dumps({'email': 'twice@test.com', 'queueId': queue_id})}, None)
+            tickets[queue_id] = json.loads(resp['body'])['ticketNumber']
+        self.register_joined_tickets()
+
+        # One subscription whose filter covers both tickets
+        self.assertEqual(filter_tickets(), sorted(tickets.values()))
+        records = [self.notifications_table.get_item(Key={'ticketNumber': t})['Item'] for t in tickets.values()]
+        self.assertEqual(records[0]['subscriptionArn'], records[1]['subscriptionArn'])
+
+        # 2. Completing one ticket keeps the other subscribed
+        complete_lambda.lambda_handler({'body': json.dumps({'queueId': 'Pharmacy', 'ticketNumber': tickets['Pharmacy']})}, None)
+        self.assertEqual(filter_tickets(), [tickets['Lab']])
+
+        # 3. The last ticket removes the subscription
+        complete_lambda.lambda_handler({'body': json.dumps({'queueId': 'Lab', 'ticketNumber': tickets['Lab']})}, None)
+        self.assertIsNone(filter_tickets())
+        self.assertNotIn('Item', self.subscriptions_table.get_item(Key={'email': 'twice@test.com'}))
+
+        # 4. An SNS error on one record is reported, the rest of the batch still runs
+        inserts = []
+        for i, email in enumerate(['ok@test.com', 'broken@test.com']):
+            resp = join_lambda.lambda_handler({'body': json.dumps({'email': email, 'queueId': 'Lab'})}, None)
+            ticket = json.loads(resp['body'])['ticketNumber']
+            record = stream_record('INSERT', new_image=self.entries_table.get_item(Key={'queueId': 'Lab', 'ticketNumber': ticket})['Item'])
+            record['dynamodb']['SequenceNumber'] = str(100 + i)
+            inserts.append(record)
+
+        original_subscribe = channels.subscribe
+        def subscribe(email, ticket_numbers):
+            if email == 'broken@test.com':
+                raise RuntimeError('Throttled')
+            return original_subscribe(email, ticket_numbers)
+        channels.subscribe = subscribe
+        self.addCleanup(setattr, channels, 'subscribe', original_subscribe)
+
+        response = events_lambda.lambda_handler({'Records': inserts}, None)
+        self.assertEqual(response['batchItemFailures'], [{'itemIdentifier': '101'}])
+        self.assertEqual(json.loads(response['body'])['ticketsProcessed'], 2)
+        self.assertEqual(len(self.notifications_table.scan()['Items']), 1)
+
+        # 5. A subscription removed outside the app is replaced by the next ticket
+        channels.subscribe = original_subscribe
+        stored = self.subscriptions_table.get_item(Key={'email': 'ok@test.com'})['Item']
+        self.sns.unsubscribe(SubscriptionArn=stored['subscriptionArn'])
+        resp = join_lambda.lambda_handler({'body': json.dumps({'email': 'ok@test.com', 'queueId': 'Pharmacy'})}, None)
+        ticket = json.loads(resp['body'])['ticketNumber']
+        self.register_joined_tickets()
+        record = self.notifications_table.get_item(Key={'ticketNumber': ticket})['Item']
+        self.assertNotEqual(record['subscriptionArn'], stored['subscriptionArn'])
+        attributes = self.sns.get_subscription_attributes(SubscriptionArn=record['subscriptionArn'])['Attributes']
+        self.assertEqual(sorted(json.loads(attributes['FilterPolicy'])['ticketNumber']), sorted(stored['tickets'] | {ticket}))
+        print("   Success: one subscription per email, failures reported per record.")
+
+    def test_outbox_delivers_each_milestone_once(self):
+        print("\n--- TESTING NOTIFICATION OUTBOX ---")
+
+        from join_queue import lambda_function as join_lambda
+        from drain_outbox import lambda_function as drain_lambda
+        from queue_common import outbox
+
+        for i in range(3):
+            join_lambda.lambda_handler({'body': json.dumps({'email': f"o{i}@test.com", 'queueId': 'Outbox'})}, None)
+        self.register_joined_tickets()
+
+        # 1. Scheduler queues intents; a concurrent duplicate is rejected
+        body = self.run_scheduler()
+        self.assertEqual(body['notificationsQueued'], 3)
+        self.assertEqual(body['outboxDelivered'], 0)
+        entries = self.outbox_table.scan()['Items']
+        self.assertEqual(outbox.enqueue(entries[0]['ticketNumber'], entries[0]['milestone'], 's', 'm'), False)
+
+        # 2. The drain worker delivers the new stream rows
+        records = [stream_record('INSERT', new_image=entry, keys=('ticketNumber', 'milestone')) for entry in entries]
+        body = json.loads(drain_lambda.lambda_handler({'Records': records}, None)['body'])
+        print(f"   Delivered {body['notificationsDelivered']} (Expected: 3)")
+        self.assertEqual(body['notificationsDelivered'], 3)
+
+        # 3. Nothing is left pending and a replay of the batch sends nothing
+        for status in outbox.pending_statuses():
+            pending = self.outbox_table.query(IndexName='PendingIndex', KeyConditionExpression=Key('outboxStatus').eq(status))
+            self.assertEqual(pending['Count'], 0)
+        body = json.loads(drain_lambda.lambda_handler({'Records': records}, None)['body'])
+        self.assertEqual(body['notificationsDelivered'], 0)
+
+        # 4. A rerun of the scheduler queues nothing new
+        body = self.run_scheduler()
+        self.assertEqual(body['notificationsQueued'], 0)
+
+        # 5. A milestone another worker already recorded is not queued: the
+        #    outbox entry and the record commit together or not at all
+        from queue_common import notifier
+        ticket_number = entries[0]['ticketNumber']
+        self.notifications_table.update_item(
+            Key={'ticketNumber': ticket_number},
+            UpdateExpression="SET notificationsSent = list_append(notificationsSent, :m)",
+            ExpressionAttributeValues={':m': [99]}
+        )
+        planned = {'ticketNumber': ticket_number, 'milestone': 99, 'subject': 's', 'message': 'm',
+                   'position': 0, 'notifiedAt': 0, 'notificationsSent': [99]}
+        self.assertFalse(notifier.queue_notification(planned))
+        self.assertNotIn('Item', self.outbox_table.get_item(Key={'ticketNumber': ticket_number, 'milestone': 99}))
+        print("   Success: each milestone queued and delivered once.")
+
+    def test_outbox_dead_letters_undeliverable_entries(self):
+        print("\n--- TESTING OUTBOX DEAD LETTERS ---")
+
+        from queue_common import outbox
+
+        outbox.enqueue('T-dead', 5, 's', 'm')
+        outbox.enqueue('T-live', outbox.YOUR_TURN_MILESTONE, 's', 'm')
+        self.assertNotEqual(outbox.YOUR_TURN_MILESTONE, 0)
+
+        orig_publish, orig_backoff = outbox.channels.publish_many, outbox.BACKOFF_BASE_SECONDS
+        outbox.channels.publish_many = lambda notifications: set()
+        outbox.BACKOFF_BASE_SECONDS = 0
+        self.addCleanup(setattr, outbox.channels, 'publish_many', orig_publish)
+        self.addCleanup(setattr, outbox, 'BACKOFF_BASE_SECONDS', orig_backoff)
+
+        # 1. Each failed drain leaves the entries pending, until the attempts run out
+        for _ in range(outbox.MAX_DELIVERY_ATTEMPTS):
+            self.assertEqual(outbox.drain_pending(), 0)
+        statuses = {item['ticketNumber']: item['outboxStatus'] for item in self.outbox_table.scan()['Items']}
+        print(f"   Statuses after {outbox.MAX_DELIVERY_ATTEMPTS} failed drains: {statuses}")
+        self.assertEqual(statuses, {'T-dead': outbox.FAILED, 'T-live': outbox.FAILED})
+
+        # 2. Dead letters are out of the pending partitions
+        for status in outbox.pending_statuses():
+            pending = self.outbox_table.query(IndexName='PendingIndex', KeyConditionExpression=Key('outboxStatus').eq(status))
+            self.assertEqual(pending['Count'], 0)
+        print("   Success: undeliverable entries are dead-lettered.")
+
+    def test_scheduler_fans_out_and_resumes(self):
+        print("\n--- TESTING SCHEDULER FAN-OUT AND CHECKPOINTS ---")
+
+        from join_queue import lambda_function as join_lambda
+        from send_notifications import lambda_function as notify_lambda
+        from queue_common import work_queue
+
+        for queue_id in ('A', 'B', 'C'):
+            for i in range(2):
+                join_lambda.lambda_handler({'body': json.dumps({'email': f"{queue_id}{i}@test.com", 'queueId': queue_id})}, None)
+        self.register_joined_tickets()
+
+        # 1. A dispatcher already out of time checkpoints before sending anything
+        body = json.loads(notify_lambda.lambda_handler({}, FakeContext(calls=0))['body'])
+        self.assertFalse(body['complete'])
+        self.assertEqual(body['queuesDispatched'], 0)
+        checkpoint = self.stats_table.get_item(Key={'queueId': notify_lambda.CHECKPOINT_KEY})['Item']
+        self.assertEqual(checkpoint['resumeQueueId'], 'A')
+
+        # 2. The next run sends one work item per queue and clears the checkpoint
+        body = json.loads(notify_lambda.lambda_handler({}, None)['body'])
+        self.assertTrue(body['complete'])
+        self.assertEqual(body['queuesDispatched'], 3)
+        self.assertNotIn('Item', self.stats_table.get_item(Key={'queueId': notify_lambda.CHECKPOINT_KEY}))
+
+        # 3. The worker runs out of time after queue A and the first ticket of B
+        totals = self.run_workers(FakeContext(calls=5))
+        print(f"   First worker queued {totals['notificationsQueued']} (Expected: 3)")
+        self.assertEqual(totals['notificationsQueued'], 3)
+        handed_back = work_queue.take_local()
+        self.assertEqual([(i['queueId'], i['resumeAfterSequence']) for i in handed_back], [('B', 1), ('C', 0)])
+
+        # 4. The next worker picks up at B's second ticket, not from the top
+        work_queue.send(handed_back)
+        totals = self.run_workers()
+        print(f"   Resumed worker processed {totals['ticketsProcessed']} (Expected: 3)")
+        self.assertEqual(totals['ticketsProcessed'], 3)
+        self.assertEqual(totals['notificationsQueued'], 3)
+
+        # 5. Positions survive the resume: B's second ticket is at position 1
+        second = self.entries_table.query(KeyConditionExpression=Key('queueId').eq('B'))['Items']
+        second = max(second, key=lambda t: t['sequence'])
+        record = self.notifications_table.get_item(Key={'ticketNumber': second['ticketNumber']})['Item']
+        self.assertEqual(record['lastNotifiedPosition'], 1)
+        print("   Success: queues fanned out and the backlog drained across invocations.")
+
+    def test_crossed_milestones_are_coalesced(self):
+        print("\n--- TESTING MILESTONE COALESCING ---")
+
+        from join_queue import lambda_function as join_lambda
+        from staff_next import lambda_function as next_lambda
+        from queue_common import notifier
+
+        self.stats_table.put_item(Item={'queueId': 'Fast', 'notification_thresholds': '10,5,3,1'})
+        tickets = []
+        for i in range(9):
+            resp = join_lambda.lambda_handler({'body': json.dumps({'email': f"f{i}@test.com", 'queueId': 'Fast'})}, None)
+            tickets.append(json.loads(resp['body'])['ticketNumber'])
+        self.register_joined_tickets()
+
+        # 1. One notice per ticket, for the lowest milestone it has crossed
+        body = self.run_scheduler()
+        self.assertEqual(body['notificationsQueued'], 9)
+        entries = self.outbox_table.query(KeyConditionExpression=Key('ticketNumber').eq(tickets[4]))['Items']
+        self.assertEqual([int(e['milestone']) for e in entries], [5])
+        record = self.notifications_table.get_item(Key={'ticketNumber': tickets[4]})['Item']
+        self.assertEqual(sorted(record['notificationsSent']), [5, 10])
+        print(f"   Position 4 got one notice for milestone 5, marked {sorted(record['notificationsSent'])}")
+
+        # 2. Within the minimum interval nothing more is sent
+        original_interval = notifier.MIN_NOTIFICATION_INTERVAL_SECONDS
+        notifier.MIN_NOTIFICATION_INTERVAL_SECONDS = 300
+        self.addCleanup(setattr, notifier, 'MIN_NOTIFICATION_INTERVAL_SECONDS', original_interval)
+        for _ in range(4):
+            next_lambda.lambda_handler({'body': json.dumps({'queueId': 'Fast'})}, None)
+        self.assertEqual(self.run_scheduler()['notificationsQueued'], 0)
+
+        # 3. Once the interval has passed, the moved ticket gets its next milestone
+        self.notifications_table.update_item(
+            Key={'ticketNumber': tickets[8]},
+            UpdateExpression="SET lastNotifiedAt = :at",
+            ExpressionAttributeValues={':at': int(time.time()) - 600}
+        )
+        self.assertEqual(self.run_scheduler()['notificationsQueued'], 1)
+        record = self.notifications_table.get_item(Key={'ticketNumber': tickets[8]})['Item']
+        self.assertEqual(record['lastNotifiedPosition'], 4)
+        print("   Success: milestones coalesced and rate limited.")
+
+    def test_scheduler_skips_queues_that_have_not_moved(self):
+        print("\n--- TESTING PROGRESS WATERMARK ---")
+
+        from join_queue import lambda_function as join_lambda
+        from staff_next import lambda_function as next_lambda
+        from staff_complete import lambda_function as complete_lambda
+        from queue_common import eta
+
+        self.stats_table.put_item(Item={'queueId': 'Busy', 'notification_thresholds': '5,3'})
+        busy = []
+        for i in range(8):
+            resp = join_lambda.lambda_handler({'body': json.dumps({'email': f"b{i}@test.com", 'queueId': 'Busy'})}, None)
+            busy.append(json.loads(resp['body'])['ticketNumber'])
+        join_lambda.lambda_handler({'body': json.dumps({'email': "idle@test.com", 'queueId': 'Idle'})}, None)
+        self.register_joined_tickets()
+
+        # 1. First run evaluates both queues and records their watermarks
+        body = self.run_scheduler()
+        self.assertEqual(body['queuesDispatched'], 2)
+
+        # 2. Nothing moved: both queues are skipped without reading a ticket
+        body = self.run_scheduler()
+        self.assertEqual((body['queuesDispatched'], body['queuesSkipped']), (0, 2))
+        self.assertEqual(body['ticketsProcessed'], 0)
+
+        # 3. One served, one removed from the line: only Busy is evaluated,
+        #    and only the positions that could have crossed 5 or 3
+        next_lambda.lambda_handler({'body': json.dumps({'queueId': 'Busy'})}, None)
+        complete_lambda.lambda_handler({'body': json.dumps({'queueId': 'Busy', 'ticketNumber': busy[7]})}, None)
+        stats = self.stats_table.get_item(Key={'queueId': 'Busy'})['Item']
+        self.assertEqual(stats['departures'], 2)
+
+        body = self.run_scheduler()
+        print(f"   Dispatched {body['queuesDispatched']}, checked {body['ticketsProcessed']} tickets (Expected: 1, 4)")
+        self.assertEqual((body['queuesDispatched'], body['queuesSkipped']), (1, 1))
+        self.assertEqual(body['ticketsProcessed'], 4)  # positions 2, 3, 4, 5
+        self.assertEqual(body['notificationsQueued'], 2)  # crossed 3 and 5
+
+        # 4. Old ETAs are only refreshed for queues with someone still waiting
+        next_lambda.lambda_handler({'body': json.dumps({'queueId': 'Idle'})}, None)
+        self.run_scheduler()
+        for queue_id in ('Busy', 'Idle'):
+            self.stats_table.update_item(
+                Key={'queueId': queue_id},
+                UpdateExpression="SET etaRefreshedAt = :old",
+                ExpressionAttributeValues={':old': int(time.time()) - eta.ETA_MAX_AGE_SECONDS}
+            )
+        body = self.run_scheduler()
+        self.assertEqual((body['queuesDispatched'], body['queuesSkipped']), (1, 1))
+        body = self.run_scheduler()
+        self.assertEqual((body['queuesDispatched'], body['queuesSkipped']), (0, 2))
+        print("   Success: idle queues skipped, only moved positions checked.")
+
+    def test_unconfirmed_recipients_are_skipped(self):
+        print("\n--- TESTING SUBSCRIPTION CONFIRMATION SYNC ---")
+
+        from join_queue import lambda_function as join_lambda
+        from queue_events import lambda_function as events_lambda
+        from sync_subscriptions import lambda_function as sync_lambda
+        from queue_common import channels, notifier
+
+        tickets = []
+        for i in range(3):
+            resp = join_lambda.lambda_handler({'body': json.dumps({'email': f"u{i}@test.com", 'queueId': 'Confirm'})}, None)
+            tickets.append(json.loads(resp['body'])['ticketNumber'])
+        items = self.entries_table.scan()['Items']
+        events_lambda.update_recipients([stream_record('INSERT', new_image=item) for item in items])
+
+        # 1. Only the first customer has clicked the link (local stand-in for SNS)
+        first_arn = self.notifications_table.get_item(Key={'ticketNumber': tickets[0]})['Item']['subscriptionArn']
+        original_listing = channels.confirmed_subscription_arns
+        channels.confirmed_subscription_arns = lambda: {first_arn}
+        self.addCleanup(setattr, channels, 'confirmed_subscription_arns', original_listing)
+
+        body = json.loads(sync_lambda.lambda_handler({}, None)['body'])
+        self.assertEqual(body['subscriptionsConfirmed'], 1)
+        body = self.run_scheduler()
+        print(f"   Sent {body['notificationsQueued']} of 3 (Expected: 1)")
+        self.assertEqual(body['notificationsQueued'], 1)
+
+        # 2. The others confirm: the queue is re-evaluated although nobody moved
+        channels.confirmed_subscription_arns = original_listing
+        body = json.loads(sync_lambda.lambda_handler({}, None)['body'])
+        self.assertEqual(body['subscriptionsConfirmed'], 2)
+        body = self.run_scheduler()
+        self.assertEqual(body['notificationsQueued'], 2)
+
+        confirmed = self.notifications_table.get_item(Key={'ticketNumber': tickets[1]})['Item']
+        self.assertNotIn('awaitingConfirmation', confirmed)
+
+        # 3. A record older than the confirmation window is no longer checked,
+        #    and with nothing left to sync there is no SNS listing at all
+        resp = join_lambda.lambda_handler({'body': json.dumps({'email': "late@test.com", 'queueId': 'Confirm'})}, None)
+        late = json.loads(resp['body'])['ticketNumber']
+        events_lambda.update_recipients([stream_record('INSERT', new_image=self.entries_table.get_item(Key={'queueId': 'Confirm', 'ticketNumber': late})['Item'])])
+        self.notifications_table.update_item(
+            Key={'ticketNumber': late},
+            UpdateExpression="SET registeredAt = :old",
+            ExpressionAttributeValues={':old': int(time.time()) - notifier.CONFIRMATION_WINDOW_SECONDS - 60}
+        )
+        channels.confirmed_subscription_arns = lambda: self.fail("listed the topic with nothing to confirm")
+        body = json.loads(sync_lambda.lambda_handler({}, None)['body'])
+        self.assertEqual(body['subscriptionsConfirmed'], 0)
+        print("   Success: unconfirmed recipients skipped until confirmed.")
+
+    def test_notification_templates_per_locale_and_queue(self):
+        print("\n--- TESTING NOTIFICATION TEMPLATES ---")
+
+        from join_queue import lambda_function as join_lambda
+        from staff_next import lambda_function as next_lambda
+        from queue_common import outbox, templates
+
+        self.stats_table.put_item(Item={'queueId': 'Madrid', 'notification_locale': 'es'})
+        self.stats_table.put_item(Item={'queueId': 'Custom', 'notification_templates': {
+            'update': {'subject': 'Now #{position}', 'message': '{ticket_number} is #{position}, ~{estimated_wait} min'},
+            'almost': {'subject': 'Bad {unknown}', 'message': 'x'}
+        }})
+        self.stats_table.put_item(Item={'queueId': 'Broken', 'notification_templates': {
+            'front_of_line': {'subject': 'Go {0}', 'message': 'x'},
+            'almost': {'subject': 'Near {position.x}', 'message': 'x'},
+            'update': {'subject': '#{position}', 'message': '~{estimated_wait:d} min'}
+        }})
+
+        # 1. Locale and per-queue overrides; a broken override falls back to the built-in
+        subject, _ = templates.render('Madrid', templates.ALMOST, 'T1', position=2, estimated_wait=10)
+        self.assertEqual(subject, "⚠️ Actualización - ¡Es el #2!")
+        subject, message = templates.render('Custom', templates.UPDATE, 'T1', position=7, estimated_wait=35)
+        self.assertEqual((subject, message), ('Now #7', 'T1 is #7, ~35 min\n'))
+        subject, _ = templates.render('Custom', templates.ALMOST, 'T1', position=2)
+        self.assertEqual(subject, "⚠️ Position Update - You're #2!")
+
+        # Positional and attribute fields are rejected up front; a format spec
+        # that only fails on some values falls back when it does
+        subject, _ = templates.render('Broken', templates.FRONT_OF_LINE, 'T1')
+        self.assertEqual(subject, "🔔 Your Turn - Please Proceed!")
+        subject, _ = templates.render('Broken', templates.ALMOST, 'T1', position=2)
+        self.assertEqual(subject, "⚠️ Position Update - You're #2!")
+        self.assertEqual(templates.render('Broken', templates.UPDATE, 'T1', position=7, estimated_wait=35),
+                         ('#7', '~35 min\n'))
+        subject, message = templates.render('Broken', templates.UPDATE, 'T1', position=7, estimated_wait=35.5)
+        self.assertIn('35.5', message)
+        self.assertNotEqual(subject, '#7')
+
+        # 2. staff_next renders "your turn" from the same registry
+        resp = join_lambda.lambda_handler({'body': json.dumps({'email': "t@test.com", 'queueId': 'Madrid'})}, None)
+        ticket = json.loads(resp['body'])['ticketNumber']
+        self.register_joined_tickets()
+        next_lambda.lambda_handler({'body': json.dumps({'queueId': 'Madrid'})}, None)
+        entry = self.outbox_table.get_item(Key={'ticketNumber': ticket, 'milestone': outbox.YOUR_TURN_MILESTONE})['Item']
+        print(f"   Your-turn subject: {entry['subject']}")
+        self.assertEqual(entry['subject'], "🔔 ES SU TURNO - ¡Pase ahora!")
+        self.assertIn(ticket, entry['message'])
+        print("   Success: templates rendered per locale and queue.")
+
+    def test_service_time_estimator(self):
+        print("\n--- TESTING MEASURED SERVICE TIME ---")
+
+        from join_queue import lambda_function as join_lambda
+        from staff_next import lambda_function as next_lambda
+        from staff_complete import lambda_function as complete_lambda
+        from queue_common import estimator
+
+        for i in range(3):
+            join_lambda.lambda_handler({'body': json.dumps({'email': f"s{i}@test.com", 'queueId': 'Timed'})}, None)
+
+        # 1. Nothing measured yet: the staff setting is the prior
+        self.assertEqual(estimator.minutes_per_person({}, 10), (estimator.DEFAULT_MINUTES, False))
+
+        # 2. A ticket served for 10 minutes, then completed by staff
+        served = json.loads(next_lambda.lambda_handler({'body': json.dumps({'queueId': 'Timed'})}, None)['body'])['served']
+        self.assertIn('servedAt', served)
+        served_at = int(time.time()) - 600
+        self.entries_table.update_item(
+            Key={'queueId': 'Timed', 'ticketNumber': served['ticketNumber']},
+            UpdateExpression="SET servedAt = :at",
+            ExpressionAttributeValues={':at': served_at}
+        )
+        complete_lambda.lambda_handler({'body': json.dumps({'queueId': 'Timed', 'ticketNumber': served['ticketNumber']})}, None)
+
+        stats = self.stats_table.get_item(Key={'queueId': 'Timed'})['Item']
+        hour = estimator.local_hour(stats, served_at)
+        minutes, measured = estimator.minutes_per_person(stats, hour)
+        self.assertTrue(measured)
+        self.assertAlmostEqual(minutes, 10.0, delta=0.1)
+
+        # 3. A 5 minute service in the same hour: 0.2 * 5 + 0.8 * 10 = 9
+        estimator.record_service('Timed', served_at, served_at + 300)
+        stats = self.stats_table.get_item(Key={'queueId': 'Timed'})['Item']
+        minutes, _ = estimator.minutes_per_person(stats, hour)
+        print(f"   Measured {minutes} mins/person (Expected: ~9)")
+        self.assertAlmostEqual(minutes, 9.0, delta=0.1)
+
+        archived = self.archive_table.scan()['Items']
+        self.assertTrue(all('servedAt' in t and 'completedAt' in t for t in archived))
+
+        # 4. A failed measurement does not fail the completion
+        served = json.loads(next_lambda.lambda_handler({'body': json.dumps({'queueId': 'Timed'})}, None)['body'])['served']
+        original_record = estimator.record_service
+        def record_service(*args):
+            raise RuntimeError('Throttled')
+        estimator.record_service = record_service
+        self.addCleanup(setattr, estimator, 'record_service', original_record)
+        response = complete_lambda.lambda_handler({'body': json.dumps({'queueId': 'Timed', 'ticketNumber': served['ticketNumber']})}, None)
+        self.assertEqual(response['statusCode'], 200)
+        self.assertIn('Item', self.archive_table.get_item(Key={'queueId': 'Timed', 'ticketNumber': served['ticketNumber']}))
+        print("   Success: service times measured and averaged.")
+
+    def test_per_queue_timezones(self):
+        print("\n--- TESTING PER-QUEUE TIMEZONES ---")
+
+        from set_settings import lambda_function as settings_lambda
+        from queue_common import config_cache, estimator, timezones
+
+        # 2026-01-15 12:00 UTC
+        noon_utc = 1768478400
+
+        # 1. Queues without a timezone use the default zone
+        self.assertEqual(timezones.DEFAULT_TIMEZONE, 'America/New_York')
+        self.assertEqual(estimator.local_hour({}, noon_utc), 7)
+
+        # 2. Each site sets its own zone; the peak window is left alone
+        settings_lambda.lambda_handler({'body': json.dumps({'queueId': 'Madrid', 'peak_period': 'MORNING'})}, None)
+        resp = settings_lambda.lambda_handler({'body': json.dumps({'queueId': 'Madrid', 'timezone': 'Europe/Madrid'})}, None)
+        self.assertEqual(resp['statusCode'], 200)
+        self.assertEqual(json.loads(resp['body'])['details'], {'start': 8, 'end': 12})
+        settings_lambda.lambda_handler({'body': json.dumps({'queueId': 'Seattle', 'timezone': 'America/Los_Angeles'})}, None)
+        # A later peak-only update reports the zone that is actually stored
+        resp = settings_lambda.lambda_handler({'body': json.dumps({'queueId': 'Madrid', 'peak_period': 'MORNING'})}, None)
+        self.assertEqual(json.loads(resp['body'])['timezone'], 'Europe/Madrid')
+
+        madrid = config_cache.get_queue_config('Madrid')
+        self.assertEqual(madrid['config_peak_period'], 'MORNING')
+        self.assertEqual(estimator.local_hour(madrid, noon_utc), 13)
+        self.assertEqual(estimator.local_hour(config_cache.get_queue_config('Seattle'), noon_utc), 4)
+        # Summer time comes from the zone database, not a fixed offset
+        self.assertEqual(estimator.local_hour(madrid, noon_utc + 182 * 86400), 14)
+
+        # 3. Unknown zones are rejected, and fall back to the default if stored anyway
+        resp = settings_lambda.lambda_handler({'body': json.dumps({'queueId': 'Madrid', 'timezone': 'Mars/Olympus'})}, None)
+        self.assertEqual(resp['statusCode'], 400)
+        self.assertEqual(estimator.local_hour({'timezone': 'Mars/Olympus'}, noon_utc), 7)
+
+        # 4. A missing default zone is an error, never a silent UTC
+        orig_default = timezones.DEFAULT_TIMEZONE
+        timezones.DEFAULT_TIMEZONE = 'Mars/Olympus'
+        self.addCleanup(setattr, timezones, 'DEFAULT_TIMEZONE', orig_default)
+        with self.assertRaises(timezones.ZoneInfoNotFoundError):
+            estimator.local_hour({}, noon_utc)
+        print("   Success: hours follow each queue's timezone.")
+
+    def test_status_reads_precomputed_etas(self):
+        print("\n--- TESTING PRECOMPUTED ETAS ---")
+
+        from join_queue import lambda_function as join_lambda
+        from get_status import lambda_function as status_lambda
+        from queue_common import config_cache, estimator, eta
+
+        tickets = []
+        for i in range(3):
+            resp = join_lambda.lambda_handler({'body': json.dumps({'email': f"eta{i}@test.com", 'queueId': 'Eta'})}, None)
+            tickets.append(json.loads(resp['body'])['ticketNumber'])
+        bucket = f"serviceMinutesH{estimator.local_hour({}):02d}"
+
+        def status():
+            config_cache.clear()
+            event = {'pathParameters': {'queueId': 'Eta', 'ticketNumber': tickets[2]}}
+            return json.loads(status_lambda.lambda_handler(event, None)['body'])
+
+        # 1. Measured 4 mins/person, materialized off the request path
+        self.stats_table.update_item(Key={'queueId': 'Eta'}, UpdateExpression=f"SET {bucket} = :m", ExpressionAttributeValues={':m': 4})
+        eta.refresh('Eta')
+        body = status()
+        print(f"   Position {body['position']}: {body['estimatedWaitMinutes']} mins ({body['calculationMode']})")
+        self.assertEqual(body['estimatedWaitMinutes'], 8)
+        self.assertEqual(body['calculationMode'], 'measured 4 mins/person')
+
+        # 2. Polls keep reading the stored vector until the next refresh
+        self.stats_table.update_item(Key={'queueId': 'Eta'}, UpdateExpression=f"SET {bucket} = :m", ExpressionAttributeValues={':m': 10})
+        self.assertEqual(status()['estimatedWaitMinutes'], 8)
+        eta.refresh('Eta')
+        self.assertEqual(status()['estimatedWaitMinutes'], 20)
+
+        # 3. Positions past the end of the vector are extrapolated
+        config_cache.clear()
+        self.assertEqual(eta.lookup('Eta', eta.ETA_POSITIONS + 5), (eta.ETA_POSITIONS + 5) * 10)
+
+        # 4. The vectors stay off the QueueStats item every join and next writes to
+        stats = self.stats_table.get_item(Key={'queueId': 'Eta'})['Item']
+        self.assertNotIn('etaMinutes', stats)
+        self.assertIn('etaRefreshedAt', stats)
+        vectors = self.aggregates_table.get_item(Key={'aggregateId': 'Eta#eta'})['Item']
+        self.assertEqual(len(vectors['etaMinutes']), eta.ETA_POSITIONS)
+        print("   Success: status polls read the precomputed ETA vector.")
+
+    def test_percentile_etas_from_sketch(self):
+        print("\n--- TESTING PERCENTILE ETAS ---")
+
+        from join_queue import lambda_function as join_lambda
+        from get_status import lambda_function as status_lambda
+        from queue_common import config_cache, estimator, eta, sketch
+
+        tickets = []
+        for i in range(5):
+            resp = join_lambda.lambda_handler({'body': json.dumps({'email': f"p{i}@test.com", 'queueId': 'Pct'})}, None)
+            tickets.append(json.loads(resp['body'])['ticketNumber'])
+
+        # 1. Mostly 2 minute services with the odd 20 minute one
+        hour = estimator.local_hour({})
+        for minutes in [2] * 8 + [20] * 2:
+            sketch.add('Pct', hour, minutes)
+        # Completions feed the sketch for the hour they were served in
+        served_at = int(time.time()) - 3600
+        estimator.record_service('Pct', served_at, served_at + 120)
+        self.assertGreaterEqual(sum(sketch.load('Pct', estimator.local_hour({}, served_at))), 1)
+
+        # 2. Size is bounded by the bin count, and old samples decay
+        item = self.aggregates_table.get_item(Key={'aggregateId': f"Pct#sketch#{hour:02d}"})['Item']
+        self.assertLessEqual(len(item) - 2, sketch.BINS)
+        orig_decay = sketch.DECAY_SAMPLES
+        sketch.DECAY_SAMPLES = 12
+        self.addCleanup(setattr, sketch, 'DECAY_SAMPLES', orig_decay)
+        sketch.add('Pct', hour, 2)
+        sketch.add('Pct', hour, 2)
+        counts = sketch.load('Pct', hour)
+        print(f"   After decay: {sum(counts)} samples")
+        self.assertEqual(sum(counts), 6)  # ten 2s and two 20s, halved
+        for minutes in [2] * 3 + [20] * 2:
+            sketch.add('Pct', hour, minutes)
+
+        # 3. get_status reports a p50/p90 band that widens down the line. The
+        #    sample is skewed: the median service (2 mins) is well below the
+        #    mean (~7 mins, also the EWMA here), and so is the median wait
+        counts = sketch.load('Pct', hour)
+        bucket = f"serviceMinutesH{hour:02d}"
+        mean = Decimal(str(round(sketch.mean(counts), 3)))
+        self.stats_table.update_item(Key={'queueId': 'Pct'}, UpdateExpression=f"SET {bucket} = :m", ExpressionAttributeValues={':m': mean})
+        eta.refresh('Pct')
+        config_cache.clear()
+        bands = []
+        for ticket in (tickets[1], tickets[4]):
+            event = {'pathParameters': {'queueId': 'Pct', 'ticketNumber': ticket}}
+            body = json.loads(status_lambda.lambda_handler(event, None)['body'])
+            bands.append((body['position'], body['estimatedWaitMinutes'], body['waitP50Minutes'], body['waitP90Minutes']))
+        print(f"   (position, expected, p50, p90): {bands}")
+        self.assertEqual(bands[0][2], 2)
+        for position, expected, p50, p90 in bands:
+            self.assertLess(p50, expected)
+            self.assertLess(expected, p90)
+        self.assertGreater(bands[1][3] - bands[1][2], bands[0][3] - bands[0][2])
+        print("   Success: percentile ETAs from the service-time sketch.")
+
+    def test_wait_scales_with_active_counters(self):
+        print("\n--- TESTING MULTI-COUNTER WAIT MODEL ---")
+
+        from join_queue import lambda_function as join_lambda
+        from staff_next import lambda_function as next_lambda
+        from get_status import lambda_function as status_lambda
+        from queue_common import config_cache, estimator, eta
+
+        tickets = []
+        for i in range(7):
+            resp = join_lambda.lambda_handler({'body': json.dumps({'email': f"m{i}@test.com", 'queueId': 'Multi'})}, None)
+            tickets.append(json.loads(resp['body'])['ticketNumber'])
+        bucket = f"serviceMinutesH{estimator.local_hour({}):02d}"
+        self.stats_table.update_item(Key={'queueId': 'Multi'}, UpdateExpression=f"SET {bucket} = :m", ExpressionAttributeValues={':m': 6})
+
+        def status():
+            eta.refresh('Multi')
+            config_cache.clear()
+            event = {'pathParameters': {'queueId': 'Multi', 'ticketNumber': tickets[6]}}
+            return json.loads(status_lambda.lambda_handler(event, None)['body'])
+
+        # 1. Three counters each call a ticket: 3 ahead, 3 servers, 6 mins each
+        for counter in ('c1', 'c2', 'c3'):
+            next_lambda.lambda_handler({'body': json.dumps({'queueId': 'Multi', 'counterId': counter})}, None)
+        body = status()
+        print(f"   3 counters: position {body['position']}, {body['estimatedWaitMinutes']} mins ({body['calculationMode']})")
+        self.assertEqual(body['position'], 3)
+        self.assertEqual(body['estimatedWaitMinutes'], 6)
+        self.assertIn('across 3 counters', body['calculationMode'])
+
+        # 2. Two counters go quiet past their heartbeat: back to one server
+        self.aggregates_table.update_item(
+            Key={'aggregateId': 'Multi#counters'},
+            UpdateExpression="SET counter_c2 = :past, counter_c3 = :past",
+            ExpressionAttributeValues={':past': int(time.time()) - 1}
+        )
+        body = status()
+        print(f"   1 counter: {body['estimatedWaitMinutes']} mins")
+        self.assertEqual(body['estimatedWaitMinutes'], 18)
+
+        # 3. Without a counterId each signed-in staff member is a counter
+        for sub in ('5b1f0c52-0000-4000-8000-000000000001', '5b1f0c52-0000-4000-8000-000000000002'):
+            event = {
+                'body': json.dumps({'queueId': 'Multi'}),
+                'requestContext': {'authorizer': {'claims': {'sub': sub}}}
+            }
+            self.assertEqual(next_lambda.lambda_handler(event, None)['statusCode'], 200)
+        body = status()
+        print(f"   2 staff logins + c1: position {body['position']}, {body['estimatedWaitMinutes']} mins")
+        self.assertEqual(body['position'], 1)
+        self.assertIn('across 3 counters', body['calculationMode'])
+
+        # 4. Bad counterIds are rejected before anything is claimed; names
+        #    that clash with the item's key are just counters
+        for counter in ('', 'a b', 'x' * 65, 7):
+            resp = next_lambda.lambda_handler({'body': json.dumps({'queueId': 'Multi', 'counterId': counter})}, None)
+            self.assertEqual(resp['statusCode'], 400)
+        self.assertEqual(status()['position'], 1)
+        resp = next_lambda.lambda_handler({'body': json.dumps({'queueId': 'Multi', 'counterId': 'aggregateId'})}, None)
+        self.assertEqual(resp['statusCode'], 200)
+
+        # 5. A heartbeat drops the expired counters from the item
+        item = self.aggregates_table.get_item(Key={'aggregateId': 'Multi#counters'})['Item']
+        self.assertNotIn('counter_c2', item)
+        self.assertIn('counter_aggregateId', item)
+        print("   Success: ETAs follow staffing.")
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file